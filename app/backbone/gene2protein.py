@@ -15,24 +15,24 @@ from string import Template
 import structlog
 
 import app.settings as settings
+import typer
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.resources import taxonomy_lineage_fns
+from app.common.writers import open_input, open_term_writer, output_fn
+from typer import Option
 
 log = structlog.getLogger(__name__)
 
 bel_version = "2.1.1"
 
-eg_datafile = f"{settings.DATA_DIR}/namespaces/eg.jsonl.gz"
-backbone_fn = f"{settings.DATA_DIR}/backbone/eg_backbone_nanopubs.jsonl.gz"
-backbone_hmrz_fn = f"{settings.DATA_DIR}/backbone/eg_backbone_nanopubs_hmrz.jsonl.gz"
-
-hmrz_species = ["TAX:9606", "TAX:10090", "TAX:10116", "TAX:7955"]
+eg_datafile = output_fn(f"{settings.DATA_DIR}/namespaces/eg.jsonl")
+backbone_fn = output_fn(f"{settings.DATA_DIR}/backbone/eg_backbone_nanopubs.jsonl")
 
 
 def process_backbone():
 
     # count = 0
-    with gzip.open(eg_datafile, "rt") as fi, gzip.open(backbone_fn, "wt") as fo, gzip.open(
-        backbone_hmrz_fn, "wt"
-    ) as fz:
+    with open_input(eg_datafile) as fi, open_term_writer(backbone_fn) as writer:
 
         metadata = {}
         for line in fi:
@@ -73,15 +73,24 @@ def process_backbone():
                 "metadata": {"gd_status": "finalized", "nanopub_type": "backbone"},
             }
 
-            fo.write(f'{{"nanopub": {json.dumps(nanopub)}}}\n')
+            writer.write({"nanopub": nanopub}, [species_key])
+
 
-            if species_key in hmrz_species:
-                fz.write(f'{{"nanopub": {json.dumps(nanopub)}}}\n')
+def main(
+    overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
+):
 
+    build_inputs = get_build_inputs(
+        "eg_backbone",
+        [eg_datafile, *taxonomy_lineage_fns],
+        __file__,
+        config={"species_subsets": settings.SPECIES_SUBSETS},
+    )
 
-def main():
-    process_backbone()
+    if overwrite or needs_rebuild(build_inputs):
+        process_backbone()
+        save_build_inputs(build_inputs)
 
 
 if __name__ == "__main__":
-    main()
+    typer.run(main)
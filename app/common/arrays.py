@@ -0,0 +1,76 @@
+import os
+from typing import List, Mapping
+
+import numpy as np
+
+# Index directories of numpy arrays, e.g. the taxonomy lineage and gene history.  Each array is
+# saved as its own .npy file so it can be memory mapped and shared by worker processes.
+
+
+def array_fns(dirname: str, names: List[str]) -> Mapping[str, str]:
+    """Array name -> .npy filename"""
+
+    return {name: f"{dirname}/{name}.npy" for name in names}
+
+
+def save_arrays(dirname: str, names: List[str], arrays: Mapping[str, np.ndarray]):
+    """Save arrays - each file is written to a temporary file and renamed into place"""
+
+    os.makedirs(dirname, exist_ok=True)
+    for (name, fn) in array_fns(dirname, names).items():
+        with open(f"{fn}.tmp", "wb") as fo:
+            np.save(fo, arrays[name])
+        os.replace(f"{fn}.tmp", fn)
+
+
+def sorted_index(ids: np.ndarray, id: int) -> int:
+    """Position of id in sorted ids - -1 if not found"""
+
+    idx = int(np.searchsorted(ids, id))
+    if idx < len(ids) and ids[idx] == id:
+        return idx
+
+    return -1
+
+
+class MappedArrays:
+    """Memory mapped arrays of an index directory, accessed as attributes, e.g. self.ids
+
+    The arrays are mapped on first use and instances pickle as the index directory so they
+    can be passed to worker processes.
+
+    Args:
+        dirname (str): index directory
+    """
+
+    # Array names - set by subclasses
+    names: List[str] = []
+
+    def __init__(self, dirname: str):
+        self.dirname = dirname
+        self.arrays = None
+
+    def __getstate__(self):
+        return {"dirname": self.dirname}
+
+    def __setstate__(self, state):
+        self.dirname = state["dirname"]
+        self.arrays = None
+
+    def exists(self) -> bool:
+        return all(os.path.exists(fn) for fn in array_fns(self.dirname, self.names).values())
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        if name in ("dirname", "arrays") or name.startswith("__"):
+            raise AttributeError(name)
+
+        if self.arrays is None:
+            self.arrays = {
+                array_name: np.load(fn, mmap_mode="r")
+                for (array_name, fn) in array_fns(self.dirname, self.names).items()
+            }
+
+        try:
+            return self.arrays[name]
+        except KeyError:
+            raise AttributeError(name)
@@ -0,0 +1,144 @@
+import json
+import mmap
+import struct
+import zlib
+from typing import Any, Mapping, Optional, Tuple
+
+from app.common.writers import key_index_fn, loads
+
+# gzip header with the BGZF BC extra subfield holding the block size
+bgzf_header = struct.Struct("<4BI2BH2BHH")
+
+
+def read_block(fi, offset: int) -> Tuple[bytes, int]:
+    """Read and decompress the BGZF block at compressed offset
+
+    Args:
+        fi (BinaryIO): BGZF file opened for binary reading
+        offset (int): compressed offset of block
+
+    Returns:
+        Tuple[bytes, int]: uncompressed block and compressed offset of the next block
+    """
+
+    fi.seek(offset)
+    header = fi.read(bgzf_header.size)
+    if len(header) < bgzf_header.size:
+        return (b"", offset)
+
+    fields = bgzf_header.unpack(header)
+    if fields[:4] != (0x1F, 0x8B, 8, 4) or fields[8:11] != (ord("B"), ord("C"), 2):
+        raise ValueError(f"Not a BGZF block at offset {offset}")
+
+    block_size = fields[11] + 1
+    cdata = fi.read(block_size - bgzf_header.size - 8)
+
+    return (zlib.decompress(cdata, -15), offset + block_size)
+
+
+class KeyIndex:
+    """Sorted term key index sidecar of a BGZF resource file
+
+    The index is memory mapped and binary searched so opening it is instant and only the
+    pages touched by a lookup are read, even for indexes of tens of millions of terms.
+
+    Args:
+        index_fn (str): key index file, see app.common.writers.key_index_fn()
+    """
+
+    def __init__(self, index_fn: str):
+        self.fi = open(index_fn, "rb")
+        self.mm = mmap.mmap(self.fi.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self.mm.close()
+        self.fi.close()
+
+    def line_start(self, pos: int) -> int:
+        """Start of the index line containing pos"""
+
+        return self.mm.rfind(b"\n", 0, pos) + 1
+
+    def lookup(self, key: str) -> Optional[int]:
+        """Get virtual offset of the (first) term record with key - None if key isn't indexed"""
+
+        target = json.dumps(key, ensure_ascii=False)[1:-1].encode("utf-8")
+
+        # Find the first line with line key >= target
+        (low, high) = (0, len(self.mm))
+        while low < high:
+            middle = self.line_start((low + high) // 2)
+            end = self.mm.find(b"\n", middle)
+            if self.mm[middle:end].split(b"\t", 1)[0] < target:
+                low = end + 1
+            else:
+                high = middle
+
+        end = self.mm.find(b"\n", low)
+        if end == -1:
+            return None
+
+        (line_key, virtual_offset) = self.mm[low:end].split(b"\t")
+        if line_key != target:
+            return None
+
+        return int(virtual_offset)
+
+
+class IndexedResource:
+    """Random access to term records of a BGZF resource file (BELRES_OUTPUT_CODEC=bgzf)
+
+    A lookup decompresses only the block(s) holding the term record.
+
+        with IndexedResource(eg.resource_fn) as resource:
+            term = resource.get_term("EG:207")
+
+    Args:
+        resource_fn (str): BGZF resource file with its key index sidecar
+    """
+
+    def __init__(self, resource_fn: str):
+        self.fi = open(resource_fn, "rb")
+        self.index = KeyIndex(key_index_fn(resource_fn))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.index.close()
+        self.fi.close()
+
+    def read_line(self, virtual_offset: int) -> bytes:
+        """Read record line at virtual offset - continued into the following blocks if needed"""
+
+        (block, next_offset) = read_block(self.fi, virtual_offset >> 16)
+        parts = [block[virtual_offset & 0xFFFF :]]
+
+        while b"\n" not in parts[-1]:
+            (block, next_offset) = read_block(self.fi, next_offset)
+            if not block:
+                break
+            parts.append(block)
+
+        return b"".join(parts).split(b"\n", 1)[0] + b"\n"
+
+    def get_record(self, key: str) -> Optional[Mapping[str, Any]]:
+        """Get term record ({"term": {...}}) by Term.key - None if not found"""
+
+        virtual_offset = self.index.lookup(key)
+        if virtual_offset is None:
+            return None
+
+        return loads(self.read_line(virtual_offset))
+
+    def get_term(self, key: str) -> Optional[Mapping[str, Any]]:
+        """Get term by Term.key - None if not found"""
+
+        record = self.get_record(key)
+        if record is None:
+            return None
+
+        return record["term"]
@@ -0,0 +1,151 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+from typing import Any, List, Mapping
+
+import structlog
+
+import app.settings as settings
+from app.__version__ import __version__
+from app.common.resources import save_json
+
+log = structlog.get_logger()
+
+build_manifest_fn = f"{settings.DATA_DIR}/build_manifest.json"
+
+# Shared modules imported by the builders - a change to any of them changes every code_version
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+shared_code_dirs = [f"{app_dir}/common", f"{app_dir}/schemas"]
+
+
+def file_sha256(fn: str, previous: Mapping[str, Any] = None) -> Mapping[str, Any]:
+    """Get SHA-256 of file contents
+
+    Args:
+        fn (str): file to hash
+        previous (Mapping[str, Any]): previous result for this file - its sha256 is reused
+            if the file size and mtime are unchanged to avoid re-reading multi-GB files
+
+    Returns:
+        Mapping[str, Any]: sha256, size and mtime of file (sha256 is None if file doesn't exist)
+    """
+
+    if not os.path.exists(fn):
+        return {"sha256": None, "size": None, "mtime": None}
+
+    stat = os.stat(fn)
+    if previous and (previous.get("size"), previous.get("mtime")) == (stat.st_size, stat.st_mtime):
+        return previous
+
+    sha256 = hashlib.sha256()
+    with open(fn, "rb") as fi:
+        for block in iter(lambda: fi.read(1024 * 1024), b""):
+            sha256.update(block)
+
+    return {"sha256": sha256.hexdigest(), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def data_sha256(data: Any) -> str:
+    """Get SHA-256 of JSON serializable data (e.g. namespace definition)"""
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def code_sha256(code_fn: str) -> str:
+    """Get SHA-256 of the builder source file and the shared app/common and app/schemas modules"""
+
+    code_fns = [code_fn]
+    for dirname in shared_code_dirs:
+        for (root, dirs, fns) in os.walk(dirname):
+            dirs.sort()
+            code_fns.extend(os.path.join(root, fn) for fn in sorted(fns) if fn.endswith(".py"))
+
+    # Paths relative to app so the hash doesn't depend on where the code is checked out
+    sha256 = hashlib.sha256()
+    for fn in code_fns:
+        sha256.update(os.path.relpath(os.path.abspath(fn), app_dir).encode())
+        sha256.update(file_sha256(fn)["sha256"].encode())
+
+    return sha256.hexdigest()
+
+
+@contextlib.contextmanager
+def locked_manifest():
+    """Load build manifest holding an exclusive lock - builders running in parallel share the manifest"""
+
+    with open(f"{build_manifest_fn}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        manifest = {}
+        if os.path.exists(build_manifest_fn):
+            with open(build_manifest_fn, "r") as fi:
+                manifest = json.load(fi)
+
+        yield manifest
+
+
+def get_build_inputs(
+    builder: str, source_fns: List[str], code_fn: str, config: Any = None
+) -> Mapping[str, Any]:
+    """Collect the content hashes of everything a builder's output depends on
+
+    Args:
+        builder (str): builder name, e.g. eg_namespace
+        source_fns (List[str]): download files and other input files (e.g. tax_labels.json.gz)
+        code_fn (str): builder source file - use __file__ (the shared modules are included)
+        config (Any): configuration used by builder, e.g. namespaces.yml entry, TAXONOMY_LABELS
+
+    Returns:
+        Mapping[str, Any]: build inputs to check with needs_rebuild() and save with save_build_inputs()
+    """
+
+    with locked_manifest() as manifest:
+        previous_sources = manifest.get(builder, {}).get("sources", {})
+
+    sources = {fn: file_sha256(fn, previous=previous_sources.get(fn)) for fn in source_fns}
+
+    return {
+        "builder": builder,
+        "sources": sources,
+        "code_version": f"{__version__} {code_sha256(code_fn)}",
+        "config": data_sha256(config),
+    }
+
+
+def needs_rebuild(build_inputs: Mapping[str, Any]) -> bool:
+    """Has any source file, the builder code or its configuration changed since the last build?"""
+
+    with locked_manifest() as manifest:
+        previous = manifest.get(build_inputs["builder"])
+
+    if not previous:
+        log.info("No previous build found", builder=build_inputs["builder"])
+        return True
+
+    changed = [
+        fn
+        for fn in build_inputs["sources"]
+        if build_inputs["sources"][fn]["sha256"]
+        != previous["sources"].get(fn, {}).get("sha256")
+    ]
+    if build_inputs["code_version"] != previous["code_version"]:
+        changed.append("code_version")
+    if build_inputs["config"] != previous["config"]:
+        changed.append("config")
+
+    if changed:
+        log.info("Build inputs changed", builder=build_inputs["builder"], changed=changed)
+        return True
+
+    log.info("Build inputs unchanged - skipping build", builder=build_inputs["builder"])
+    return False
+
+
+def save_build_inputs(build_inputs: Mapping[str, Any]):
+    """Record build inputs in the build manifest after a successful build"""
+
+    with locked_manifest() as manifest:
+        manifest[build_inputs["builder"]] = build_inputs
+        save_json(build_manifest_fn, manifest)
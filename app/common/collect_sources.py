@@ -1,13 +1,22 @@
+import concurrent.futures
+import contextlib
 import datetime
+import fcntl
 import ftplib
 import gzip
+import http.client
+import itertools
+import json
 import os
 import pathlib
 import re
 import shutil
+import threading
+import time
+import urllib.error
 import urllib.request
 from pathlib import Path
-from typing import Any, Mapping, Tuple
+from typing import Any, BinaryIO, Callable, Iterable, List, Mapping, Tuple
 from urllib.parse import urlparse
 
 import requests
@@ -16,10 +25,14 @@ import yaml
 from dateutil import parser
 
 import app.settings as settings
+from app.common.resources import save_json
 from app.common.text import timestamp_to_date
 
 log = structlog.get_logger()
 
+# ETag/Last-Modified of downloaded web files by url - used for conditional GET freshness checks
+validators_fn = f"{settings.DOWNLOAD_DIR}/download_validators.json"
+
 
 def file_newer(check_file: str, base_file: str) -> bool:
     """Is check_file newer than base_file?
@@ -40,11 +53,266 @@ def file_newer(check_file: str, base_file: str) -> bool:
     return cf_modtime_ts > bf_modtime_ts
 
 
+def deterministic_gzip_open(fn: str, mode: str = "wb") -> gzip.GzipFile:
+    """Open gzip file for writing without a timestamp in the gzip header
+
+    Identical content always gives an identical file so the build manifest content
+    hashes only change when the downloaded content changes
+    """
+
+    return gzip.GzipFile(fn, mode, mtime=0)
+
+
+class BandwidthLimiter:
+    """Token bucket shared by concurrent downloads to keep their total rate under a ceiling
+
+    Args:
+        max_bytes_per_sec (int): bandwidth ceiling - 0 for unlimited
+    """
+
+    def __init__(self, max_bytes_per_sec: int = 0):
+        self.rate = max_bytes_per_sec
+        self.tokens = max_bytes_per_sec
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes: int):
+        """Account for nbytes downloaded - sleeps while the ceiling is exceeded"""
+
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+@contextlib.contextmanager
+def locked_validators():
+    """Load download validators holding an exclusive lock - downloads run concurrently"""
+
+    with open(f"{validators_fn}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        validators = {}
+        if os.path.exists(validators_fn):
+            with open(validators_fn, "r") as fi:
+                validators = json.load(fi)
+
+        yield validators
+
+
+def get_validators(url: str) -> Mapping[str, str]:
+    """Get ETag/Last-Modified saved for url when it was last downloaded"""
+
+    with locked_validators() as validators:
+        return validators.get(url, {})
+
+
+def save_validators(url: str, url_validators: Mapping[str, str]):
+    """Save ETag/Last-Modified for url after downloading it"""
+
+    with locked_validators() as validators:
+        validators[url] = {key: val for (key, val) in url_validators.items() if val}
+        save_json(validators_fn, validators)
+
+
+# Errors worth retrying a download for - permanent FTP/HTTP errors are re-raised straight away
+download_errors = ftplib.all_errors + (http.client.HTTPException,)
+
+
+def partial_download_fns(download_fn: str) -> Tuple[str, str]:
+    """Partial download file (raw remote bytes) and its progress file for download_fn"""
+
+    return (f"{download_fn}.partial", f"{download_fn}.partial.json")
+
+
+def load_download_progress(download_fn: str) -> Mapping[str, Any]:
+    """Get url and remote file version of the partial download of download_fn"""
+
+    (partial_fn, progress_fn) = partial_download_fns(download_fn)
+    if not (os.path.exists(partial_fn) and os.path.exists(progress_fn)):
+        return {}
+
+    with open(progress_fn, "r") as fi:
+        return json.load(fi)
+
+
+def retry_download(attempt: Callable[[], Any], url: str) -> Any:
+    """Run download attempt, retrying with exponential backoff on transient errors
+
+    Each attempt resumes from the partial download left by the previous attempt.
+    """
+
+    for retry in itertools.count():
+        try:
+            return attempt()
+
+        except download_errors as e:
+            permanent = isinstance(e, ftplib.error_perm) or (
+                isinstance(e, urllib.error.HTTPError) and e.code < 500
+            )
+            if permanent or retry >= settings.DOWNLOAD_RETRIES:
+                raise
+
+            wait = min(settings.DOWNLOAD_RETRY_BACKOFF * 2 ** retry, 300)
+            log.warning("Download failed - retrying", url=url, error=str(e), retry=retry + 1, wait=wait)
+            time.sleep(wait)
+
+
+def finish_download(download_fn: str, compress: bool):
+    """Move completed partial download into place - compressing it if the source isn't gzipped"""
+
+    (partial_fn, progress_fn) = partial_download_fns(download_fn)
+
+    if compress:
+        tmp_fn = f"{download_fn}.tmp"
+        with open(partial_fn, "rb") as fi, deterministic_gzip_open(tmp_fn, "wb") as fo:
+            shutil.copyfileobj(fi, fo, 1024 * 1024)
+        os.replace(tmp_fn, download_fn)
+        os.remove(partial_fn)
+    else:
+        os.replace(partial_fn, download_fn)
+
+    os.remove(progress_fn)
+
+
+def write_blocks(blocks: Iterable[bytes], fo: BinaryIO, limiter: BandwidthLimiter = None) -> int:
+    """Write downloaded blocks to partial download file - returns number of bytes written"""
+
+    size = 0
+    for block in blocks:
+        if limiter:
+            limiter.consume(len(block))
+        fo.write(block)
+        size += len(block)
+
+    return size
+
+
+def retrieve_web_file(url: str, download_fn: str, compress: bool, limiter: BandwidthLimiter = None):
+    """Download url to download_fn via a .partial file resumed with HTTP Range requests
+
+    A partial download is only resumed if the server confirms (If-Range) that the remote
+    file still matches the ETag/Last-Modified saved when the download was started.
+    """
+
+    (partial_fn, progress_fn) = partial_download_fns(download_fn)
+
+    def attempt():
+        progress = load_download_progress(download_fn)
+
+        headers = {}
+        offset = 0
+        if progress.get("url") == url and progress.get("version"):
+            offset = os.path.getsize(partial_fn)
+            headers = {"Range": f"bytes={offset}-", "If-Range": progress["version"]}
+
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            response = urllib.request.urlopen(request, timeout=settings.DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if not (offset and e.code == 416):
+                raise
+
+            # Range not satisfiable - the partial download is already complete if it has the
+            # full remote size (e.g. interrupted before finish_download), else start over
+            total = re.match(r"bytes \*/(\d+)$", e.headers.get("Content-Range") or "")
+            if total and int(total.group(1)) == offset:
+                log.info("Partial download already complete", url=url, size=offset)
+                return
+
+            log.info("Partial download can't be resumed - restarting download", url=url)
+            os.remove(progress_fn)
+            return attempt()
+
+        with response:
+            if offset and response.status != 206:
+                log.info("Remote file changed - restarting download", url=url)
+                offset = 0
+
+            if not offset:
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                # weak ETags can't be used with If-Range
+                version = etag if etag and not etag.startswith("W/") else last_modified
+                validators = {"etag": etag, "last_modified": last_modified}
+                save_json(progress_fn, {"url": url, "version": version, "validators": validators})
+            else:
+                log.info("Resuming download", url=url, offset=offset)
+
+            with open(partial_fn, "ab" if offset else "wb") as fo:
+                size = write_blocks(iter(lambda: response.read(1024 * 1024), b""), fo, limiter)
+
+            # response.read() returns b"" rather than raising if the connection drops
+            expected = response.headers.get("Content-Length")
+            if expected and size < int(expected):
+                raise http.client.IncompleteRead(b"", int(expected) - size)
+
+    retry_download(attempt, url)
+
+    validators = load_download_progress(download_fn).get("validators", {})
+    finish_download(download_fn, compress)
+    save_validators(url, validators)
+
+
+def retrieve_ftp_file(
+    url: str, download_fn: str, version: str, compress: bool, limiter: BandwidthLimiter = None
+):
+    """Download url to download_fn via a .partial file resumed with FTP REST
+
+    Args:
+        url (str): ftp url
+        download_fn (str): local filename
+        version (str): remote file MDTM timestamp - partial downloads of other versions are discarded
+        compress (bool): gzip the download (remote file isn't gzipped)
+        limiter (BandwidthLimiter): shared bandwidth ceiling for concurrent downloads
+    """
+
+    p = urlparse(url)
+    path_obj = pathlib.Path(p.path)
+    (partial_fn, progress_fn) = partial_download_fns(download_fn)
+
+    def attempt():
+        progress = load_download_progress(download_fn)
+
+        offset = 0
+        if progress.get("url") == url and progress.get("version") == version:
+            offset = os.path.getsize(partial_fn)
+            log.info("Resuming download", url=url, offset=offset)
+        else:
+            save_json(progress_fn, {"url": url, "version": version})
+
+        ftp = ftplib.FTP(host=p.hostname, timeout=settings.DOWNLOAD_TIMEOUT)
+        try:
+            ftp.login()
+            ftp.cwd(str(path_obj.parent))
+
+            with open(partial_fn, "ab" if offset else "wb") as fo:
+                ftp.retrbinary(
+                    f"RETR {path_obj.name}",
+                    lambda block: write_blocks([block], fo, limiter),
+                    rest=offset or None,
+                )
+        finally:
+            ftp.close()
+
+    retry_download(attempt, url)
+    finish_download(download_fn, compress)
+
+
 def get_web_file(
     url: str,
     download_fn: str,
     days_old: int = settings.UPDATE_CYCLE_DAYS,
     force_download: bool = False,
+    limiter: BandwidthLimiter = None,
 ) -> Tuple[bool, str]:
     """ Get Web file only if last modified header is more than given days_old or if local file older than remote file
 
@@ -53,6 +321,7 @@ def get_web_file(
         lfile (str): local file path
         days_old (int): how many days old local file is before re-downloading
         force (boolean): whether to force downloading file even if it's not newer than already downloaded file
+        limiter (BandwidthLimiter): shared bandwidth ceiling for concurrent downloads
 
     Returns:
         (boolean, str): tuple with success for get and a message with result information
@@ -68,15 +337,35 @@ def get_web_file(
         need_download = True
     else:  # local file exists AND not forced, so check the remote counterpart for their last modified time and compare
         try:
-            r = requests.get(url)
-            last_modified = r.headers.get("Last-Modified", False)
-            if last_modified:
-                rmod_date_parsed = parser.parse(last_modified)
-                rmod_date_local = rmod_date_parsed.replace(tzinfo=datetime.timezone.utc).astimezone(
-                    tz=None
-                )
-                rmod_date = rmod_date_local.strftime("%Y%m%d")
-        except requests.ConnectionError:
+            # Conditional GET using the validators of the previous download - 304 has no body
+            validators = get_validators(url)
+            if validators:
+                headers = {}
+                if validators.get("etag"):
+                    headers["If-None-Match"] = validators["etag"]
+                if validators.get("last_modified"):
+                    headers["If-Modified-Since"] = validators["last_modified"]
+
+                with requests.get(
+                    url, headers=headers, stream=True, timeout=settings.DOWNLOAD_TIMEOUT
+                ) as r:
+                    if r.status_code == 304:
+                        msg = f"No download needed; remote file not modified since {download_fn} was downloaded."
+                        return False, msg
+                    elif r.ok:
+                        need_download = True
+
+            # No validators saved yet - only fetch the headers
+            else:
+                r = requests.head(url, allow_redirects=True, timeout=settings.DOWNLOAD_TIMEOUT)
+                last_modified = r.headers.get("Last-Modified", False)
+                if last_modified:
+                    rmod_date_parsed = parser.parse(last_modified)
+                    rmod_date_local = rmod_date_parsed.replace(
+                        tzinfo=datetime.timezone.utc
+                    ).astimezone(tz=None)
+                    rmod_date = rmod_date_local.strftime("%Y%m%d")
+        except requests.RequestException:
             log.warning("Cannot connect to the given URL.")
         finally:
             local_file_mtime_ts = os.path.getmtime(download_fn)
@@ -101,13 +390,8 @@ def get_web_file(
 
     if need_download:
 
-        if not re.search("\.gz$", url):
-            file_open_fn = gzip.open
-        else:
-            file_open_fn = open
-
-        with urllib.request.urlopen(url) as response, file_open_fn(download_fn, "wb") as out_file:
-            shutil.copyfileobj(response, out_file)
+        compress = not re.search("\.gz$", url)
+        retrieve_web_file(url, download_fn, compress, limiter=limiter)
 
         msg = f"Remote file downloaded as {download_fn}."
         return True, msg
@@ -121,6 +405,7 @@ def get_ftp_file(
     download_fn: str,
     days_old: int = settings.UPDATE_CYCLE_DAYS,
     force_download: bool = False,
+    limiter: BandwidthLimiter = None,
 ) -> Tuple[bool, str]:
     """Get FTP file only if newer than already downloaded file
 
@@ -129,6 +414,7 @@ def get_ftp_file(
         download_fn: local filename of remote source data file
         days_old (int): how many days old local file is before re-downloading - only used if can't determine remote file mod date
         force_download (bool): whether to force downloading file even if it's not newer than already downloaded file
+        limiter (BandwidthLimiter): shared bandwidth ceiling for concurrent downloads
 
     Returns:
         (changed, msg): tuple download filename and whether the file has been changed vs previous download
@@ -153,7 +439,7 @@ def get_ftp_file(
     # Only download file if it's newer than what is saved
     rmod_date = "19010101"
 
-    ftp = ftplib.FTP(host=host)
+    ftp = ftplib.FTP(host=host, timeout=settings.DOWNLOAD_TIMEOUT)
     try:
         ftp.login()
 
@@ -163,6 +449,7 @@ def get_ftp_file(
         if (
             reply_code == 213
         ):  # 213 code denotes a successful usage of MDTM, and is followed by the timestamp
+            remote_mod_timestamp = reply[1]
             remote_mod_date = reply[1][
                 :8
             ]  # we only need the first 8 digits of timestamp: YYYYMMDD - discard HHMMSS
@@ -171,18 +458,9 @@ def get_ftp_file(
             changed = False
             return (changed, "Remote file is not newer than local file")
 
-        if compress_flag:
-            file_open_fn = gzip.open
-        else:
-            file_open_fn = open
-
         # Retrieve and save file
-        if compress_flag:
-            with gzip.open(download_fn, "wb") as f:
-                ftp.retrbinary(f"RETR {filename}", f.write)
-        else:
-            with open(download_fn, "wb") as f:
-                ftp.retrbinary(f"RETR {filename}", f.write)
+        ftp.close()  # retrieve_ftp_file() uses its own connection(s)
+        retrieve_ftp_file(url, download_fn, remote_mod_timestamp, compress_flag, limiter=limiter)
 
         msg = "Downloaded file"
         changed = True
@@ -204,7 +482,132 @@ def get_ftp_file(
             return (changed, msg)
 
     finally:
-        ftp.quit()
+        ftp.close()
+
+
+def get_source_file(
+    url: str, download_fn: str, force_download: bool = False, limiter: BandwidthLimiter = None
+) -> Tuple[bool, str]:
+    """Get source data file with get_ftp_file() or get_web_file() depending on the url scheme"""
+
+    if urlparse(url).scheme == "ftp":
+        return get_ftp_file(url, download_fn, force_download=force_download, limiter=limiter)
+
+    return get_web_file(url, download_fn, force_download=force_download, limiter=limiter)
+
+
+class DownloadScheduler:
+    """Download source data files concurrently
+
+    Downloads run in a thread pool with at most settings.DOWNLOAD_HOST_LIMITS concurrent
+    downloads per host and a shared settings.DOWNLOAD_MAX_BYTES_PER_SEC bandwidth ceiling.
+    Each download_fn is only downloaded once - submitting it again returns the same future.
+
+    Args:
+        workers (int): number of download threads
+        host_limits (Mapping[str, int]): maximum concurrent downloads by host
+        default_host_limit (int): maximum concurrent downloads for hosts not in host_limits
+        max_bytes_per_sec (int): total bandwidth ceiling for all downloads - 0 for unlimited
+    """
+
+    def __init__(
+        self,
+        workers: int = settings.DOWNLOAD_WORKERS,
+        host_limits: Mapping[str, int] = settings.DOWNLOAD_HOST_LIMITS,
+        default_host_limit: int = settings.DOWNLOAD_DEFAULT_HOST_LIMIT,
+        max_bytes_per_sec: int = settings.DOWNLOAD_MAX_BYTES_PER_SEC,
+    ):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="download"
+        )
+        self.host_limits = host_limits
+        self.default_host_limit = default_host_limit
+        self.limiter = BandwidthLimiter(max_bytes_per_sec)
+
+        self.lock = threading.Lock()
+        self.host_semaphores = {}
+        self.futures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def host_semaphore(self, url: str) -> threading.Semaphore:
+        """Semaphore capping concurrent downloads from the url host"""
+
+        host = urlparse(url).hostname
+        with self.lock:
+            if host not in self.host_semaphores:
+                limit = self.host_limits.get(host, self.default_host_limit)
+                self.host_semaphores[host] = threading.BoundedSemaphore(limit)
+
+            return self.host_semaphores[host]
+
+    def download(self, url: str, download_fn: str, force_download: bool = False) -> Tuple[bool, str]:
+        """Download file holding its host slot - runs in a download thread"""
+
+        with self.host_semaphore(url):
+            start = time.time()
+            (changed, msg) = get_source_file(
+                url, download_fn, force_download=force_download, limiter=self.limiter
+            )
+
+        log.info(
+            "Collect download file",
+            url=url,
+            result=msg,
+            changed=changed,
+            wall_time=round(time.time() - start, 1),
+        )
+
+        return (changed, msg)
+
+    def submit(
+        self, url: str, download_fn: str, force_download: bool = False
+    ) -> concurrent.futures.Future:
+        """Schedule download of url to download_fn"""
+
+        with self.lock:
+            if download_fn not in self.futures:
+                self.futures[download_fn] = self.executor.submit(
+                    self.download, url, download_fn, force_download
+                )
+
+            return self.futures[download_fn]
+
+    def submit_sources(
+        self, sources: Iterable[Tuple[str, str]], force_download: bool = False
+    ) -> List[concurrent.futures.Future]:
+        """Schedule downloads of builder sources - list of (url, download_fn)"""
+
+        return [
+            self.submit(url, download_fn, force_download=force_download)
+            for (url, download_fn) in sources
+        ]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def download_sources(
+    sources: Iterable[Tuple[str, str]], force_download: bool = False
+) -> List[Tuple[bool, str]]:
+    """Download builder source files concurrently
+
+    Args:
+        sources (Iterable[Tuple[str, str]]): (url, download_fn) for each source file
+        force_download (bool): download files even if they are not newer than the local files
+
+    Returns:
+        List[Tuple[bool, str]]: (changed, msg) for each source file
+    """
+
+    with DownloadScheduler() as scheduler:
+        futures = scheduler.submit_sources(sources, force_download=force_download)
+
+        return [future.result() for future in futures]
 
 
 def get_chembl_version(url) -> str:
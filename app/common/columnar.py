@@ -0,0 +1,140 @@
+import itertools
+import json
+import os
+import re
+from typing import Any, List, Mapping
+
+import structlog
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - only needed for Parquet export
+    pyarrow = None
+
+import app.settings as settings
+from app.common.parallel import chunked
+from app.common.writers import loads, open_input
+from app.schemas.main import Term
+
+log = structlog.get_logger()
+
+# Low cardinality columns - stored as Arrow dictionary arrays (repeated strings are stored once),
+# list columns as lists of dictionary encoded strings
+dictionary_columns = ["namespace", "species_key", "species_label", "entity_types"]
+
+
+def parquet_fn(resource_fn: str) -> str:
+    """Parquet filename for namespace resource file, e.g. eg.jsonl.gz -> eg.parquet"""
+
+    return re.sub(r"\.jsonl(\.\w+)?$", ".parquet", resource_fn)
+
+
+def term_schema() -> "pyarrow.Schema":
+    """Arrow schema of the Term model - list fields are list<string> columns"""
+
+    fields = []
+    for (name, field) in Term.__fields__.items():
+        arrow_type = pyarrow.string()
+        if name in dictionary_columns:
+            arrow_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        if field.outer_type_ is not field.type_:  # List[...]
+            arrow_type = pyarrow.list_(arrow_type)
+        fields.append(pyarrow.field(name, arrow_type))
+
+    return pyarrow.schema(fields)
+
+
+def dictionary_list_array(values: List[Any]) -> "pyarrow.ListArray":
+    """Convert lists of strings into a list<dictionary<int32, string>> array"""
+
+    # A null offset makes that list null
+    (offsets, flat) = ([], [])
+    for value in values:
+        offsets.append(None if value is None else len(flat))
+        flat.extend(value or [])
+    offsets.append(len(flat))
+
+    return pyarrow.ListArray.from_arrays(
+        pyarrow.array(offsets, pyarrow.int32()),
+        pyarrow.array(flat, pyarrow.string()).dictionary_encode(),
+    )
+
+
+def terms_table(terms: List[Mapping[str, Any]], schema: "pyarrow.Schema") -> "pyarrow.Table":
+    """Convert term dicts into an Arrow table with the term schema"""
+
+    arrays = []
+    for field in schema:
+        values = [term.get(field.name) for term in terms]
+        if pyarrow.types.is_dictionary(field.type):
+            arrays.append(pyarrow.array(values, pyarrow.string()).dictionary_encode())
+        elif pyarrow.types.is_list(field.type) and pyarrow.types.is_dictionary(
+            field.type.value_type
+        ):
+            arrays.append(dictionary_list_array(values))
+        else:
+            arrays.append(pyarrow.array(values, field.type))
+
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(
+    resource_fn: str, row_group_size: int = settings.PARQUET_ROW_GROUP_SIZE, force: bool = False
+) -> str:
+    """Write namespace terms as a Parquet file alongside the JSONL resource file
+
+    Each row group holds row_group_size terms so readers can skip row groups using the column
+    statistics (e.g. species_key = "TAX:9606") and only read the columns they need.  The namespace
+    metadata record is saved as the "metadata" key of the Parquet schema metadata.
+
+    Args:
+        resource_fn (str): namespace JSONL resource file
+        row_group_size (int): terms per row group
+        force (bool): rewrite Parquet file even if it is newer than the resource file
+
+    Returns:
+        str: Parquet filename
+    """
+
+    if pyarrow is None:
+        raise ImportError("Parquet export requires the pyarrow package")
+
+    fn = parquet_fn(resource_fn)
+    if (
+        not force
+        and os.path.exists(fn)
+        and os.path.getmtime(fn) >= os.path.getmtime(resource_fn)
+    ):
+        log.info("Parquet file is up to date", parquet_fn=fn)
+        return fn
+
+    schema = term_schema()
+    count = 0
+
+    with open_input(resource_fn, "rb") as fi:
+        records = (loads(line) for line in fi)
+
+        # Metadata record is the first line of the resource file
+        first = next(records, {})
+        if "metadata" in first:
+            schema = schema.with_metadata({"metadata": json.dumps(first["metadata"])})
+        else:
+            records = itertools.chain([first], records)
+
+        writer = pyarrow.parquet.ParquetWriter(
+            f"{fn}.tmp", schema, compression=settings.PARQUET_COMPRESSION
+        )
+        try:
+            terms = (record["term"] for record in records if "term" in record)
+            for chunk in chunked(terms, row_group_size):
+                writer.write_table(terms_table(chunk, schema), row_group_size=row_group_size)
+                count += len(chunk)
+        finally:
+            writer.close()
+
+    os.replace(f"{fn}.tmp", fn)
+
+    log.info("Wrote namespace Parquet file", parquet_fn=fn, terms=count)
+
+    return fn
@@ -0,0 +1,184 @@
+import contextlib
+import gzip
+import json
+import os
+import re
+import tempfile
+import zlib
+from typing import Mapping, Optional
+
+import structlog
+
+from app.common.writers import TermWriter, open_input, open_output
+
+log = structlog.get_logger()
+
+# Term.key is the first field of every term record, so it can be pulled out without parsing the line
+term_key_regex = re.compile(r'^\{"term":\s*\{"key":\s*"((?:[^"\\]|\\.)*)"')
+
+
+def previous_release_fn(resource_fn: str) -> str:
+    """Filename used to hold the previous release while the namespace is rebuilt"""
+
+    return re.sub(r"\.jsonl(\.\w+)?$", r".previous.jsonl\1", resource_fn)
+
+
+def delta_release_fn(resource_fn: str) -> str:
+    """Delta filename for namespace resource file, e.g. eg.jsonl.gz -> eg.delta.jsonl.gz"""
+
+    return re.sub(r"\.jsonl(\.\w+)?$", r".delta.jsonl\1", resource_fn)
+
+
+def get_term_key(line: str) -> Optional[str]:
+    """Get Term.key from JSONL term record line - None for metadata records"""
+
+    match = term_key_regex.match(line)
+    if match:
+        return json.loads(f'"{match.group(1)}"')
+
+    record = json.loads(line)
+    if "term" in record:
+        return record["term"]["key"]
+
+    return None
+
+
+def partition_terms(fn: str, tmpdir: str, prefix: str, partitions: int) -> Optional[dict]:
+    """Split term records into partition files by hash of Term.key
+
+    Args:
+        fn (str): namespace JSONL file
+        tmpdir (str): directory for partition files
+        prefix (str): partition filename prefix
+        partitions (int): number of partitions
+
+    Returns:
+        Optional[dict]: namespace metadata record of file
+    """
+
+    metadata = None
+    partition_files = [
+        gzip.open(f"{tmpdir}/{prefix}-{idx}.jsonl.gz", "wt", compresslevel=1)
+        for idx in range(partitions)
+    ]
+
+    with open_input(fn) as fi:
+        for line in fi:
+            key = get_term_key(line)
+            if key is None:
+                metadata = json.loads(line).get("metadata", metadata)
+                continue
+
+            partition_files[zlib.crc32(key.encode("utf-8")) % partitions].write(line)
+
+    for partition_file in partition_files:
+        partition_file.close()
+
+    return metadata
+
+
+def write_delta(
+    previous_fn: str, current_fn: str, delta_fn: str, partitions: int = 64
+) -> Mapping[str, int]:
+    """Write added/removed/modified term records between two releases of a namespace
+
+    This is a partitioned hash join - both releases are split into partitions on disk by
+    Term.key hash and only one partition of the previous release is held in memory at a time.
+
+    Args:
+        previous_fn (str): previous namespace JSONL file
+        current_fn (str): current namespace JSONL file
+        delta_fn (str): delta JSONL file to write
+        partitions (int): number of partitions - raise for very large namespaces
+
+    Returns:
+        Mapping[str, int]: counts of added, removed and modified terms
+    """
+
+    counts = {"added": 0, "removed": 0, "modified": 0}
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(delta_fn)) as tmpdir:
+
+        previous_metadata = partition_terms(previous_fn, tmpdir, "previous", partitions)
+        current_metadata = partition_terms(current_fn, tmpdir, "current", partitions)
+
+        with open_output(delta_fn) as fo:
+
+            writer = TermWriter(fo)
+
+            metadata = dict(current_metadata or {})
+            metadata["delta_from_version"] = (previous_metadata or {}).get("version", "")
+            writer.write_metadata(metadata)
+
+            for idx in range(partitions):
+                previous = {}
+                with gzip.open(f"{tmpdir}/previous-{idx}.jsonl.gz", "rt") as fi:
+                    for line in fi:
+                        previous[get_term_key(line)] = line
+
+                with gzip.open(f"{tmpdir}/current-{idx}.jsonl.gz", "rt") as fi:
+                    for line in fi:
+                        key = get_term_key(line)
+                        previous_line = previous.pop(key, None)
+
+                        if previous_line is None:
+                            action = "added"
+                        elif previous_line == line:
+                            continue
+                        elif json.loads(previous_line)["term"] == json.loads(line)["term"]:
+                            continue  # only serialization differences
+                        else:
+                            action = "modified"
+
+                        counts[action] += 1
+                        delta = {"action": action, "key": key, "term": json.loads(line)["term"]}
+                        writer.write({"delta": delta})
+
+                for key in previous:
+                    counts["removed"] += 1
+                    writer.write({"delta": {"action": "removed", "key": key}})
+
+    return counts
+
+
+@contextlib.contextmanager
+def release_delta(resource_fn: str, enabled: bool = True):
+    """Write <ns>.delta.jsonl.gz for the namespace file rebuilt inside this context
+
+    The previous release is moved aside before the build, diffed against the new release after
+    the build and then removed.  If the build fails the previous release is restored.  A previous
+    release left moved aside by a killed build is restored first - the resource file next to it
+    is from the unfinished build.
+
+    Args:
+        resource_fn (str): namespace resource file, e.g. eg.jsonl.gz
+        enabled (bool): write delta file - if False this context only restores a previous release
+            left by a killed build
+    """
+
+    previous_fn = previous_release_fn(resource_fn)
+    if os.path.exists(previous_fn):
+        log.warning(
+            "Restoring previous release left by an interrupted build", resource_fn=resource_fn
+        )
+        os.replace(previous_fn, resource_fn)
+
+    if not enabled or not os.path.exists(resource_fn):
+        if enabled:
+            log.info("No previous release to compute delta against", resource_fn=resource_fn)
+        yield
+        return
+
+    os.replace(resource_fn, previous_fn)
+
+    try:
+        yield
+    except BaseException:
+        os.replace(previous_fn, resource_fn)
+        raise
+
+    delta_fn = delta_release_fn(resource_fn)
+    counts = write_delta(previous_fn, resource_fn, delta_fn)
+    os.remove(previous_fn)
+
+    log.info("Wrote namespace delta", delta_fn=delta_fn, **counts)
@@ -0,0 +1,71 @@
+import heapq
+import itertools
+import tempfile
+from typing import BinaryIO, Iterable, Iterator, List
+
+import app.settings as settings
+
+
+def write_run(lines: List[bytes], tmpdir: str) -> BinaryIO:
+    """Sort lines and spill them to a temporary run file - returned rewound for reading"""
+
+    lines.sort()
+    run = tempfile.TemporaryFile(dir=tmpdir)
+    run.writelines(lines)
+    run.seek(0)
+
+    return run
+
+
+def iter_sorted(
+    lines: Iterable[bytes],
+    buffer_size: int = settings.SORT_BUFFER_SIZE,
+    unique: bool = False,
+    tmpdir: str = None,
+) -> Iterator[bytes]:
+    """Sort newline terminated byte lines using bounded memory (external merge sort)
+
+    Lines are collected until buffer_size bytes are held, sorted and spilled to a temporary
+    run file.  The runs are then merged - only one line per run is in memory during the merge.
+    Inputs that fit in buffer_size are sorted in memory without touching disk.
+
+    Args:
+        lines (Iterable[bytes]): lines to sort - each must end with a newline
+        buffer_size (int): bytes of lines held in memory before a run is spilled
+        unique (bool): drop duplicate lines
+        tmpdir (str): directory for run files - defaults to the system temp directory
+
+    Returns:
+        Iterator[bytes]: lines in byte order
+    """
+
+    runs = []
+    buffer = []
+    buffered = 0
+
+    try:
+        for line in lines:
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= buffer_size:
+                runs.append(write_run(buffer, tmpdir))
+                buffer = []
+                buffered = 0
+
+        if runs:
+            if buffer:
+                runs.append(write_run(buffer, tmpdir))
+                buffer = []
+            merged = heapq.merge(*runs)
+        else:
+            buffer.sort()
+            merged = iter(buffer)
+
+        if unique:
+            merged = (line for (line, group) in itertools.groupby(merged))
+
+        yield from merged
+
+    finally:
+        for run in runs:
+            run.close()
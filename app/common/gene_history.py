@@ -0,0 +1,209 @@
+import gzip
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+import structlog
+
+import app.settings as settings
+from app.common.arrays import MappedArrays, array_fns, save_arrays
+
+log = structlog.getLogger(__name__)
+
+# EntrezGene history index written by the EG namespace build from gene_history.gz
+gene_history_dir = f"{settings.DATA_DIR}/namespaces/eg_history"
+
+# old_ids             sorted discontinued gene ids
+# current_ids         current gene id of each old id after following the replacement chain,
+#                     0 if the gene was withdrawn without a replacement
+# by_current_ids      current_ids sorted (withdrawn genes excluded)
+# by_current_old_ids  old id of each by_current_ids entry
+gene_history_arrays = ["old_ids", "current_ids", "by_current_ids", "by_current_old_ids"]
+
+
+def gene_history_fns(dirname: str = gene_history_dir) -> Mapping[str, str]:
+    """Gene history array name -> .npy filename"""
+
+    return array_fns(dirname, gene_history_arrays)
+
+
+def parse_gene_history_block(block: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse complete gene_history lines - vectorized over the block
+
+    Every line has 5 tab separated columns so splitting the whole block on tabs gives 4 fields
+    per line (the newline joins the last column of a line to the first of the next one).
+    """
+
+    tokens = block.split(b"\t")
+    if len(tokens) != 4 * block.count(b"\n") + 1:
+        raise ValueError("Unexpected gene_history line format - expected 5 tab separated columns")
+
+    new_ids = np.array(tokens[1::4])
+    new_ids[new_ids == b"-"] = b"0"
+
+    return (np.array(tokens[2::4]).astype(np.uint32), new_ids.astype(np.uint32))
+
+
+def read_gene_history(fn: str, block_size: int = 16 * 1024 * 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """Stream gene_history.gz - (GeneID, Discontinued_GeneID) columns as integer arrays
+
+    Args:
+        fn (str): gene_history.gz file
+        block_size (int): bytes decompressed and parsed at a time
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: discontinued gene ids and their replacement gene ids
+            (0 if the gene was withdrawn - GeneID is -)
+    """
+
+    (old_ids, new_ids) = ([], [])
+    tail = b""
+
+    with gzip.open(fn, "rb") as fi:
+        fi.readline()  # skip header line
+
+        while True:
+            block = fi.read(block_size)
+            if not block:
+                break
+
+            # Parse complete lines - the partial last line is carried over to the next block
+            block = tail + block
+            end = block.rfind(b"\n") + 1
+            (block, tail) = (block[:end], block[end:])
+            if block:
+                (old_block_ids, new_block_ids) = parse_gene_history_block(block)
+                old_ids.append(old_block_ids)
+                new_ids.append(new_block_ids)
+
+    if tail.strip():
+        (old_block_ids, new_block_ids) = parse_gene_history_block(tail + b"\n")
+        old_ids.append(old_block_ids)
+        new_ids.append(new_block_ids)
+
+    if not old_ids:
+        return (np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32))
+
+    return (np.concatenate(old_ids), np.concatenate(new_ids))
+
+
+def compute_gene_history(old_ids: np.ndarray, new_ids: np.ndarray) -> Mapping[str, np.ndarray]:
+    """Resolve replacement chains (A replaced by B replaced by C) to the current gene ids
+
+    Chains are followed by pointer jumping, so resolution takes log2(longest chain) vectorized
+    passes over the history.
+
+    Args:
+        old_ids (np.ndarray): discontinued gene ids
+        new_ids (np.ndarray): replacement gene id of each old id - 0 if withdrawn
+
+    Returns:
+        Mapping[str, np.ndarray]: gene history arrays, see gene_history_arrays
+    """
+
+    # Sort by old id - the first entry is kept if an old id is listed more than once
+    order = np.argsort(old_ids, kind="stable")
+    (old_ids, new_ids) = (old_ids[order], new_ids[order])
+    keep = old_ids != new_ids
+    keep[1:] &= old_ids[1:] != old_ids[:-1]
+    (old_ids, new_ids) = (old_ids[keep], new_ids[keep])
+    count = len(old_ids)
+
+    # Position of the replacement in old_ids if it was discontinued in turn, else -1
+    jump = np.searchsorted(old_ids, new_ids).astype(np.int64)
+    jump[jump >= count] = 0
+    jump = np.where((new_ids != 0) & (old_ids[jump] == new_ids), jump, -1)
+
+    current_ids = new_ids.copy()
+    for _ in range(count.bit_length() + 1):
+        has_jump = np.flatnonzero(jump >= 0)
+        if not len(has_jump):
+            break
+        current_ids[has_jump] = current_ids[jump[has_jump]]
+        jump[has_jump] = jump[jump[has_jump]]
+    else:
+        # Replacement cycles don't resolve to a current gene - keep the direct replacement
+        cycles = jump >= 0
+        log.warning("Gene history replacement cycles", gene_ids=old_ids[cycles][:20].tolist())
+        current_ids[cycles] = new_ids[cycles]
+
+    replaced = np.flatnonzero(current_ids != 0)
+    by_current = replaced[np.argsort(current_ids[replaced], kind="stable")]
+
+    return {
+        "old_ids": old_ids,
+        "current_ids": current_ids,
+        "by_current_ids": current_ids[by_current],
+        "by_current_old_ids": old_ids[by_current],
+    }
+
+
+def save_gene_history(gene_history: Mapping[str, np.ndarray], dirname: str = gene_history_dir):
+    """Save gene history arrays"""
+
+    save_arrays(dirname, gene_history_arrays, gene_history)
+
+
+def build_gene_history(history_fn: str, dirname: str = gene_history_dir):
+    """Build gene history index from gene_history.gz"""
+
+    (old_ids, new_ids) = read_gene_history(history_fn)
+    gene_history = compute_gene_history(old_ids, new_ids)
+    save_gene_history(gene_history, dirname)
+
+    log.info(
+        "Gene history index built",
+        discontinued=len(gene_history["old_ids"]),
+        replaced=len(gene_history["by_current_ids"]),
+    )
+
+
+class GeneHistory(MappedArrays):
+    """EntrezGene history lookups in both directions using the memory mapped gene history index
+
+        history = GeneHistory()
+        history.current(100002)  # 4560 - discontinued gene id -> current gene id
+        history.discontinued(4560)  # [100002] - current gene id -> discontinued gene ids
+
+    Args:
+        dirname (str): gene history index directory
+    """
+
+    names = gene_history_arrays
+
+    def __init__(self, dirname: str = gene_history_dir):
+        super().__init__(dirname)
+
+    def current(self, gene_id: int) -> Optional[int]:
+        """Current gene id - gene_id if it wasn't discontinued, None if it was withdrawn"""
+
+        return self.current_many([gene_id])[0] or None
+
+    def current_many(self, gene_ids: Iterable[int]) -> List[int]:
+        """Current gene ids - vectorized current(), withdrawn genes are 0"""
+
+        gene_ids = np.fromiter(gene_ids, dtype=np.uint32)
+        if not len(self.old_ids):
+            return gene_ids.tolist()
+
+        idx = np.searchsorted(self.old_ids, gene_ids)
+        idx[idx >= len(self.old_ids)] = 0
+        found = self.old_ids[idx] == gene_ids
+
+        return np.where(found, self.current_ids[idx], gene_ids).tolist()
+
+    def discontinued(self, gene_id: int) -> List[int]:
+        """Discontinued gene ids replaced (directly or through a chain) by gene_id"""
+
+        return self.discontinued_many([gene_id]).get(gene_id, [])
+
+    def discontinued_many(self, gene_ids: Iterable[int]) -> Dict[int, List[int]]:
+        """Vectorized discontinued() - only gene ids with discontinued gene ids are returned"""
+
+        gene_ids = np.fromiter(gene_ids, dtype=np.uint32)
+        starts = np.searchsorted(self.by_current_ids, gene_ids, side="left")
+        ends = np.searchsorted(self.by_current_ids, gene_ids, side="right")
+
+        return {
+            int(gene_ids[idx]): sorted(self.by_current_old_ids[starts[idx] : ends[idx]].tolist())
+            for idx in np.flatnonzero(ends > starts)
+        }
@@ -0,0 +1,109 @@
+from typing import Dict, FrozenSet, Hashable, List
+
+
+class Dag:
+    """Directed acyclic graph of child -> parent edges, e.g. OBO is_a relations
+
+    Ancestor and descendant sets are memoized for every node finished by a traversal (not just
+    the query node) and traversals stop at nodes whose closure is already known, so each edge is
+    traversed once over all queries and each closure is the union of its neighbors' closures.
+    """
+
+    def __init__(self):
+        self.parents: Dict[Hashable, List[Hashable]] = {}
+        self.children: Dict[Hashable, List[Hashable]] = {}
+        self.ancestor_sets: Dict[Hashable, FrozenSet[Hashable]] = {}
+        self.descendant_sets: Dict[Hashable, FrozenSet[Hashable]] = {}
+
+    def add_edge(self, child: Hashable, parent: Hashable):
+        """Add child -> parent edge - duplicate edges are ignored"""
+
+        parents = self.parents.setdefault(child, [])
+        if parent in parents:
+            return
+
+        parents.append(parent)
+        self.children.setdefault(parent, []).append(child)
+
+        self.ancestor_sets.clear()
+        self.descendant_sets.clear()
+
+    def ancestors(self, node: Hashable) -> FrozenSet[Hashable]:
+        """All nodes reachable from node via parent edges (node itself is not included)"""
+
+        return closure(node, self.parents, self.ancestor_sets)
+
+    def descendants(self, node: Hashable) -> FrozenSet[Hashable]:
+        """All nodes reachable from node via child edges (node itself is not included)"""
+
+        return closure(node, self.children, self.descendant_sets)
+
+    def is_ancestor(self, ancestor: Hashable, node: Hashable) -> bool:
+        """Is ancestor reachable from node via parent edges?"""
+
+        return ancestor in self.ancestors(node)
+
+
+def closure(
+    node: Hashable,
+    edges: Dict[Hashable, List[Hashable]],
+    memo: Dict[Hashable, FrozenSet[Hashable]],
+) -> FrozenSet[Hashable]:
+    """Transitive closure of node over edges using and updating memo
+
+    Iterative post-order depth first search - the closure of each node is memoized once all of
+    its neighbors are finished.  If edges turn out to have a cycle the closure of node is found by
+    reachable() instead (nodes already finished are memoized correctly).
+    """
+
+    if node in memo:
+        return memo[node]
+
+    in_progress = {node}
+    stack = [(node, iter(edges.get(node, ())))]
+    while stack:
+        (current, neighbors) = stack[-1]
+        for neighbor in neighbors:
+            if neighbor in memo:
+                continue
+            if neighbor in in_progress:
+                return reachable(node, edges, memo)
+
+            in_progress.add(neighbor)
+            stack.append((neighbor, iter(edges.get(neighbor, ()))))
+            break
+        else:
+            stack.pop()
+            in_progress.discard(current)
+            result = set()
+            for neighbor in edges.get(current, ()):
+                result.add(neighbor)
+                result |= memo[neighbor]
+            memo[current] = frozenset(result)
+
+    return memo[node]
+
+
+def reachable(
+    node: Hashable,
+    edges: Dict[Hashable, List[Hashable]],
+    memo: Dict[Hashable, FrozenSet[Hashable]],
+) -> FrozenSet[Hashable]:
+    """Nodes reachable from node over edges, which may have cycles - only node is memoized"""
+
+    result = set()
+    stack = list(edges.get(node, ()))
+    while stack:
+        next_node = stack.pop()
+        if next_node in result:
+            continue
+
+        result.add(next_node)
+        if next_node in memo:
+            result |= memo[next_node]
+        else:
+            stack.extend(edges.get(next_node, ()))
+
+    memo[node] = frozenset(result)
+
+    return memo[node]
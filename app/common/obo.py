@@ -0,0 +1,81 @@
+import functools
+import re
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+# OBO tag names, e.g. id, is_a, property_value
+tag_regex = re.compile(r"\w[\-\w]+")
+
+header_stanza_type = "Header"
+
+
+@functools.lru_cache(maxsize=None)
+def is_tag(tag: str) -> bool:
+    """Check tag name - there are only a few distinct tags so results are cached"""
+
+    return tag_regex.fullmatch(tag) is not None
+
+
+def iter_stanzas(fi: Iterable[str]) -> Iterator[Tuple[str, List[Tuple[str, str]]]]:
+    """Tokenize OBO file into stanzas
+
+    Lines are dispatched on their first character - "[" starts a stanza, a whitespace only
+    line ends it and anything else is a "tag: value" line.  Values are returned as-is
+    (trailing whitespace removed) - trailing modifiers, dbxrefs and ! comments are left
+    for the namespace mapping to handle.
+
+    Args:
+        fi (Iterable[str]): OBO file lines, e.g. gzip.open(fn, "rt")
+
+    Returns:
+        Iterator[Tuple[str, List[Tuple[str, str]]]]: (stanza_type, [(tag, value), ...]) where
+            stanza_type is Term, Typedef, Instance or Header for the tags before the first stanza
+    """
+
+    stanza_type = header_stanza_type
+    tags = []
+
+    for line in fi:
+        first = line[:1]
+
+        if first == "[":
+            if tags:
+                yield (stanza_type, tags)
+            stanza_type = line.strip()[1:-1]
+            tags = []
+
+        elif not line or line.isspace():
+            if tags:
+                yield (stanza_type, tags)
+            stanza_type = None
+            tags = []
+
+        elif stanza_type is not None:
+            (tag, sep, value) = line.partition(":")
+            if sep and value[:1].isspace() and is_tag(tag):
+                tags.append((tag, value[1:].rstrip()))
+
+    if tags:
+        yield (stanza_type, tags)
+
+
+def iter_terms(
+    fi: Iterable[str], term_mapping: Callable[[List[Tuple[str, str]]], Optional[object]]
+) -> Iterator[object]:
+    """Map OBO [Term] stanzas to namespace terms
+
+    Args:
+        fi (Iterable[str]): OBO file lines
+        term_mapping (Callable): namespace callback mapping the (tag, value) list of a [Term]
+            stanza to a term - returns None to skip the stanza (e.g. obsolete terms)
+
+    Returns:
+        Iterator[object]: terms returned by term_mapping
+    """
+
+    for (stanza_type, tags) in iter_stanzas(fi):
+        if stanza_type != "Term":
+            continue
+
+        term = term_mapping(tags)
+        if term is not None:
+            yield term
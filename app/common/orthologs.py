@@ -0,0 +1,258 @@
+from typing import List, Mapping, Optional
+
+import numpy as np
+
+import app.settings as settings
+from app.common.arrays import MappedArrays, array_fns, save_arrays, sorted_index
+
+# EG ortholog adjacency written by the EG orthologs build
+ortholog_adjacency_dir = f"{settings.DATA_DIR}/orthologs/eg_adjacency"
+
+# gene_ids     sorted gene ids (the key table - EG:<gene id>)
+# species_ids  taxonomy id of each gene
+# indptr       neighbors of gene i are indices[indptr[i]:indptr[i + 1]] (compressed sparse row)
+# indices      positions in gene_ids of the orthologs, sorted within each gene
+ortholog_adjacency_arrays = ["gene_ids", "species_ids", "indptr", "indices"]
+
+
+def ortholog_adjacency_fns(dirname: str = ortholog_adjacency_dir) -> Mapping[str, str]:
+    """Ortholog adjacency array name -> .npy filename"""
+
+    return array_fns(dirname, ortholog_adjacency_arrays)
+
+
+def compute_ortholog_adjacency(
+    subject_ids: np.ndarray,
+    object_ids: np.ndarray,
+    subject_species_ids: np.ndarray,
+    object_species_ids: np.ndarray,
+) -> Mapping[str, np.ndarray]:
+    """Build the compressed sparse row adjacency of deduplicated ortholog pairs
+
+    Each pair is added in both directions.
+
+    Args:
+        subject_ids (np.ndarray): subject gene ids
+        object_ids (np.ndarray): object gene ids
+        subject_species_ids (np.ndarray): subject taxonomy ids
+        object_species_ids (np.ndarray): object taxonomy ids
+
+    Returns:
+        Mapping[str, np.ndarray]: ortholog adjacency arrays, see ortholog_adjacency_arrays
+    """
+
+    ends = np.concatenate((subject_ids, object_ids))
+    neighbors = np.concatenate((object_ids, subject_ids))
+
+    (gene_ids, rows) = np.unique(ends, return_inverse=True)
+    species_ids = np.zeros(len(gene_ids), dtype=np.uint32)
+    species_ids[rows] = np.concatenate((subject_species_ids, object_species_ids))
+
+    columns = np.searchsorted(gene_ids, neighbors)
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(len(gene_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(gene_ids)), out=indptr[1:])
+
+    return {
+        "gene_ids": gene_ids.astype(np.uint32),
+        "species_ids": species_ids,
+        "indptr": indptr,
+        "indices": columns[order].astype(np.uint32),
+    }
+
+
+def save_ortholog_adjacency(
+    adjacency: Mapping[str, np.ndarray], dirname: str = ortholog_adjacency_dir
+):
+    """Save ortholog adjacency arrays"""
+
+    save_arrays(dirname, ortholog_adjacency_arrays, adjacency)
+
+
+class GeneKeyArrays(MappedArrays):
+    """Memory mapped arrays with a sorted gene_ids key table"""
+
+    def index(self, key: str) -> int:
+        """Position of gene key (EG:207) in the key table - -1 if the gene has no orthologs"""
+
+        (prefix, _, gene_id) = key.partition(":")
+        if prefix != "EG" or not gene_id.isdigit():
+            return -1
+
+        return sorted_index(self.gene_ids, int(gene_id))
+
+
+class OrthologAdjacency(GeneKeyArrays):
+    """EG ortholog lookups using the memory mapped ortholog adjacency - O(degree) per gene
+
+        orthologs = OrthologAdjacency()
+        orthologs.orthologs("EG:207")  # ["EG:11651", "EG:24185", ...]
+        orthologs.orthologs("EG:207", species_key="TAX:10090")  # ["EG:11651"]
+
+    Args:
+        dirname (str): ortholog adjacency directory
+    """
+
+    names = ortholog_adjacency_arrays
+
+    def __init__(self, dirname: str = ortholog_adjacency_dir):
+        super().__init__(dirname)
+
+    def species_key(self, key: str) -> Optional[str]:
+        idx = self.index(key)
+        if idx == -1:
+            return None
+
+        return f"TAX:{self.species_ids[idx]}"
+
+    def orthologs(self, key: str, species_key: str = None) -> List[str]:
+        """Ortholog gene keys of gene key, optionally only those of species_key"""
+
+        idx = self.index(key)
+        if idx == -1:
+            return []
+
+        columns = self.indices[self.indptr[idx] : self.indptr[idx + 1]]
+        if species_key is not None:
+            columns = columns[self.species_ids[columns] == int(species_key.partition(":")[2])]
+
+        return [f"EG:{gene_id}" for gene_id in self.gene_ids[columns].tolist()]
+
+
+# EG ortholog groups written by the EG ortholog groups build
+ortholog_groups_dir = f"{settings.DATA_DIR}/orthologs/eg_groups"
+
+# gene_ids           sorted gene ids (same key table as the ortholog adjacency)
+# species_ids        taxonomy id of each gene
+# group_ids          group id of each gene - the smallest gene id in the group
+# grouped            positions in gene_ids sorted by group id (then gene id)
+# grouped_group_ids  group id of each grouped entry
+ortholog_groups_arrays = ["gene_ids", "species_ids", "group_ids", "grouped", "grouped_group_ids"]
+
+
+def ortholog_groups_fns(dirname: str = ortholog_groups_dir) -> Mapping[str, str]:
+    """Ortholog groups array name -> .npy filename"""
+
+    return array_fns(dirname, ortholog_groups_arrays)
+
+
+def connected_components(indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Connected components of a compressed sparse row graph - vectorized union-find
+
+    Each pass hooks the larger root of every edge joining two components under the smaller
+    root and then compresses the paths by pointer jumping.  Edges inside a component are
+    dropped after each pass, so later passes only touch the edges still joining components.
+
+    Args:
+        indptr (np.ndarray): CSR row pointers
+        indices (np.ndarray): CSR column indices
+
+    Returns:
+        np.ndarray: component label of each node - the smallest node in its component
+    """
+
+    count = len(indptr) - 1
+    rows = np.repeat(np.arange(count, dtype=np.int64), np.diff(indptr))
+    columns = np.asarray(indices, dtype=np.int64)
+    forward = rows < columns  # each undirected edge once
+    (rows, columns) = (rows[forward], columns[forward])
+
+    labels = np.arange(count, dtype=np.int64)
+    while len(rows):
+        (row_labels, column_labels) = (labels[rows], labels[columns])
+        joining = row_labels != column_labels
+        (rows, columns) = (rows[joining], columns[joining])
+        (row_labels, column_labels) = (row_labels[joining], column_labels[joining])
+        if not len(rows):
+            break
+
+        # Hook - labels are all roots here so the forest stays acyclic (labels only decrease)
+        np.minimum.at(
+            labels,
+            np.maximum(row_labels, column_labels),
+            np.minimum(row_labels, column_labels),
+        )
+
+        # Compress
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+
+    return labels
+
+
+def compute_ortholog_groups(adjacency: OrthologAdjacency) -> Mapping[str, np.ndarray]:
+    """Ortholog groups - connected components of the ortholog adjacency
+
+    Args:
+        adjacency (OrthologAdjacency): ortholog adjacency
+
+    Returns:
+        Mapping[str, np.ndarray]: ortholog groups arrays, see ortholog_groups_arrays
+    """
+
+    gene_ids = np.asarray(adjacency.gene_ids)
+
+    # gene_ids are sorted so the smallest position of a component is its smallest gene id
+    group_ids = gene_ids[connected_components(adjacency.indptr, adjacency.indices)]
+    grouped = np.argsort(group_ids, kind="stable")
+
+    return {
+        "gene_ids": gene_ids,
+        "species_ids": np.asarray(adjacency.species_ids),
+        "group_ids": group_ids,
+        "grouped": grouped.astype(np.uint32),
+        "grouped_group_ids": group_ids[grouped],
+    }
+
+
+def save_ortholog_groups(groups: Mapping[str, np.ndarray], dirname: str = ortholog_groups_dir):
+    """Save ortholog groups arrays"""
+
+    save_arrays(dirname, ortholog_groups_arrays, groups)
+
+
+class OrthologGroups(GeneKeyArrays):
+    """EG ortholog group lookups using the memory mapped gene -> group index
+
+    Genes are orthologous if they are in the same group, even if they are only connected
+    through other genes (e.g. mouse and rat genes through their human ortholog).
+
+        groups = OrthologGroups()
+        groups.group_id("EG:11651")  # 207
+        groups.members("EG:11651", species_key="TAX:10116")  # rat orthologs of a mouse gene
+
+    Args:
+        dirname (str): ortholog groups directory
+    """
+
+    names = ortholog_groups_arrays
+
+    def __init__(self, dirname: str = ortholog_groups_dir):
+        super().__init__(dirname)
+
+    def group_id(self, key: str) -> Optional[int]:
+        """Ortholog group id of gene key - None if the gene has no orthologs"""
+
+        idx = self.index(key)
+        if idx == -1:
+            return None
+
+        return int(self.group_ids[idx])
+
+    def members(self, key: str, species_key: str = None) -> List[str]:
+        """Gene keys in the ortholog group of gene key (key included), optionally of species_key only"""
+
+        group_id = self.group_id(key)
+        if group_id is None:
+            return []
+
+        start = np.searchsorted(self.grouped_group_ids, group_id, side="left")
+        end = np.searchsorted(self.grouped_group_ids, group_id, side="right")
+        positions = self.grouped[start:end]
+        if species_key is not None:
+            positions = positions[self.species_ids[positions] == int(species_key.partition(":")[2])]
+
+        return [f"EG:{gene_id}" for gene_id in self.gene_ids[positions].tolist()]
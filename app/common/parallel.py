@@ -0,0 +1,61 @@
+import collections
+import itertools
+import multiprocessing
+from typing import Any, Callable, Iterable, Iterator, List, Sequence
+
+
+def chunked(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Split iterable into lists of size items (last list may be shorter)"""
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ordered_map(
+    func: Callable[[Any], Any],
+    chunks: Iterable[Any],
+    workers: int = 1,
+    initializer: Callable = None,
+    initargs: Sequence[Any] = (),
+    max_pending: int = None,
+) -> Iterator[Any]:
+    """Map func over chunks in worker processes, yielding results in input order
+
+    Unlike Pool.imap() only max_pending chunks are read ahead of the results
+    being consumed so memory stays bounded for very large input files.
+
+    Args:
+        func (Callable): function applied to each chunk - must be picklable (module level)
+        chunks (Iterable[Any]): work items
+        workers (int): number of worker processes - 1 or less runs func in this process
+        initializer (Callable): worker process initializer (also run in-process if workers <= 1)
+        initargs (Sequence[Any]): initializer arguments
+        max_pending (int): maximum chunks submitted but not yet yielded, defaults to 4 * workers
+
+    Returns:
+        Iterator[Any]: func results in input order
+    """
+
+    if workers <= 1:
+        if initializer:
+            initializer(*initargs)
+        for chunk in chunks:
+            yield func(chunk)
+        return
+
+    if max_pending is None:
+        max_pending = 4 * workers
+
+    with multiprocessing.Pool(processes=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(func, (chunk,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
@@ -1,11 +1,25 @@
 import datetime
 import gzip
 import json
+import os
+from typing import Any
 
 import app.settings as settings
+from app.common.species_labels import SpeciesLabels
+from app.common.taxonomy import TaxonomyLineage, lineage_fns
 from app.common.text import dt_now
+from app.common.writers import output_fn
 from app.schemas.main import Namespace, Term
 
+# Species labels written by tax.py - memory mapped label store used by the builders and
+# the same labels as JSON for other consumers
+species_labels_fn = f"{settings.DATA_DIR}/namespaces/tax_labels.bin"
+species_labels_json_fn = output_fn(f"{settings.DATA_DIR}/namespaces/tax_labels.json")
+
+# Taxonomy lineage arrays written by tax.py - build inputs of the builders using species
+# label fallback or species subsets with clades
+taxonomy_lineage_fns = list(lineage_fns().values())
+
 
 def get_metadata(namespace_def, version: str = None) -> dict:
     """Get namespace metadata"""
@@ -40,13 +54,29 @@ def get_metadata(namespace_def, version: str = None) -> dict:
     return metadata.dict(skip_defaults=True)
 
 
-def get_species_labels():
-    """Get species labels with overrides from TAXONOMY_LABELS setting"""
+def get_species_labels() -> SpeciesLabels:
+    """Get species labels with overrides from TAXONOMY_LABELS setting
+
+    The label store is memory mapped on first lookup, so this is cheap to call at import time
+    and the labels are shared between processes.  Sub-species taxa fall back to the label of
+    their species using the taxonomy lineage.
+    """
+
+    return SpeciesLabels(
+        species_labels_fn, overrides=settings.TAXONOMY_LABELS, lineage=TaxonomyLineage()
+    )
+
+
+def save_json(fn: str, data: Any):
+    """Save JSON file atomically - written to a temporary file and renamed into place
 
-    species_labels_fn = f"{settings.DATA_DIR}/namespaces/tax_labels.json.gz"
-    with gzip.open(species_labels_fn, "r") as fi:
-        species_labels = json.load(fi)
+    Used for state files (checkpoints, manifests) that must never be left half written
+    """
 
-    species_labels.update(settings.TAXONOMY_LABELS)
+    tmp_fn = f"{fn}.tmp"
+    with open(tmp_fn, "w") as fo:
+        json.dump(data, fo, indent=2)
+        fo.flush()
+        os.fsync(fo.fileno())
 
-    return species_labels
+    os.replace(tmp_fn, fn)
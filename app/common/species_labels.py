@@ -0,0 +1,172 @@
+import array
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_left
+from typing import Iterable, Iterator, Mapping, Optional, Tuple
+
+from app.common.taxonomy import TaxonomyLineage
+
+# Species label store layout (native byte order, recorded in the header):
+#
+#   header   magic, byte order, count
+#   ids      count x uint32 sorted taxonomy ids
+#   offsets  (count + 1) x uint32 label offsets into the string table
+#   strings  UTF-8 labels
+store_magic = b"BELSPLB1"
+store_header = struct.Struct("=8s1sxxxI")
+
+
+def write_species_label_store(fn: str, labels: Iterable[Tuple[int, str]]):
+    """Write species label store for SpeciesLabels - written to a temporary file and renamed into place
+
+    Args:
+        fn (str): species label store file
+        labels (Iterable[Tuple[int, str]]): (taxonomy id, label) sorted by taxonomy id
+    """
+
+    ids = array.array("I")
+    offsets = array.array("I", [0])
+    strings = bytearray()
+    for (id, label) in labels:
+        if ids and id <= ids[-1]:
+            raise ValueError(f"Species labels are not sorted by taxonomy id at {id}")
+        ids.append(id)
+        strings += label.encode("utf-8")
+        offsets.append(len(strings))
+
+    with open(f"{fn}.tmp", "wb") as fo:
+        fo.write(store_header.pack(store_magic, sys.byteorder[0].encode(), len(ids)))
+        fo.write(ids.tobytes())
+        fo.write(offsets.tobytes())
+        fo.write(strings)
+
+    os.replace(f"{fn}.tmp", fn)
+
+
+class SpeciesLabels(Mapping[str, str]):
+    """Species key (TAX:9606) -> label mapping backed by a memory mapped species label store
+
+    The store is opened on first use - the pages are shared by all of the processes that map
+    it so builder worker pools don't each hold a copy of the labels.  Instances pickle as the
+    store filename so they can be passed to worker processes.
+
+    With a taxonomy lineage, taxa below species rank (e.g. strains and subspecies) that have
+    no label of their own get the label of their species.
+
+    Args:
+        fn (str): species label store written by write_species_label_store()
+        overrides (Mapping[str, str]): labels used instead of the stored labels, e.g. TAXONOMY_LABELS
+            (keyed by taxonomy id without the TAX: prefix)
+        lineage (TaxonomyLineage): taxonomy lineage used to find the species of a taxon - ignored
+            if the lineage hasn't been built
+    """
+
+    def __init__(
+        self, fn: str, overrides: Mapping[str, str] = None, lineage: TaxonomyLineage = None
+    ):
+        self.fn = fn
+        self.overrides = {f"TAX:{id}": label for (id, label) in (overrides or {}).items()}
+        self.lineage = lineage
+        self.mm = None
+
+    def __getstate__(self):
+        return {"fn": self.fn, "overrides": self.overrides, "lineage": self.lineage}
+
+    def __setstate__(self, state):
+        self.fn = state["fn"]
+        self.overrides = state["overrides"]
+        self.lineage = state["lineage"]
+        self.mm = None
+
+    def open(self):
+        """Memory map the store"""
+
+        with open(self.fn, "rb") as fi:
+            self.mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, byteorder, count) = store_header.unpack_from(self.mm)
+        if magic != store_magic:
+            raise ValueError(f"Not a species label store: {self.fn}")
+        if byteorder != sys.byteorder[0].encode():
+            raise ValueError(f"Species label store written with a different byte order: {self.fn}")
+
+        if self.lineage is not None and not self.lineage.exists():
+            self.lineage = None
+
+        view = memoryview(self.mm)
+        ids_start = store_header.size
+        offsets_start = ids_start + 4 * count
+        self.strings_start = offsets_start + 4 * (count + 1)
+        self.ids = view[ids_start:offsets_start].cast("I")
+        self.offsets = view[offsets_start : self.strings_start].cast("I")
+
+    def lookup(self, species_key: str) -> Optional[str]:
+        """Get stored label - None if species_key isn't in the store"""
+
+        if self.mm is None:
+            self.open()
+
+        (prefix, _, id) = species_key.partition(":")
+        if prefix != "TAX" or not id.isdigit():
+            return None
+
+        id = int(id)
+        idx = bisect_left(self.ids, id)
+        if idx == len(self.ids) or self.ids[idx] != id:
+            return None
+
+        start = self.strings_start + self.offsets[idx]
+        end = self.strings_start + self.offsets[idx + 1]
+
+        return self.mm[start:end].decode("utf-8")
+
+    def species_key(self, species_key: str) -> Optional[str]:
+        """Species key of the species rank ancestor of a taxon - None if there is no lineage or species"""
+
+        if self.mm is None:
+            self.open()
+
+        if self.lineage is None:
+            return None
+
+        species = self.lineage.species(species_key)
+        if species is None or f"TAX:{species}" == species_key:
+            return None
+
+        return f"TAX:{species}"
+
+    def __getitem__(self, species_key: str) -> str:
+        if species_key in self.overrides:
+            return self.overrides[species_key]
+
+        label = self.lookup(species_key)
+        if label is None:
+            ancestor_key = self.species_key(species_key)
+            if ancestor_key is None:
+                raise KeyError(species_key)
+            return self[ancestor_key]
+
+        return label
+
+    def __contains__(self, species_key) -> bool:
+        try:
+            self[species_key]
+        except KeyError:
+            return False
+
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        if self.mm is None:
+            self.open()
+
+        yield from (f"TAX:{id}" for id in self.ids)
+        yield from (key for key in self.overrides if self.lookup(key) is None)
+
+    def __len__(self) -> int:
+        if self.mm is None:
+            self.open()
+
+        return len(self.ids) + sum(1 for key in self.overrides if self.lookup(key) is None)
@@ -0,0 +1,235 @@
+from typing import Collection, Dict, Mapping, Optional, Set, Union
+
+import numpy as np
+
+import app.settings as settings
+from app.common.arrays import MappedArrays, array_fns, save_arrays, sorted_index
+
+# Taxonomy lineage arrays written by tax.py
+lineage_dir = f"{settings.DATA_DIR}/namespaces/tax_lineage"
+
+# Ranks with a precomputed ancestor array (ancestor or self of the rank)
+lineage_ranks = [
+    "species",
+    "genus",
+    "family",
+    "order",
+    "class",
+    "phylum",
+    "kingdom",
+    "superkingdom",
+    "domain",
+]
+
+lineage_arrays = ["ids", "parents", "ranks", "rank_names", "enter", "exit", "preorder"]
+lineage_arrays.extend(f"ancestor_{rank}" for rank in lineage_ranks)
+
+TaxonId = Union[int, str]  # 9606 or TAX:9606
+
+
+def lineage_fns(dirname: str = lineage_dir) -> Mapping[str, str]:
+    """Lineage array name -> .npy filename"""
+
+    return array_fns(dirname, lineage_arrays)
+
+
+def compute_lineage(ids: np.ndarray, parent_ids: np.ndarray, ranks: np.ndarray, rank_names: list):
+    """Compute taxonomy lineage arrays
+
+    Every step is vectorized over all of the taxa at a tree depth, so the whole NCBI taxonomy
+    only needs a few hundred numpy operations.
+
+    Args:
+        ids (np.ndarray): taxonomy ids
+        parent_ids (np.ndarray): parent taxonomy id of each taxon - 0 for the root
+        ranks (np.ndarray): rank code of each taxon
+        rank_names (list): rank code -> rank
+
+    Returns:
+        Mapping[str, np.ndarray]: lineage arrays, see lineage_arrays - all ordered by taxonomy id
+            and parents/preorder as positions in ids
+    """
+
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order].astype(np.uint32)
+    parent_ids = parent_ids[order]
+    ranks = ranks[order].astype(np.uint8)
+    count = len(ids)
+
+    # Parent positions - -1 for the root and for parents missing from nodes.dmp
+    parents = np.searchsorted(ids, parent_ids).astype(np.int64)
+    parents[parents >= count] = 0
+    parents = np.where((parent_ids != 0) & (ids[parents] == parent_ids), parents, -1)
+
+    # Depth of each taxon - pointer jumping, so log2(max depth) passes
+    depth = (parents >= 0).astype(np.int64)
+    jump = parents.copy()
+    for _ in range(count.bit_length() + 1):
+        has_jump = np.flatnonzero(jump >= 0)
+        if not len(has_jump):
+            break
+        depth[has_jump] += depth[jump[has_jump]]
+        jump[has_jump] = jump[jump[has_jump]]
+    else:
+        raise ValueError("Taxonomy nodes have a parent cycle")
+
+    levels = [np.flatnonzero(depth == level) for level in range(depth.max() + 1 if count else 0)]
+
+    # Subtree sizes - bottom up
+    size = np.ones(count, dtype=np.int64)
+    for level in reversed(levels[1:]):
+        np.add.at(size, parents[level], size[level])
+
+    # Preorder (Euler tour entry) numbering - top down, children ordered by taxonomy id.  The
+    # subtree of a taxon is the contiguous interval enter[taxon] <= enter[x] < exit[taxon]
+    enter = np.zeros(count, dtype=np.int64)
+    for (depth_idx, level) in enumerate(levels):
+        if depth_idx == 0:
+            enter[level] = np.cumsum(size[level]) - size[level]
+            continue
+
+        # level is sorted by position so siblings are in taxonomy id order within their parent
+        level = level[np.argsort(parents[level], kind="stable")]
+        level_parents = parents[level]
+        offsets = np.cumsum(size[level]) - size[level]
+        group_starts = np.flatnonzero(np.r_[True, level_parents[1:] != level_parents[:-1]])
+        group_offsets = np.repeat(offsets[group_starts], np.diff(np.r_[group_starts, len(level)]))
+        enter[level] = enter[level_parents] + 1 + offsets - group_offsets
+
+    exit = enter + size
+    preorder = np.empty(count, dtype=np.int32)
+    preorder[enter] = np.arange(count, dtype=np.int32)
+
+    lineage = {
+        "ids": ids,
+        "parents": parents.astype(np.int32),
+        "ranks": ranks,
+        "rank_names": np.array(rank_names, dtype=str),
+        "enter": enter.astype(np.int32),
+        "exit": exit.astype(np.int32),
+        "preorder": preorder,
+    }
+
+    # Ancestor (or self) at each rank - top down
+    for rank in lineage_ranks:
+        ancestor = np.full(count, -1, dtype=np.int64)
+        if rank in rank_names:
+            is_rank = ranks == rank_names.index(rank)
+            ancestor[is_rank] = np.flatnonzero(is_rank)
+        for level in levels[1:]:
+            missing = level[ancestor[level] == -1]
+            ancestor[missing] = ancestor[parents[missing]]
+        lineage[f"ancestor_{rank}"] = np.where(ancestor >= 0, ids[ancestor], 0).astype(np.uint32)
+
+    return lineage
+
+
+def save_lineage(lineage: Mapping[str, np.ndarray], dirname: str = lineage_dir):
+    """Save lineage arrays"""
+
+    save_arrays(dirname, lineage_arrays, lineage)
+
+
+class TaxonomyLineage(MappedArrays):
+    """Taxonomy lineage queries using the memory mapped lineage arrays written by tax.py
+
+        lineage = TaxonomyLineage()
+        lineage.rank_ancestor("TAX:511145", "species")  # 562
+        lineage.in_clade("TAX:9606", "TAX:40674")  # True - human is a mammal
+
+    Args:
+        dirname (str): lineage directory
+    """
+
+    names = lineage_arrays
+
+    def __init__(self, dirname: str = lineage_dir):
+        super().__init__(dirname)
+
+    def index(self, taxon: TaxonId) -> int:
+        """Position of taxon in the lineage arrays - -1 if not found"""
+
+        if isinstance(taxon, str):
+            taxon = taxon.partition(":")[2] if ":" in taxon else taxon
+            if not taxon.isdigit():
+                return -1
+            taxon = int(taxon)
+
+        return sorted_index(self.ids, taxon)
+
+    def rank(self, taxon: TaxonId) -> Optional[str]:
+        idx = self.index(taxon)
+        if idx == -1:
+            return None
+
+        return str(self.rank_names[self.ranks[idx]])
+
+    def parent(self, taxon: TaxonId) -> Optional[int]:
+        idx = self.index(taxon)
+        if idx == -1 or self.parents[idx] == -1:
+            return None
+
+        return int(self.ids[self.parents[idx]])
+
+    def rank_ancestor(self, taxon: TaxonId, rank: str) -> Optional[int]:
+        """Taxonomy id of the ancestor (or taxon itself) with rank, e.g. the species of a strain"""
+
+        idx = self.index(taxon)
+        if idx == -1:
+            return None
+
+        ancestor = int(getattr(self, f"ancestor_{rank}")[idx])
+
+        return ancestor or None
+
+    def species(self, taxon: TaxonId) -> Optional[int]:
+        return self.rank_ancestor(taxon, "species")
+
+    def in_clade(self, taxon: TaxonId, clade: TaxonId) -> bool:
+        """Is taxon the clade taxon or one of its descendants?  O(1) interval test"""
+
+        (idx, clade_idx) = (self.index(taxon), self.index(clade))
+        if idx == -1 or clade_idx == -1:
+            return False
+
+        return self.enter[clade_idx] <= self.enter[idx] < self.exit[clade_idx]
+
+    def clade(self, clade: TaxonId) -> np.ndarray:
+        """Taxonomy ids of the clade taxon and all of its descendants"""
+
+        idx = self.index(clade)
+        if idx == -1:
+            return np.empty(0, dtype=np.uint32)
+
+        return self.ids[self.preorder[self.enter[idx] : self.exit[idx]]]
+
+
+def resolve_species_subsets(
+    subsets: Mapping[str, Mapping[str, Collection[str]]], lineage: TaxonomyLineage = None
+) -> Dict[str, Set[str]]:
+    """Species keys of each species subset - listed species plus all taxa of the listed clades
+
+    Args:
+        subsets (Mapping[str, Mapping[str, Collection[str]]]): subset definitions, see settings.SPECIES_SUBSETS
+        lineage (TaxonomyLineage): lineage used to expand clades
+
+    Returns:
+        Dict[str, Set[str]]: subset name -> species keys
+    """
+
+    resolved = {}
+    for (name, subset) in subsets.items():
+        species_keys = set(subset.get("species", []))
+
+        if subset.get("clades"):
+            lineage = lineage or TaxonomyLineage()
+            if not lineage.exists():
+                raise FileNotFoundError(
+                    f"Species subset {name} has clades - build the taxonomy (tax.py) first"
+                )
+            for clade in subset["clades"]:
+                species_keys.update(f"TAX:{id}" for id in lineage.clade(clade).tolist())
+
+        resolved[name] = species_keys
+
+    return resolved
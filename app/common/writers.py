@@ -0,0 +1,518 @@
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import itertools
+import json
+import os
+import re
+import struct
+import tempfile
+import zlib
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Collection,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    Mapping,
+    Sequence,
+    Tuple,
+)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - only needed for BELRES_OUTPUT_CODEC=zstd
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # pragma: no cover - only needed for BELRES_OUTPUT_CODEC=lz4
+    lz4 = None
+
+import app.settings as settings
+from app.common import extsort
+from app.common.taxonomy import resolve_species_subsets
+
+# Number of term records serialized in this process - used to sample terms for validation
+term_counter = itertools.count()
+
+
+def dumps(record: Mapping[str, Any]) -> bytes:
+    """Serialize record as a JSONL line
+
+    Uses orjson if installed - the stdlib fallback produces identical output
+    (same key order, compact separators, UTF-8 instead of \\u escapes).
+    """
+
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def loads(line: bytes) -> Any:
+    """Parse JSONL line - uses orjson if installed"""
+
+    if orjson is not None:
+        return orjson.loads(line)
+
+    return json.loads(line)
+
+
+def term_record(term: Any) -> Mapping[str, Any]:
+    """Get term record for JSONL file from TermRecord, Term or term dict
+
+    Every settings.TERM_VALIDATION_SAMPLE'th TermRecord is validated against the Term model.
+    """
+
+    if isinstance(term, Mapping):
+        return {"term": term}
+
+    if settings.TERM_VALIDATION_SAMPLE and next(term_counter) % settings.TERM_VALIDATION_SAMPLE == 0:
+        term.validate()
+
+    return {"term": term.dict()}
+
+
+class TermWriter:
+    """Write JSONL records to a resource file and its species subset files
+
+    Each record is serialized once and the same bytes are written to every output.  Records are
+    routed to the subsets with a dict lookup of each record species key.
+
+    Args:
+        fo (BinaryIO): resource file opened for binary writing
+        subsets (Sequence[Tuple[BinaryIO, Collection[str]]]): subset files (e.g. _hmrz files)
+            with the species keys that are written to them
+    """
+
+    def __init__(self, fo: BinaryIO, subsets: Sequence[Tuple[BinaryIO, Collection[str]]] = ()):
+        self.fo = fo
+        self.subset_files = [fz for (fz, species_keys) in subsets]
+
+        # species key -> subset files that include the species
+        self.species_subsets: Dict[str, FrozenSet[BinaryIO]] = {}
+        for (fz, species_keys) in subsets:
+            for species_key in set(species_keys):
+                self.species_subsets[species_key] = self.species_subsets.get(
+                    species_key, frozenset()
+                ) | {fz}
+
+    def write_metadata(self, metadata: Mapping[str, Any]):
+        """Write metadata header record to the resource file and all subset files"""
+
+        line = dumps({"metadata": metadata})
+        self.fo.write(line)
+        for fz in self.subset_files:
+            fz.write(line)
+
+    def write_line(self, line: bytes, species_keys: Iterable[str] = ()):
+        """Write serialized record - to subset files if all of the record species are in the subset"""
+
+        self.fo.write(line)
+
+        if not self.species_subsets:
+            return
+
+        subset_files = None
+        for species_key in species_keys:
+            files = self.species_subsets.get(species_key)
+            if not files:
+                return
+            subset_files = files if subset_files is None else subset_files & files
+
+        for fz in subset_files or ():
+            fz.write(line)
+
+    def write_lines(self, lines: Iterable[Tuple[bytes, Iterable[str]]]):
+        """Write serialized records with their species keys (e.g. results from worker processes)"""
+
+        for (line, species_keys) in lines:
+            self.write_line(line, species_keys)
+
+    def write(self, record: Mapping[str, Any], species_keys: Iterable[str] = ()):
+        """Write record, e.g. {"ortholog": ortholog}"""
+
+        self.write_line(dumps(record), species_keys)
+
+    def write_term(self, term: Any):
+        """Write Term (or term dict) routed to subsets on its species_key"""
+
+        record = term_record(term)
+        self.write_line(dumps(record), [record["term"]["species_key"]])
+
+
+def compress_gzip_member(block: bytes, level: int) -> bytes:
+    """Compress block as a complete gzip member (zlib releases the GIL while compressing)"""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip header, mtime 0
+
+    return compressor.compress(block) + compressor.flush()
+
+
+class ParallelGzipFile:
+    """Write a gzip file compressing blocks on a thread pool (like pigz)
+
+    Each block is written as a separate gzip member - a multi-member gzip file is a standard
+    gzip file that gzip.open(), zcat, etc. read as one stream.
+
+    Args:
+        fn (str): output filename
+        level (int): gzip compression level
+        block_size (int): uncompressed bytes per gzip member
+        threads (int): compression threads - 1 compresses in the calling thread
+        executor (concurrent.futures.Executor): compression thread pool shared with other files
+            (not shut down on close) - a pool of threads is started if not given
+    """
+
+    def __init__(
+        self,
+        fn: str,
+        level: int = settings.OUTPUT_GZIP_LEVEL,
+        block_size: int = settings.OUTPUT_GZIP_BLOCK_SIZE,
+        threads: int = settings.OUTPUT_THREADS,
+        executor: concurrent.futures.Executor = None,
+    ):
+        self.fo = open(fn, "wb")
+        self.level = level
+        self.block_size = block_size
+        self.buffer = []
+        self.buffered = 0
+        self.members = 0
+        self.closed = False
+
+        self.executor = executor
+        self.owns_executor = executor is None and threads > 1
+        if self.owns_executor:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.pending = collections.deque()
+        self.max_pending = 2 * threads
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data: bytes) -> int:
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            self.compress_block()
+
+        return len(data)
+
+    def compress_block(self):
+        """Compress buffered data as the next gzip member"""
+
+        block = b"".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        self.members += 1
+
+        if self.executor is None:
+            self.write_member(self.compress_member(block, self.level))
+            return
+
+        self.pending.append(self.executor.submit(self.compress_member, block, self.level))
+        while len(self.pending) > self.max_pending:
+            self.write_member(self.pending.popleft().result())
+
+    compress_member = staticmethod(compress_gzip_member)
+
+    def write_member(self, member: bytes):
+        """Write compressed member to the file - members are written in order"""
+
+        self.fo.write(member)
+
+    def finish(self):
+        """Finish file after all blocks are written - an empty gzip member if nothing was written"""
+
+        if not self.members:
+            self.write_member(compress_gzip_member(b"", self.level))
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self.buffered:
+                self.compress_block()
+            while self.pending:
+                self.write_member(self.pending.popleft().result())
+            self.finish()
+        finally:
+            if self.owns_executor:
+                self.executor.shutdown()
+            self.fo.close()
+            self.closed = True
+
+
+# BGZF (blocked gzip as used by samtools/tabix) - uncompressed bytes per block, the
+# compressed block including header and trailer must fit in 64KiB
+bgzf_block_size = 0xFF00
+bgzf_max_block_size = 0x10000
+bgzf_eof = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Term.key is the first field of every term record, so it can be pulled out without parsing the
+# line - multiline so every record of a batch of lines is matched
+term_key_regex = re.compile(rb'^\{"term":\s*\{"key":\s*"((?:[^"\\]|\\.)*)"', re.MULTILINE)
+
+
+def compress_bgzf_block(block: bytes, level: int) -> bytes:
+    """Compress block as a BGZF block - a gzip member with its compressed size in the BC extra field"""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # raw deflate
+    cdata = compressor.compress(block) + compressor.flush()
+    if len(cdata) + 26 > bgzf_max_block_size:  # incompressible data - store it
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = compressor.compress(block) + compressor.flush()
+
+    header = struct.pack(
+        "<4BI2BH2BHH", 0x1F, 0x8B, 8, 4, 0, 0, 0xFF, 6, ord("B"), ord("C"), 2, len(cdata) + 25
+    )
+    trailer = struct.pack("<2I", zlib.crc32(block), len(block))
+
+    return header + cdata + trailer
+
+
+def key_index_fn(fn: str) -> str:
+    """Term key index sidecar of BGZF resource file, e.g. eg.jsonl.gz -> eg.jsonl.gz.keys"""
+
+    return f"{fn}.keys"
+
+
+class BgzfFile(ParallelGzipFile):
+    """Write a BGZF file (seekable blocked gzip) with a sorted term key index sidecar
+
+    BGZF files are standard multi-member gzip files so gzip.open(), zcat, etc. read them as
+    usual, but each block can also be decompressed on its own.  Records are located by a virtual
+    offset - compressed offset of the block << 16 | offset of the record in the uncompressed block.
+
+    The key -> virtual offset of every term record written is saved to key_index_fn(fn) as
+    "key\\tvirtual_offset" lines sorted by key (JSON escaped key bytes) - see app.common.bgzf.
+
+    Args:
+        fn (str): output filename
+        level (int): compression level
+        threads (int): compression threads - 1 compresses in the calling thread
+        executor (concurrent.futures.Executor): compression thread pool shared with other files
+    """
+
+    compress_member = staticmethod(compress_bgzf_block)
+
+    def __init__(
+        self,
+        fn: str,
+        level: int = settings.OUTPUT_GZIP_LEVEL,
+        threads: int = settings.OUTPUT_THREADS,
+        executor: concurrent.futures.Executor = None,
+    ):
+        super().__init__(
+            fn, level=level, block_size=bgzf_block_size, threads=threads, executor=executor
+        )
+
+        self.fn = fn
+        self.offset = 0
+        self.block_offsets = []
+
+        # Unsorted key, block number, offset in block lines - sorted when the file is closed,
+        # numbers are zero padded so duplicate keys sort in file order
+        self.keys = tempfile.TemporaryFile(dir=os.path.dirname(fn) or None)
+        self.key_count = 0
+
+    def write(self, data: bytes) -> int:
+        """Write data - every term record line in data is indexed (e.g. a batch of records)"""
+
+        # Blocks are exactly block_size bytes - a stream position gives its block and offset
+        position = self.members * self.block_size + self.buffered
+        for match in term_key_regex.finditer(data):
+            (block, offset) = divmod(position + match.start(), self.block_size)
+            self.keys.write(b"%s\t%010d\t%05d\n" % (match.group(1), block, offset))
+            self.key_count += 1
+
+        # Blocks are split at exactly block_size bytes so offsets in a block fit in 16 bits
+        view = memoryview(data)
+        while view:
+            chunk = view[: self.block_size - self.buffered]
+            self.buffer.append(bytes(chunk))
+            self.buffered += len(chunk)
+            view = view[len(chunk) :]
+            if self.buffered >= self.block_size:
+                self.compress_block()
+
+        return len(data)
+
+    def write_member(self, member: bytes):
+        self.block_offsets.append(self.offset)
+        self.offset += len(member)
+        self.fo.write(member)
+
+    def finish(self):
+        """Write the BGZF end of file block and the sorted key index"""
+
+        self.fo.write(bgzf_eof)
+
+        try:
+            if self.key_count:
+                self.write_key_index()
+        finally:
+            self.keys.close()
+
+    def write_key_index(self):
+        """Sort the term keys and write them with their virtual offsets to key_index_fn(self.fn)"""
+
+        self.keys.seek(0)
+        index_fn = key_index_fn(self.fn)
+
+        with open(f"{index_fn}.tmp", "wb") as fo:
+            for line in extsort.iter_sorted(self.keys, tmpdir=os.path.dirname(self.fn) or None):
+                (key, block, offset) = line.rstrip(b"\n").split(b"\t")
+                virtual_offset = self.block_offsets[int(block)] << 16 | int(offset)
+                fo.write(b"%s\t%d\n" % (key, virtual_offset))
+
+        os.replace(f"{index_fn}.tmp", index_fn)
+
+
+# Output codecs - filename extension and magic bytes used to detect the codec when reading
+codecs = {
+    "gzip": {"extension": ".gz", "magic": b"\x1f\x8b"},
+    "bgzf": {"extension": ".gz", "magic": b"\x1f\x8b"},  # detected as gzip - readable as gzip
+    "zstd": {"extension": ".zst", "magic": b"\x28\xb5\x2f\xfd"},
+    "lz4": {"extension": ".lz4", "magic": b"\x04\x22\x4d\x18"},
+    "none": {"extension": "", "magic": None},
+}
+
+
+def check_codec(codec: str):
+    """Check codec is known and its optional compression package is installed"""
+
+    if codec not in codecs:
+        raise ValueError(f"Unknown output codec {codec} - use one of {', '.join(codecs)}")
+    if codec == "zstd" and zstandard is None:
+        raise ImportError("Output codec zstd requires the zstandard package")
+    if codec == "lz4" and lz4 is None:
+        raise ImportError("Output codec lz4 requires the lz4 package")
+
+
+def output_fn(fn: str, codec: str = settings.OUTPUT_CODEC) -> str:
+    """Output filename for the codec, e.g. eg.jsonl -> eg.jsonl.gz or eg.jsonl.zst"""
+
+    return f"{fn}{codecs[codec]['extension']}"
+
+
+def open_output(
+    fn: str, codec: str = settings.OUTPUT_CODEC, executor: concurrent.futures.Executor = None
+) -> BinaryIO:
+    """Open resource file for binary writing with the output codec (settings.OUTPUT_CODEC)
+
+    gzip is compressed in parallel blocks, bgzf also writes a term key index, zstd uses settings.OUTPUT_ZSTD_LEVEL and
+    settings.OUTPUT_THREADS worker threads.  gzip and bgzf blocks are compressed on executor if
+    given, e.g. a thread pool shared by a resource file and its subset files.
+    """
+
+    check_codec(codec)
+
+    if codec == "gzip":
+        return ParallelGzipFile(fn, executor=executor)
+
+    elif codec == "bgzf":
+        return BgzfFile(fn, executor=executor)
+
+    elif codec == "zstd":
+        threads = settings.OUTPUT_THREADS if settings.OUTPUT_THREADS > 1 else 0
+        compressor = zstandard.ZstdCompressor(level=settings.OUTPUT_ZSTD_LEVEL, threads=threads)
+        return compressor.stream_writer(open(fn, "wb"), closefd=True)
+
+    elif codec == "lz4":
+        return lz4.frame.open(fn, "wb")
+
+    return open(fn, "wb")
+
+
+def detect_codec(fn: str) -> str:
+    """Detect codec of file from its magic bytes"""
+
+    with open(fn, "rb") as fi:
+        head = fi.read(4)
+
+    for (codec, codec_def) in codecs.items():
+        if codec_def["magic"] and head.startswith(codec_def["magic"]):
+            return codec
+
+    return "none"
+
+
+def open_input(fn: str, mode: str = "rt") -> IO:
+    """Open resource file written with any output codec for reading - codec is auto-detected
+
+    Args:
+        fn (str): resource file
+        mode (str): rt or rb
+
+    Returns:
+        IO: file object
+    """
+
+    codec = detect_codec(fn)
+    check_codec(codec)
+
+    if codec == "gzip":
+        return gzip.open(fn, mode)
+    elif codec == "zstd":
+        return zstandard.open(fn, mode)
+    elif codec == "lz4":
+        return lz4.frame.open(fn, mode)
+
+    return open(fn, mode)
+
+
+def subset_fn(fn: str, subset: str) -> str:
+    """Species subset filename of resource file, e.g. eg.jsonl.gz -> eg_hmrz.jsonl.gz"""
+
+    return re.sub(r"\.jsonl(\.\w+)?$", rf"_{subset}.jsonl\1", fn)
+
+
+@contextlib.contextmanager
+def open_term_writer(
+    fn: str, subsets: Mapping[str, Mapping[str, Collection[str]]] = settings.SPECIES_SUBSETS
+) -> Iterator[TermWriter]:
+    """Open resource file and its species subset files (settings.SPECIES_SUBSETS) as a TermWriter
+
+    Args:
+        fn (str): resource file, e.g. eg.jsonl.gz
+        subsets (Mapping[str, Mapping[str, Collection[str]]]): subset name -> species and clades,
+            written to subset_fn(fn, name)
+
+    Returns:
+        Iterator[TermWriter]: writer - all of the files are closed on exit
+
+    The files share one pool of settings.OUTPUT_THREADS compression threads.
+    """
+
+    subset_species = resolve_species_subsets(subsets)
+
+    with contextlib.ExitStack() as stack:
+        # Entered first so it is shut down after all of the files are closed
+        executor = None
+        if settings.OUTPUT_THREADS > 1:
+            executor = stack.enter_context(
+                concurrent.futures.ThreadPoolExecutor(max_workers=settings.OUTPUT_THREADS)
+            )
+
+        fo = stack.enter_context(open_output(fn, executor=executor))
+        subset_files = [
+            (stack.enter_context(open_output(subset_fn(fn, name), executor=executor)), species_keys)
+            for (name, species_keys) in subset_species.items()
+        ]
+
+        yield TermWriter(fo, subsets=subset_files)
@@ -25,7 +25,8 @@ import typer
 from app.common.collect_sources import get_ftp_file
 from app.common.resources import get_metadata, get_species_labels
 from app.common.text import quote_id
-from app.schemas.main import Term
+from app.common.writers import TermWriter, open_output, output_fn
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("CHANGEME_namespace")
@@ -40,7 +41,7 @@ species_key = "TAX:CHANGEME"
 
 download_url = "ftp://CHANGEME"
 download_fn = f"{settings.DOWNLOAD_DIR}/CHANGEME.gz"
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
 
 
 def build_json():
@@ -55,11 +56,13 @@ def build_json():
 
     species_labels = get_species_labels()
 
-    with gzip.open(download_fn, "rt") as fi, gzip.open(resource_fn, "wt") as fo:
+    with gzip.open(download_fn, "rt") as fi, open_output(resource_fn) as fo:
+
+        writer = TermWriter(fo)
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
+        writer.write_metadata(metadata)
 
         orig_data = json.load(fi)
 
@@ -67,7 +70,7 @@ def build_json():
 
             id = doc["CHANGEME"]
 
-            term = Term(
+            term = TermRecord(
                 key=f"{namespace}:{id}",
                 namespace=namespace,
                 id=id,
@@ -77,7 +80,7 @@ def build_json():
                 # species_label=species_labels[species_key],
             )
 
-            term.alt_ids = ["NS:1"]
+            term.alt_keys = ["NS:1"]
 
             # Synonyms
             term.synonyms.extend(["one", "two"])
@@ -92,7 +95,7 @@ def build_json():
             term.obsolete_keys.append("NS:1")
 
             # Add term to JSONL
-            fo.write("{}\n".format(json.dumps({"term": term.dict()})))
+            writer.write_term(term)
 
 
 def main(
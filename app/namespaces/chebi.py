@@ -13,19 +13,23 @@ import os
 import re
 import sys
 import tempfile
-from typing import Any, Iterable, List, Mapping
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
 
 import structlog
 import yaml
 
 import app.settings as settings
 import app.setup_logging
-import pronto
 import typer
-from app.common.collect_sources import get_ftp_file
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.collect_sources import download_sources
+from app.common.columnar import write_parquet
+from app.common.delta import release_delta
+from app.common.obo import iter_terms
 from app.common.resources import get_metadata
 from app.common.text import quote_id, strip_quotes
-from app.schemas.main import Term
+from app.common.writers import TermWriter, open_output, output_fn
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("chebi_namespace")
@@ -38,94 +42,106 @@ namespace_def = settings.NAMESPACE_DEFINITIONS[namespace_lc]
 
 download_url = "ftp://ftp.ebi.ac.uk/pub/databases/chebi/ontology/chebi.obo.gz"
 download_fn = f"{settings.DOWNLOAD_DIR}/chebi.obo.gz"
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
 
+sources = [(download_url, download_fn)]
 
-def build_json():
 
-    with gzip.open(download_fn, "rt") as fi, gzip.open(resource_fn, "wt") as fo:
+quoted_regex = re.compile('"(.*?)"')
+inchikey_regex = re.compile(r'inchikey\s"(.*?)"')
 
-        # Header JSONL record for terminology
-        metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
 
-        keyval_regex = re.compile("(\w[\-\w]+)\:\s(.*?)\s*$")
-        term_regex = re.compile("\[Term\]")
-        blankline_regex = re.compile("\s*$")
+def process_term(tags: List[Tuple[str, str]]) -> Optional[TermRecord]:
+    """Map OBO [Term] stanza tags to TermRecord - None for obsolete and 1 star terms"""
 
-        term = None
+    term = TermRecord(namespace=namespace, entity_types=["Abundance"])
 
-        unique_names = {}
+    for (key, val) in tags:
 
-        for line in fi:
-            term_match = term_regex.match(line)
-            blank_match = blankline_regex.match(line)
-            keyval_match = keyval_regex.match(line)
-            if term_match:
-                term = Term(namespace=namespace, entity_types=["Abundance"])
+        if key == "id":
+            term.id = val.replace("CHEBI:", "")
+            term.key = val
 
-            elif blank_match:  # On blank line save term record
-                # Add term to JSONL
-                if term and term.id:
-                    fo.write("{}\n".format(json.dumps({"term": term.dict()})))
+        elif key == "name":
+            term.name = val
+            term.label = val
+            term.alt_keys.append(f"CHEBI:{quote_id(val)}")
 
-                term = None
+        elif key == "subset":
+            if val not in ["2_STAR", "3_STAR"]:
+                return None
 
-            elif term and keyval_match:
-                key = keyval_match.group(1)
-                val = keyval_match.group(2)
+        elif key == "def":
+            val = val.replace("[]", "")
+            term.description = strip_quotes(val)
 
-                if key == "id":
-                    term.id = val.replace("CHEBI:", "")
-                    term.key = val
+        elif key == "synonym":
+            matches = quoted_regex.search(val)
+            if matches:
+                syn = matches.group(1)
+                term.synonyms.append(syn)
+            else:
+                log.warning(f"Unmatched synonym: {val}")
 
-                elif key == "name":
-                    term.name = val
-                    term.label = val
-                    term.alt_keys.append(f"CHEBI:{quote_id(val)}")
+        elif key == "alt_id":
+            term.alt_keys.append(val.strip())
 
-                elif key == "subset":
-                    if val not in ["2_STAR", "3_STAR"]:
-                        term = None
-                        continue
+        elif key == "property_value":
+            matches = inchikey_regex.search(val)
+            if matches:
+                inchikey = matches.group(1)
+                term.equivalence_keys.append(f"INCHIKEY:{inchikey}")
 
-                elif key == "def":
-                    val = val.replace("[]", "")
-                    term.description = strip_quotes(val)
+        elif key == "is_obsolete":
+            return None
 
-                elif key == "synonym":
-                    matches = re.search('"(.*?)"', val)
-                    if matches:
-                        syn = matches.group(1)
-                        term.synonyms.append(syn)
-                    else:
-                        log.warning(f"Unmatched synonym: {val}")
+    if not term.id:
+        return None
 
-                elif key == "alt_id":
-                    term.alt_keys.append(val.strip())
+    return term
 
-                elif key == "property_value":
-                    matches = re.search('inchikey\s"(.*?)"', val)
-                    if matches:
-                        inchikey = matches.group(1)
-                        term.equivalence_keys.append(f"INCHIKEY:{inchikey}")
 
-                elif key == "is_obsolete":
-                    term = None
+def build_json():
+
+    with gzip.open(download_fn, "rt") as fi, open_output(resource_fn) as fo:
+
+        writer = TermWriter(fo)
+
+        # Header JSONL record for terminology
+        metadata = get_metadata(namespace_def)
+        writer.write_metadata(metadata)
+
+        for term in iter_terms(fi, process_term):
+            writer.write_term(term)
 
 
 def main(
     overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
     force_download: bool = Option(False, help="Force re-downloading of source data file"),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
 ):
 
-    (changed, msg) = get_ftp_file(download_url, download_fn, force_download=force_download)
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_fn],
+        __file__,
+        config=namespace_def,
+    )
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json()
+        save_build_inputs(build_inputs)
 
-    if changed or overwrite:
-        build_json()
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
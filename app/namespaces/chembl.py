@@ -24,10 +24,14 @@ import yaml
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_chembl_version, get_ftp_file
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.columnar import write_parquet
+from app.common.collect_sources import download_sources, get_chembl_version
+from app.common.delta import release_delta
 from app.common.resources import get_metadata
 from app.common.text import quote_id, strip_quotes
-from app.schemas.main import Term
+from app.common.writers import TermWriter, open_output, output_fn
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("chembl_namespace")
@@ -44,9 +48,11 @@ chembl_version = get_chembl_version(
 
 download_url = f"ftp://ftp.ebi.ac.uk/pub/databases/chembl/ChEMBLdb/latest/chembl_{chembl_version}_sqlite.tar.gz"
 download_fn = f"{settings.DOWNLOAD_DIR}/chembl_{chembl_version}_sqlite.tar.gz"
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
 download_db_fn = f"{settings.DOWNLOAD_DIR}/chembl_{chembl_version}/chembl_{chembl_version}_sqlite/chembl_{chembl_version}.db"
 
+sources = [(download_url, download_fn)]
+
 
 def query_db() -> Iterable[Mapping[str, Any]]:
     """Generator to run chembl term queries using sqlite chembl db"""
@@ -121,11 +127,13 @@ def build_json():
     There are multiple tables that have to be joined and records collapsed to the Parent ID.
     """
 
-    with gzip.open(resource_fn, mode="wt") as fo:
+    with open_output(resource_fn) as fo:
+
+        writer = TermWriter(fo)
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
+        writer.write_metadata(metadata)
 
         for record in query_db():
             key = f"{namespace}:{record['src_id']}"
@@ -136,7 +144,7 @@ def build_json():
                 name = record["pref_name"]
                 label = name
 
-            term = Term(
+            term = TermRecord(
                 key=key,
                 namespace=namespace,
                 id=record["src_id"],
@@ -153,7 +161,7 @@ def build_json():
                 term.equivalence_keys.append(record["inchi_key"])
 
             # Add term to JSONL
-            fo.write("{}\n".format(json.dumps({"term": term.dict()})))
+            writer.write_term(term)
 
 
 def main(
@@ -163,17 +171,30 @@ def main(
     force_download: bool = Option(
         False, help="Force re-downloading of source data file"
     ),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
 ):
 
-    (changed, msg) = get_ftp_file(
-        download_url, download_fn, force_download=force_download
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_fn],
+        __file__,
+        config=namespace_def,
     )
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json()
+        save_build_inputs(build_inputs)
 
-    if changed or overwrite:
-        build_json()
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
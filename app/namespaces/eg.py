@@ -12,6 +12,7 @@ import gzip
 import json
 import os
 import re
+from typing import List, Mapping, Tuple
 
 import structlog
 import yaml
@@ -19,10 +20,21 @@ import yaml
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_ftp_file
-from app.common.resources import get_metadata, get_species_labels
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.collect_sources import download_sources
+from app.common.columnar import write_parquet
+from app.common.delta import release_delta
+from app.common.gene_history import GeneHistory, build_gene_history
+from app.common.parallel import chunked, ordered_map
+from app.common.resources import (
+    get_metadata,
+    get_species_labels,
+    species_labels_fn,
+    taxonomy_lineage_fns,
+)
 from app.common.text import quote_id
-from app.schemas.main import Term
+from app.common.writers import dumps, open_term_writer, output_fn, term_record
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("eg_namespace")
@@ -37,167 +49,182 @@ download_url = "ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/GENE_INFO/All_Data.gene_inf
 download_history_url = "ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/gene_history.gz"
 download_fn = f"{settings.DOWNLOAD_DIR}/eg.csv.gz"
 download_history_fn = f"{settings.DOWNLOAD_DIR}/eg_gene_history.json.gz"
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
-resource_fn_hmrz = f"{settings.DATA_DIR}/namespaces/{namespace_lc}_hmrz.jsonl.gz"
-hmrz_species = ["TAX:9606", "TAX:10090", "TAX:10116", "TAX:7955"]
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
 
+sources = [(download_url, download_fn), (download_history_url, download_history_fn)]
 
-def get_history():
-    """Get history of gene records
 
-    Returns:
-        Mapping[str, Mapping[str, int]]: history dict of dicts - new gene_id and old_gene_id
-    """
+# Map gene_types to BEL entity types
+bel_entity_type_map = {
+    "snoRNA": ["Gene", "RNA"],
+    "snRNA": ["Gene", "RNA"],
+    "ncRNA": ["Gene", "RNA"],
+    "tRNA": ["Gene", "RNA"],
+    "scRNA": ["Gene", "RNA"],
+    "other": ["Gene"],
+    "pseudo": ["Gene", "RNA"],
+    "unknown": ["Gene", "RNA", "Protein"],
+    "protein-coding": ["Gene", "RNA", "Protein"],
+    "rRNA": ["Gene", "RNA"],
+}
 
-    history = {}
-    with gzip.open(download_history_fn, "rt") as fi:
+# Lookups used by process_lines() - set in each worker process by init_worker()
+species_labels = {}
+history = None
 
-        fi.__next__()  # skip header line
 
-        for line in fi:
-            cols = line.split("\t")
+def init_worker(worker_species_labels, worker_history):
+    """Initialize process_lines() lookups in a worker process"""
+
+    global species_labels, history
+
+    species_labels = worker_species_labels
+    history = worker_history
 
-            (gene_id, old_gene_id,) = (
-                cols[1],
-                cols[2],
-            )
-            if gene_id != "-":
-                if history.get(gene_id, None):
-                    history[gene_id] = {old_gene_id: 1}
 
-    return history
+def process_lines(
+    lines: List[str],
+) -> Tuple[List[Tuple[bytes, List[str]]], Mapping[str, int], Mapping[str, int]]:
+    """Convert a block of gene_info lines into JSONL term records
 
+    Args:
+        lines (List[str]): All_Data.gene_info lines
+
+    Returns:
+        Tuple[List[Tuple[bytes, List[str]]], Mapping[str, int], Mapping[str, int]]: JSONL term
+            records with their species keys, equivalence prefixes collected and missing entity types
+    """
 
-def build_json():
+    out = []
+    collect_prefixes = {}
+    missing_entity_types = {}
+
+    # Discontinued gene ids of the genes in this block - one vectorized lookup
+    obsolete_ids = history.discontinued_many(int(line.split("\t", 2)[1]) for line in lines)
+
+    for line in lines:
+
+        cols = line.split("\t")
+        (tax_src_id, gene_id, symbol, syns, dbxrefs, desc, gene_type, name) = (
+            cols[0],
+            cols[1],
+            cols[2],
+            cols[4],
+            cols[5],
+            cols[8],
+            cols[9],
+            cols[11],
+        )
+        species_key = f"TAX:{tax_src_id}"
+
+        # Process synonyms
+        synonyms = []
+        syns = syns.rstrip()
+        if syns:
+            synonyms = syns.split("|")
+
+        # Process equivalences
+        equivalence_keys = []
+        dbxrefs = dbxrefs.rstrip()
+        if dbxrefs == "-":
+            dbxrefs = None
+        else:
+            dbxrefs = dbxrefs.split("|")
+        if dbxrefs is not None:
+            for dbxref in dbxrefs:
+                if "Ensembl:" in dbxref:
+                    equivalence_keys.append(dbxref)
+                elif "MGI:MGI" in dbxref:
+                    dbxref.replace("MGI:MGI:", "MGI:")
+                    equivalence_keys.append(dbxref)
+                elif "VGNC:VGNC:" in dbxref:
+                    dbxref.replace("VGNC:VGNC:", "VGNC:")
+                    equivalence_keys.append(dbxref)
+                elif "HGNC:HGNC:" in dbxref:
+                    dbxref.replace("HGNC:HGNC:", "HGNC:")
+                    equivalence_keys.append(dbxref)
+                else:
+                    (prefix, rest) = dbxref.split(":")
+                    collect_prefixes[prefix] = 1
+
+        if gene_type in ["miscRNA", "biological-region"]:  # Skip gene types
+            continue
+        elif gene_type not in bel_entity_type_map:
+            log.error(f"Unknown gene_type found {gene_type}")
+            missing_entity_types[gene_type] = 1
+            entity_types = None
+        else:
+            entity_types = bel_entity_type_map[gene_type]
+
+        if name == "-":
+            name = symbol
+
+        term = TermRecord(
+            key=f"{namespace}:{gene_id}",
+            namespace=namespace,
+            id=gene_id,
+            label=symbol,
+            name=name,
+            description=desc,
+            species_key=species_key,
+            species_label=species_labels.get(species_key, ""),
+            equivalence_keys=copy.copy(equivalence_keys),
+            synonyms=copy.copy(synonyms),
+        )
+
+        if entity_types:
+            term.entity_types = copy.copy(entity_types)
+
+        if int(gene_id) in obsolete_ids:
+            term.obsolete_keys = [f"{namespace}:{obs_id}" for obs_id in obsolete_ids[int(gene_id)]]
+
+        # Add term to JSONL
+        out.append((dumps(term_record(term)), [species_key]))
+
+    return (out, collect_prefixes, missing_entity_types)
+
+
+def build_json(workers: int = 1, chunk_size: int = 20000):
     """Build EG namespace json load file
 
     Args:
-        force (bool): build json result regardless of file mod dates
+        workers (int): number of processes used to convert gene_info lines to term records
+        chunk_size (int): number of gene_info lines sent to a worker at a time
 
     Returns:
         None
     """
 
-    metadata = get_metadata(namespace_def)
-    history = get_history()
-
     collect_prefixes = {}
+    missing_entity_types = {}
 
-    species_labels = get_species_labels()
+    # Gene history index - also used by the EG orthologs build
+    build_gene_history(download_history_fn)
 
-    missing_entity_types = {}
-    bel_entity_type_map = {
-        "snoRNA": ["Gene", "RNA"],
-        "snRNA": ["Gene", "RNA"],
-        "ncRNA": ["Gene", "RNA"],
-        "tRNA": ["Gene", "RNA"],
-        "scRNA": ["Gene", "RNA"],
-        "other": ["Gene"],
-        "pseudo": ["Gene", "RNA"],
-        "unknown": ["Gene", "RNA", "Protein"],
-        "protein-coding": ["Gene", "RNA", "Protein"],
-        "rRNA": ["Gene", "RNA"],
-    }
-
-    with gzip.open(download_fn, "rt") as fi, gzip.open(
-        resource_fn, "wt"
-    ) as fo, gzip.open(resource_fn_hmrz, "wt") as fz:
+    with gzip.open(download_fn, "rt") as fi, open_term_writer(resource_fn) as writer:
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
-        fz.write("{}\n".format(json.dumps({"metadata": metadata})))
+        writer.write_metadata(metadata)
 
         fi.__next__()  # skip header line
 
-        for line in fi:
-
-            cols = line.split("\t")
-            (tax_src_id, gene_id, symbol, syns, dbxrefs, desc, gene_type, name) = (
-                cols[0],
-                cols[1],
-                cols[2],
-                cols[4],
-                cols[5],
-                cols[8],
-                cols[9],
-                cols[11],
-            )
-            species_key = f"TAX:{tax_src_id}"
-
-            # Process synonyms
-            syns = syns.rstrip()
-            if syns:
-                synonyms = syns.split("|")
-
-            # Process equivalences
-            equivalence_keys = []
-            dbxrefs = dbxrefs.rstrip()
-            if dbxrefs == "-":
-                dbxrefs = None
-            else:
-                dbxrefs = dbxrefs.split("|")
-            if dbxrefs is not None:
-                for dbxref in dbxrefs:
-                    if "Ensembl:" in dbxref:
-                        equivalence_keys.append(dbxref)
-                    elif "MGI:MGI" in dbxref:
-                        dbxref.replace("MGI:MGI:", "MGI:")
-                        equivalence_keys.append(dbxref)
-                    elif "VGNC:VGNC:" in dbxref:
-                        dbxref.replace("VGNC:VGNC:", "VGNC:")
-                        equivalence_keys.append(dbxref)
-                    elif "HGNC:HGNC:" in dbxref:
-                        dbxref.replace("HGNC:HGNC:", "HGNC:")
-                        equivalence_keys.append(dbxref)
-                    else:
-                        (prefix, rest) = dbxref.split(":")
-                        collect_prefixes[prefix] = 1
-
-            if gene_type in ["miscRNA", "biological-region"]:  # Skip gene types
-                continue
-            elif gene_type not in bel_entity_type_map:
-                log.error(f"Unknown gene_type found {gene_type}")
-                missing_entity_types[gene_type] = 1
-                entity_types = None
-            else:
-                entity_types = bel_entity_type_map[gene_type]
-
-            if name == "-":
-                name = symbol
-
-            term = Term(
-                key=f"{namespace}:{gene_id}",
-                namespace=namespace,
-                id=gene_id,
-                label=symbol,
-                name=name,
-                description=desc,
-                species_key=species_key,
-                species_label=species_labels.get(species_key, ""),
-                equivalence_keys=copy.copy(equivalence_keys),
-                synonyms=copy.copy(synonyms),
-            )
-
-            if entity_types:
-                term.entity_types = copy.copy(entity_types)
-
-            # TODO - check that this is working correctly
-            if gene_id in history:
-                term.obsolete_keys = [
-                    f"{namespace}:{obs_id}" for obs_id in history[gene_id].keys()
-                ]
-
-            # Add term to JSONL
-            fo.write("{}\n".format(json.dumps({"term": term.dict()})))
-
-            if species_key in hmrz_species:
-                fz.write("{}\n".format(json.dumps({"term": term.dict()})))
+        # Results are returned in file order so output matches the serial (workers=1) build
+        for (out, prefixes, missing) in ordered_map(
+            process_lines,
+            chunked(fi, chunk_size),
+            workers=workers,
+            initializer=init_worker,
+            initargs=(get_species_labels(), GeneHistory()),
+        ):
+            writer.write_lines(out)
+            collect_prefixes.update(prefixes)
+            missing_entity_types.update(missing)
 
     log.info(f"Equivalence Prefixes {json.dumps(collect_prefixes, indent=4)}")
 
     if missing_entity_types:
-        log.error("Missing Entity Types:\n", json.dumps(missing_entity_types))
+        log.error(f"Missing Entity Types:\n{json.dumps(missing_entity_types)}")
 
 
 def main(
@@ -207,20 +234,35 @@ def main(
     force_download: bool = Option(
         False, help="Force re-downloading of source data file"
     ),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
+    workers: int = Option(1, help="Number of processes used to build the namespace"),
 ):
 
-    (changed, msg) = get_ftp_file(
-        download_url, download_fn, force_download=force_download
-    )
-    (changed_history, msg_history) = get_ftp_file(
-        download_history_url, download_history_fn, force_download=force_download
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_fn, download_history_fn, species_labels_fn, *taxonomy_lineage_fns],
+        __file__,
+        config={
+            "namespace": namespace_def,
+            "taxonomy_labels": settings.TAXONOMY_LABELS,
+            "species_subsets": settings.SPECIES_SUBSETS,
+        },
     )
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json(workers=workers)
+        save_build_inputs(build_inputs)
 
-    if changed or overwrite:
-        build_json()
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
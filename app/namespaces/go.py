@@ -15,7 +15,7 @@ import re
 import sys
 import tempfile
 from pathlib import Path
-from typing import TextIO
+from typing import List, Optional, TextIO, Tuple
 
 import structlog
 import yaml
@@ -23,10 +23,16 @@ import yaml
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_web_file
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.collect_sources import download_sources
+from app.common.columnar import write_parquet
+from app.common.delta import release_delta
+from app.common.graph import Dag
+from app.common.obo import iter_terms
 from app.common.resources import get_metadata
 from app.common.text import quote_id
-from app.schemas.main import Term
+from app.common.writers import TermWriter, open_output, output_fn
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("go_namespace")
@@ -39,128 +45,104 @@ namespace_def = settings.NAMESPACE_DEFINITIONS[namespace_lc]
 
 download_url = "http://purl.obolibrary.org/obo/go.obo"
 download_fn = f"{settings.DOWNLOAD_DIR}/go.obo.gz"
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
+
+sources = [(download_url, download_fn)]
 
 complex_parent_id = "GO:0032991"
 
+quoted_regex = re.compile('"(.*?)"')
+is_a_regex = re.compile(r"GO:(\d+)")
+
+
+def process_term(tags: List[Tuple[str, str]]) -> Optional[TermRecord]:
+    """Map OBO [Term] stanza tags to TermRecord - None for obsolete terms"""
+
+    term = TermRecord(namespace=namespace)
+
+    for (key, val) in tags:
 
-def is_parent(check_id, target_parent_id, parent_ids) -> bool:
-    """Check to see if target_parent_id is a parent of check_id"""
+        if key == "id":
+            term.id = val.replace("GO:", "")
+            term.key = f"{namespace}:{term.id}"
 
-    if check_id in parent_ids:
+        elif key == "name":
+            term.label = val
+            term.name = val
 
-        for parent_id in parent_ids[check_id]:
-            result = is_parent(parent_id, target_parent_id, parent_ids)
+            label_id = quote_id(val)
+            term.alt_keys.append(f"{namespace}:{label_id}")
 
-            if result is True:
-                return result
-            elif target_parent_id == parent_id:
-                return True
+        elif key == "is_obsolete":
+            return None
+
+        elif key == "def":
+            matches = quoted_regex.search(val)
+            if matches:
+                description = matches.group(1).strip()
+                term.description = description
+
+        elif key == "synonym":
+            matches = quoted_regex.search(val)
+            if matches:
+                syn = matches.group(1).strip()
+                term.synonyms.append(syn)
             else:
-                return False
+                log.warning(f"Unmatched synonym: {val}")
+
+        elif key == "alt_id":
+            val = val.replace("DOID", "DO").strip()
+            term.alt_keys.append(val)
+
+        elif key == "is_a":
+            matches = is_a_regex.match(val)
+            if matches:
+                parent_id = matches.group(1)
+                term.parent_keys.append(f"{namespace}:{parent_id}")
+
+        elif key == "namespace":
+            if "biological_process" == val:
+                term.entity_types.append("BiologicalProcess")
+            elif "cellular_component" == val:
+                term.entity_types.append("Location")
+                term.annotation_types.append("CellStructure")
+            elif "molecular_function" == val:
+                term.entity_types.append("Activity")
+
+    if not term.id:
+        return None
+
+    return term
 
 
 def build_json():
 
-    # collect parents/hierarchy
-    parent_ids = {}
+    # Single pass over the OBO file - terms are held until the is_a hierarchy is complete
+    hierarchy = Dag()
+    terms = []
     with gzip.open(download_fn, "rt") as fi:
-        id_re = re.compile("id:\s+(\S+)\s*")
-        isa_re = re.compile("is_a:\s+(\S+)\s")
-
-        for line in fi:
-            id_match = id_re.match(line)
-            isa_match = isa_re.match(line)
-            if id_match:
-                goid = id_match.group(1)
-            if isa_match:
-                isa_id = isa_match.group(1)
-                if goid in parent_ids:
-                    parent_ids[goid][isa_id] = 1
-                else:
-                    parent_ids[goid] = {isa_id: 1}
-
-    with gzip.open(download_fn, "rt") as fi, gzip.open(resource_fn, "wt") as fo:
+        for term in iter_terms(fi, process_term):
+            for parent_key in term.parent_keys:
+                hierarchy.add_edge(term.key, parent_key)
+            terms.append(term)
+
+    complex_keys = hierarchy.descendants(complex_parent_id)
+
+    with open_output(resource_fn) as fo:
+
+        writer = TermWriter(fo)
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
-
-        keyval_regex = re.compile("(\w[\-\w]+)\:\s(.*?)\s*$")
-        term_regex = re.compile("\[Term\]")
-        blankline_regex = re.compile("\s*$")
-
-        term = None
-        obsolete_flag = False
-
-        for line in fi:
-            term_match = term_regex.match(line)
-            blank_match = blankline_regex.match(line)
-            keyval_match = keyval_regex.match(line)
-
-            if term_match:
-                obsolete_flag = False
-                term = Term(namespace=namespace)
-
-            elif blank_match:
-                # Add term to JSONL
-                if not obsolete_flag and term and term.id:
-                    fo.write("{}\n".format(json.dumps({"term": term.dict()})))
-                    term = None
-
-            elif term and keyval_match:
-                key = keyval_match.group(1)
-                val = keyval_match.group(2)
-
-                if key == "id":
-                    term.id = val.replace("GO:", "")
-                    term.key = f"{namespace}:{term.id}"
-
-                    if is_parent(term.key, complex_parent_id, parent_ids):
-                        term.entity_types.append("Complex")
-
-                elif key == "name":
-                    term.label = val
-                    term.name = val
-
-                    label_id = quote_id(val)
-                    term.alt_keys.append(f"{namespace}:{label_id}")
-
-                elif key == "is_obsolete":
-                    obsolete_flag = True
-
-                elif key == "def":
-                    matches = re.search('"(.*?)"', val)
-                    if matches:
-                        description = matches.group(1).strip()
-                        term.description = description
-
-                elif key == "synonym":
-                    matches = re.search('"(.*?)"', val)
-                    if matches:
-                        syn = matches.group(1).strip()
-                        term.synonyms.append(syn)
-                    else:
-                        log.warning(f"Unmatched synonym: {val}")
-
-                elif key == "alt_id":
-                    val = val.replace("DOID", "DO").strip()
-                    term.alt_keys.append(val)
-
-                elif key == "is_a":
-                    matches = re.match("DOID:(\d+)\s", val)
-                    if matches:
-                        parent_id = matches.group(1)
-                        term.parent_keys.append(f"DO:{parent_id}")
-
-                elif key == "namespace":
-                    if "biological_process" == val:
-                        term.entity_types.append("BiologicalProcess")
-                    elif "cellular_component" == val:
-                        term.entity_types.append("Location")
-                        term.annotation_types.append("CellStructure")
-                    elif "molecular_function" == val:
-                        term.entity_types.append("Activity")
+        writer.write_metadata(metadata)
+
+        for term in terms:
+            if term.key in complex_keys:
+                term.entity_types.insert(0, "Complex")
+
+            term.child_keys = list(hierarchy.children.get(term.key, []))
+
+            writer.write_term(term)
 
 
 def main(
@@ -170,17 +152,30 @@ def main(
     force_download: bool = Option(
         False, help="Force re-downloading of source data file"
     ),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
 ):
 
-    (changed, msg) = get_web_file(
-        download_url, download_fn, force_download=force_download
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_fn],
+        __file__,
+        config=namespace_def,
     )
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json()
+        save_build_inputs(build_inputs)
 
-    if changed or overwrite:
-        build_json()
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
@@ -19,10 +19,14 @@ import yaml
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_ftp_file, get_mesh_version
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.columnar import write_parquet
+from app.common.collect_sources import download_sources, get_mesh_version
+from app.common.delta import release_delta
 from app.common.resources import get_metadata, get_species_labels
 from app.common.text import quote_id
-from app.schemas.main import Term
+from app.common.writers import TermWriter, open_output, output_fn
+from app.schemas.main import TermRecord
 from typer import Option
 
 # TODO - figure out how to add the children attributes - complicated by the fact that only
@@ -50,7 +54,12 @@ download_descriptors_url = (
 )
 download_descriptors_fn = f"{settings.DOWNLOAD_DIR}/mesh_d{version}.bin.gz"
 
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
+
+sources = [
+    (download_concepts_url, download_concepts_fn),
+    (download_descriptors_url, download_descriptors_fn),
+]
 
 
 def process_types(mesh_tree_ids):
@@ -107,11 +116,13 @@ def build_json():
 
     with gzip.open(download_descriptors_fn, "rt") as fid, gzip.open(
         download_concepts_fn, "rt"
-    ) as fic, gzip.open(resource_fn, "wt") as fo:
+    ) as fic, open_output(resource_fn) as fo:
+
+        writer = TermWriter(fo)
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
+        writer.write_metadata(metadata)
 
         mesh_tree_ids = []
 
@@ -120,7 +131,7 @@ def build_json():
             blank_match = blankline_regex.match(line)
 
             if line.startswith("*NEWRECORD"):
-                term = Term(namespace=namespace)
+                term = TermRecord(namespace=namespace)
                 mesh_tree_ids = []
 
             elif blank_match:
@@ -135,7 +146,7 @@ def build_json():
 
                     if entity_types or annotation_types:
                         # Add term to JSONL
-                        fo.write("{}\n".format(json.dumps({"term": term.dict()})))
+                        writer.write_term(term)
 
                     # Linking to concept records
                     links[term.name] = (term.key, entity_types, annotation_types)
@@ -176,7 +187,7 @@ def build_json():
             blank_match = blankline_regex.match(line)
 
             if line.startswith("*NEWRECORD"):
-                term = Term(namespace=namespace)
+                term = TermRecord(namespace=namespace)
                 mesh_heading = ""
 
             elif blank_match:
@@ -192,7 +203,7 @@ def build_json():
 
                     if entity_types or annotation_types:
                         # Add term to JSONL
-                        fo.write("{}\n".format(json.dumps({"term": term.dict()})))
+                        writer.write_term(term)
 
             # term.id
             elif line.startswith("UI = "):
@@ -219,20 +230,30 @@ def build_json():
 def main(
     overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
     force_download: bool = Option(False, help="Force re-downloading of source data file"),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
 ):
 
-    (changed_concepts, msg) = get_ftp_file(
-        download_concepts_url, download_concepts_fn, force_download=force_download
-    )
-    (changed_descriptors, msg) = get_ftp_file(
-        download_descriptors_url, download_descriptors_fn, force_download=force_download
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_concepts_fn, download_descriptors_fn],
+        __file__,
+        config=namespace_def,
     )
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed_descriptors)
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json()
+        save_build_inputs(build_inputs)
 
-    if changed_descriptors or overwrite:
-        build_json()
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
@@ -12,7 +12,7 @@ import gzip
 import json
 import os
 import re
-from typing import Any, List, Mapping
+from typing import Any, BinaryIO, Iterable, Iterator, List, Mapping, Tuple
 
 import structlog
 import yaml
@@ -20,10 +20,21 @@ import yaml
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_ftp_file
-from app.common.resources import get_metadata, get_species_labels
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.collect_sources import download_sources
+from app.common.columnar import write_parquet
+from app.common.delta import release_delta
+from app.common.parallel import chunked, ordered_map
+from app.common.resources import (
+    get_metadata,
+    get_species_labels,
+    save_json,
+    species_labels_fn,
+    taxonomy_lineage_fns,
+)
 from app.common.text import quote_id
-from app.schemas.main import Term
+from app.common.writers import dumps, open_output, open_term_writer, output_fn, term_record
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("sp_namespace")
@@ -41,19 +52,51 @@ namespace_def = settings.NAMESPACE_DEFINITIONS[namespace_lc]
 
 download_url = "ftp://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/uniprot_sprot.dat.gz"
 download_fn = f"{settings.DOWNLOAD_DIR}/sp_uniprot_sprot.dat.gz"
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
-resource_fn_hmrz = f"{settings.DATA_DIR}/namespaces/{namespace_lc}_hmrz.jsonl.gz"
-hmrz_species = ["TAX:9606", "TAX:10090", "TAX:10116", "TAX:7955"]
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
+
+sources = [(download_url, download_fn)]
+
+# TrEMBL terms are added to the Uniprot namespace as sharded files with a manifest
+trembl_namespace = "UP"
+trembl_namespace_def = settings.NAMESPACE_DEFINITIONS[trembl_namespace.lower()]
+download_trembl_url = "ftp://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/uniprot_trembl.dat.gz"
+download_trembl_fn = f"{settings.DOWNLOAD_DIR}/sp_uniprot_trembl.dat.gz"
+trembl_shard_fn_template = output_fn(f"{settings.DATA_DIR}/namespaces/tr.part-{{shard:04d}}.jsonl")
+trembl_shard_fn_regex = re.compile(r"^tr\.part-(\d+)\.jsonl")
+trembl_manifest_fn = f"{settings.DATA_DIR}/namespaces/tr.manifest.json"
+trembl_checkpoint_fn = f"{settings.DATA_DIR}/namespaces/tr.checkpoint.json"
+trembl_sources = [(download_trembl_url, download_trembl_fn)]
 
 species_labels = get_species_labels()
 model_org_prefixes = ["HGNC", "MGI", "RGD", "ZFIN"]
 model_org_prefix_str = "|".join(model_org_prefixes)
 
-def process_record(record: List[str]) -> Term:
+# Dat file line types used by process_record() - all other line types are skipped
+record_line_types = {"ID", "AC", "OX", "DR", "DE", "GN"}
+
+id_regex = re.compile(r"^ID\s+(\w+);?")
+ac_prefix_regex = re.compile(r"^AC\s+")
+ac_end_regex = re.compile(r";$")
+ac_sep_regex = re.compile(r";\s+")
+ox_regex = re.compile(r"^OX\s+NCBI_TaxID=(\d+)")
+dr_regex = re.compile(r"^DR\s+(\w+);\s(\w+);\s([\w\-]+)\.")
+de_gn_regex = re.compile(r"^(DE|GN)\s+")
+evidence_regex = re.compile(" {.*?}", flags=re.S)
+gn_name_regex = re.compile("Name=(.*?)[;{]+")
+gn_synonyms_regex = re.compile("Synonyms=(.*?);")
+gn_orfnames_regex = re.compile("ORFNames=(.*?);")
+model_org_regex = re.compile(model_org_prefix_str)
+de_recname_regex = re.compile(r"RecName:(.*?;)\s*(\w+:)?")
+de_altname_regex = re.compile(r"AltName:(.*?;)\s*\w+:")
+de_keyval_regex = re.compile(r"\s*(\w+)=(.*?);")
+
+
+def process_record(record: List[str], namespace: str = namespace) -> TermRecord:
     """Process SwissProt Dat file record
 
     Args:
         record (List[str]): array of swissprot dat file for one protein
+        namespace (str): namespace for the term - SP or UP for TrEMBL records
 
     Returns:
         Mapping[str, Any]: term record for namespace
@@ -66,61 +109,68 @@ def process_record(record: List[str]) -> Term:
 
     for line in record:
 
+        # Dispatch on the two character line type instead of trying every regex on every line
+        line_type = line[:2]
+        if line_type not in record_line_types:
+            continue
+
         # Get ID
-        match = re.match("^ID\s+(\w+);?", line)
-        if match:
-            entry_name = match.group(1)
+        if line_type == "ID":
+            match = id_regex.match(line)
+            if match:
+                entry_name = match.group(1)
 
         # Get accessions
-        if re.match("^AC", line):
-            ac_line = re.sub("^AC\s+", "", line).rstrip()
-            ac_line = re.sub(";$", "", ac_line)
-            ac_line = re.sub(";\s+", ";", ac_line)
+        elif line_type == "AC":
+            ac_line = ac_prefix_regex.sub("", line).rstrip()
+            ac_line = ac_end_regex.sub("", ac_line)
+            ac_line = ac_sep_regex.sub(";", ac_line)
             accessions.extend(ac_line.split(";"))
 
         # Get Taxonomy ID
-        match = re.match("^OX\s+NCBI_TaxID=(\d+)", line)
-        if match:
-            species_id = match.group(1)
-            species_key = f"TAX:{species_id}"
+        elif line_type == "OX":
+            match = ox_regex.match(line)
+            if match:
+                species_id = match.group(1)
+                species_key = f"TAX:{species_id}"
 
         # Get Equivalences
-        match = re.match("^DR\s+(\w+);\s(\w+);\s([\w\-]+)\.", line)
-        if match:
-            (db, db_id, extra) = match.group(1, 2, 3)
-            if db == "HGNC":
-                equivalences.append(f"{db}:{extra}")
-                # print(equivalences)
-            elif db == "MGI":
-                equivalences.append(f"{db}:{extra}")
-                # print(equivalences)
-            if db == "RGD":
-                equivalences.append(f"{db}:{extra}")
-                # print(equivalences)
-            elif db == "GeneID":
-                equivalences.append(f"EG:{db_id}")
-                # print(equivalences)
-
-        if re.match("^DE\s+", line):
-            de += line.replace("DE", "").strip()
-        if re.match("^GN\s+", line):
-            gn += line.replace("GN", "").strip()
+        elif line_type == "DR":
+            match = dr_regex.match(line)
+            if match:
+                (db, db_id, extra) = match.group(1, 2, 3)
+                if db == "HGNC":
+                    equivalences.append(f"{db}:{extra}")
+                elif db == "MGI":
+                    equivalences.append(f"{db}:{extra}")
+                if db == "RGD":
+                    equivalences.append(f"{db}:{extra}")
+                elif db == "GeneID":
+                    equivalences.append(f"EG:{db_id}")
+
+        elif line_type == "DE":
+            if de_gn_regex.match(line):
+                de += line.replace("DE", "").strip()
+
+        elif line_type == "GN":
+            if de_gn_regex.match(line):
+                gn += line.replace("GN", "").strip()
 
     synonyms = []
     name = None
     full_name = None
 
     # GN - gene names processing
-    gn = re.sub(" {.*?}", "", gn, flags=re.S)
-    match = re.search("Name=(.*?)[;{]+", gn)
+    gn = evidence_regex.sub("", gn)
+    match = gn_name_regex.search(gn)
     if match:
         name = match.group(1)
-    match = re.search("Synonyms=(.*?);", gn)
+    match = gn_synonyms_regex.search(gn)
     if match:
         syns = match.group(1)
         synonyms.extend(syns.split(", "))
 
-    match = re.search("ORFNames=(.*?);", gn)
+    match = gn_orfnames_regex.search(gn)
     if match:
         syns = match.group(1)
         orfnames = syns.split(", ")
@@ -141,42 +191,39 @@ def process_record(record: List[str]) -> Term:
 
     eg_equivalences = [e for e in equivalences if e.startswith("EG")]
     if len(eg_equivalences) > 1:
-        model_org_equivalences = [e for e in equivalences if re.match(model_org_prefix_str, e)]
+        model_org_equivalences = [e for e in equivalences if model_org_regex.match(e)]
         if len(model_org_equivalences) >= 1:
             equivalences = [model_org_equivalences[0]]
         else:
             equivalences = [eg_equivalences[0]]
 
     # DE - name processing
-    log.debug(f"DE {de}")
-    de = re.sub(" {.*?}", "", de, flags=re.S)
-    match = re.search("RecName:(.*?;)\s*(\w+:)?", de)
+    de = evidence_regex.sub("", de)
+    match = de_recname_regex.search(de)
     if match:
         recname_grp = match.group(1)
-        match_list = re.findall("\s*(\w+)=(.*?);", recname_grp)
+        match_list = de_keyval_regex.findall(recname_grp)
         for key, val in match_list:
             if key == "Full":
                 full_name = val
             if not name and key == "Short":
                 name = val
 
-            log.debug(f"DE RecName Key: {key}  Val: {val}")
         if not name and full_name:  # Use long name for protein name if all else fails
             name = full_name
 
-    match = re.search("AltName:(.*?;)\s*\w+:", de, flags=0)
+    match = de_altname_regex.search(de)
     if match:
         altname_grp = match.group(1)
-        match_list = re.findall("\s*(\w+)=(.*?);", altname_grp)
+        match_list = de_keyval_regex.findall(altname_grp)
         for key, val in match_list:
             if key in ["Full", "Short"]:
                 synonyms.append(val)
-            log.debug(f"DE AltName Key: {key}  Val: {val}")
 
     if not name:
         name = entry_name
 
-    term = Term(
+    term = TermRecord(
         key=f"{namespace}:{accessions[0]}",
         namespace=namespace,
         id=accessions[0],
@@ -201,44 +248,280 @@ def process_record(record: List[str]) -> Term:
     return term
 
 
-def build_json():
-    """Build Swissprot namespace jsonl load file"""
+def iter_records(fi: Iterable[str]) -> Iterator[List[str]]:
+    """Split dat file into records - each record is the list of lines up to and including the // line"""
+
+    record = []
+    for line in fi:
+        record.append(line)
+
+        if line.startswith("//"):
+            yield record
+            record = []
+
+
+def process_records(records: List[List[str]]) -> List[Tuple[bytes, List[str]]]:
+    """Convert a batch of dat file records into JSONL term records
+
+    Args:
+        records (List[List[str]]): dat file records
+
+    Returns:
+        List[Tuple[bytes, List[str]]]: JSONL term records with their species keys
+    """
+
+    out = []
+    for record in records:
+        term = process_record(record)
+        out.append((dumps(term_record(term)), [term.species_key]))
+
+    return out
+
+
+def build_json(workers: int = 1, batch_size: int = 2000):
+    """Build Swissprot namespace jsonl load file
 
-    with gzip.open(download_fn, "rt") as fi, gzip.open(resource_fn, "wt") as fo, gzip.open(
-        resource_fn_hmrz, "wt"
-    ) as fz:
+    Args:
+        workers (int): number of processes used to convert dat file records to term records
+        batch_size (int): number of dat file records sent to a worker at a time
+    """
+
+    with gzip.open(download_fn, "rt") as fi, open_term_writer(resource_fn) as writer:
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
-        fz.write("{}\n".format(json.dumps({"metadata": metadata})))
+        writer.write_metadata(metadata)
+
+        # Results are returned in file order so output matches the serial (workers=1) build
+        for out in ordered_map(
+            process_records, chunked(iter_records(fi), batch_size), workers=workers
+        ):
+            writer.write_lines(out)
+
+
+def iter_trembl_records(fi: BinaryIO, offset: int) -> Iterator[Tuple[List[str], int]]:
+    """Split binary dat file stream into records with the uncompressed byte offset of the record end
+
+    Args:
+        fi (BinaryIO): decompressed dat file stream positioned at offset
+        offset (int): starting uncompressed byte offset
+
+    Returns:
+        Iterator[Tuple[List[str], int]]: record lines and offset just past the record's // line
+    """
+
+    record = []
+    for line in fi:
+        offset += len(line)
+        record.append(line.decode("utf-8"))
+
+        if line.startswith(b"//"):
+            yield (record, offset)
+            record = []
+
+
+def process_trembl_records(records: List[Tuple[List[str], int]]) -> Tuple[bytes, int, int]:
+    """Convert a batch of TrEMBL records into JSONL term records
+
+    Args:
+        records (List[Tuple[List[str], int]]): dat file records with their end offsets
+
+    Returns:
+        Tuple[bytes, int, int]: JSONL, number of terms and the end offset of the last record
+    """
+
+    out = []
+    for (record, offset) in records:
+        term = process_record(record, namespace=trembl_namespace)
+        out.append(dumps(term_record(term)))
+
+    return (b"".join(out), len(out), records[-1][1])
+
+
+def load_trembl_checkpoint(restart: bool = False) -> Mapping[str, Any]:
+    """Load TrEMBL build checkpoint if it matches the current download file
+
+    Args:
+        restart (bool): ignore any existing checkpoint
+
+    Returns:
+        Mapping[str, Any]: checkpoint with uncompressed source offset, next shard number and finished shards
+    """
+
+    source_stat = os.stat(download_trembl_fn)
+    checkpoint = {
+        "source_fn": download_trembl_fn,
+        "source_size": source_stat.st_size,
+        "source_mtime": source_stat.st_mtime,
+        "offset": 0,
+        "shard": 0,
+        "shards": [],
+    }
+
+    if restart or not os.path.exists(trembl_checkpoint_fn):
+        return checkpoint
+
+    with open(trembl_checkpoint_fn, "r") as fi:
+        saved = json.load(fi)
 
-        record = []
-        for line in fi:
-            record.append(line)
+    if (saved["source_size"], saved["source_mtime"]) != (
+        checkpoint["source_size"],
+        checkpoint["source_mtime"],
+    ):
+        log.info("TrEMBL download file changed since checkpoint - restarting build")
+        return checkpoint
 
-            if re.match("^//", line):
-                term = process_record(record)
+    log.info("Resuming TrEMBL build", offset=saved["offset"], shard=saved["shard"])
 
-                fo.write("{}\n".format(json.dumps({"term": term.dict()})))
-                if term.species_key in hmrz_species:
-                    fz.write("{}\n".format(json.dumps({"term": term.dict()})))
+    return saved
 
-                record = []
+
+def remove_trembl_shards(first_shard: int = 0):
+    """Remove TrEMBL shard files and key indexes numbered first_shard and up
+
+    These are left over from an earlier (possibly larger) build or from the unfinished shard of
+    an interrupted build and would otherwise be mixed in with the shards of this build.
+    """
+
+    dirname = os.path.dirname(trembl_shard_fn_template)
+    if not os.path.isdir(dirname):
+        return
+
+    for name in os.listdir(dirname):
+        match = trembl_shard_fn_regex.match(name)
+        if match and int(match.group(1)) >= first_shard:
+            os.remove(os.path.join(dirname, name))
+
+
+def build_trembl_json(
+    workers: int = 1, batch_size: int = 2000, shard_size: int = 1000000, restart: bool = False
+):
+    """Build TrEMBL (UP) namespace as sharded jsonl load files
+
+    Streams the dat file with bounded memory.  A checkpoint with the uncompressed byte offset
+    and shard number is saved after each shard is finished so a killed build resumes from the
+    last finished shard.  Resuming still decompresses the source file up to the offset but
+    skips parsing it.
+
+    Args:
+        workers (int): number of processes used to convert dat file records to term records
+        batch_size (int): number of dat file records sent to a worker at a time
+        shard_size (int): number of terms per shard file (shards are cut at batch boundaries)
+        restart (bool): ignore any existing checkpoint and rebuild all shards
+    """
+
+    checkpoint = load_trembl_checkpoint(restart=restart)
+    metadata = get_metadata(trembl_namespace_def)
+
+    # The manifest is only written once all of the shards are finished
+    if os.path.exists(trembl_manifest_fn):
+        os.remove(trembl_manifest_fn)
+    remove_trembl_shards(checkpoint["shard"])
+
+    def start_shard():
+        fn = trembl_shard_fn_template.format(shard=checkpoint["shard"])
+        fo = open_output(fn)
+        fo.write(dumps({"metadata": metadata}))
+        return (fn, fo, 0)
+
+    def finish_shard(fn, fo, count, offset):
+        fo.close()
+        checkpoint["shards"].append({"fn": os.path.basename(fn), "terms": count})
+        checkpoint["shard"] += 1
+        checkpoint["offset"] = offset
+        save_json(trembl_checkpoint_fn, checkpoint)
+
+    with gzip.open(download_trembl_fn, "rb") as fi:
+
+        if checkpoint["offset"]:
+            fi.seek(checkpoint["offset"])
+
+        (fn, fo, count) = start_shard()
+        for (out, batch_count, offset) in ordered_map(
+            process_trembl_records,
+            chunked(iter_trembl_records(fi, checkpoint["offset"]), batch_size),
+            workers=workers,
+        ):
+            fo.write(out)
+            count += batch_count
+
+            if count >= shard_size:
+                finish_shard(fn, fo, count, offset)
+                (fn, fo, count) = start_shard()
+
+        if count:
+            finish_shard(fn, fo, count, fi.tell())
+        else:
+            fo.close()
+            os.remove(fn)
+
+    manifest = {
+        "metadata": metadata,
+        "shards": checkpoint["shards"],
+        "terms": sum(shard["terms"] for shard in checkpoint["shards"]),
+    }
+    save_json(trembl_manifest_fn, manifest)
+    if os.path.exists(trembl_checkpoint_fn):
+        os.remove(trembl_checkpoint_fn)
 
 
 def main(
     overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
     force_download: bool = Option(False, help="Force re-downloading of source data file"),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
+    workers: int = Option(1, help="Number of processes used to build the namespace"),
+    trembl: bool = Option(False, help="Build the TrEMBL (UP) namespace shards instead of SwissProt"),
+    restart: bool = Option(False, help="Ignore any TrEMBL build checkpoint and start over"),
 ):
 
-    (changed, msg) = get_ftp_file(download_url, download_fn, force_download=force_download)
+    if trembl:
+        if download:
+            download_sources(trembl_sources, force_download=force_download)
+
+        build_inputs = get_build_inputs(
+            f"{trembl_namespace.lower()}_namespace",
+            [download_trembl_fn, species_labels_fn, *taxonomy_lineage_fns],
+            __file__,
+            config={"namespace": trembl_namespace_def, "taxonomy_labels": settings.TAXONOMY_LABELS},
+        )
+
+        # An unfinished build is resumed even if the build inputs haven't changed
+        if (
+            overwrite
+            or restart
+            or os.path.exists(trembl_checkpoint_fn)
+            or needs_rebuild(build_inputs)
+        ):
+            build_trembl_json(workers=workers, restart=restart)
+            save_build_inputs(build_inputs)
+
+        return
+
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_fn, species_labels_fn, *taxonomy_lineage_fns],
+        __file__,
+        config={
+            "namespace": namespace_def,
+            "taxonomy_labels": settings.TAXONOMY_LABELS,
+            "species_subsets": settings.SPECIES_SUBSETS,
+        },
+    )
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json(workers=workers)
+        save_build_inputs(build_inputs)
 
-    if changed or overwrite:
-        build_json()
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ Usage:  tax.py
 
 """
 
+import array
 import copy
 import datetime
 import gzip
@@ -13,19 +14,25 @@ import json
 import os
 import re
 import tarfile
-import tempfile
-import sys
+from typing import Iterable
 
+import numpy as np
 import structlog
 import yaml
 
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_ftp_file
-from app.common.resources import get_metadata, get_species_labels
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.collect_sources import download_sources
+from app.common.columnar import write_parquet
+from app.common.delta import release_delta
+from app.common.resources import get_metadata, species_labels_fn, species_labels_json_fn
+from app.common.species_labels import write_species_label_store
+from app.common.taxonomy import compute_lineage, save_lineage
 from app.common.text import quote_id
-from app.schemas.main import Term
+from app.common.writers import open_output, open_term_writer, output_fn
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("tax_namespace")
@@ -39,153 +46,258 @@ namespace_def = settings.NAMESPACE_DEFINITIONS[namespace_lc]
 download_url = "ftp://ftp.ncbi.nih.gov/pub/taxonomy/taxdump.tar.gz"
 download_fn = f"{settings.DOWNLOAD_DIR}/taxdump.tar.gz"
 
-species_labels_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}_labels.json.gz"
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
-resource_fn_hmrz = f"{settings.DATA_DIR}/namespaces/{namespace_lc}_hmrz.jsonl.gz"
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
 
-hmrz_species = ["TAX:9606", "TAX:10090", "TAX:10116", "TAX:7955"]
 
+sources = [(download_url, download_fn)]
 
-def build_json():
-    """Build taxonomy.json file"""
 
-    # Extract nodes.dmp file from tarfile
-    tmpdir = tempfile.TemporaryDirectory(suffix=None, prefix=None, dir=None)
-    try:
-        tar = tarfile.open(name=download_fn)
-        tar.extractall(path=tmpdir.name, members=None, numeric_owner=False)
-        tar.close()
-    except Exception as e:
-        print(f"Error trying to open tarfile: {str(e)}")
-        sys.exit(1)
-
-    terms = {}
-
-    # Collect IDs and tree structure
-    with open(f"{tmpdir.name}/nodes.dmp", "r") as f:
-        for line in f:
-            (id, parent_id, rank, *rest) = line.split("\t|\t")
+class Taxonomy:
+    """Taxonomy nodes and names from taxdump held in array-backed columns
 
-            terms[id] = {
-                "namespace": namespace,
-                "id": id,
-                "key": f"{namespace}:{id}",
-                "parent_keys": [],
-                "taxonomy_rank": rank,
-                "name": "",
-                "label": "",
-                "species_key": f"{namespace}:{id}",
-                "species_label": "",
-                "synonyms": [],
-                "alt_keys": [],
-                "taxonomy_names": [],
-                "annotation_types": [],
-                "entity_types": [],
-            }
+    Rows are allocated in order of first appearance of a taxonomy id in either dmp file.  Names
+    are stored once per row as a tuple of the distinct names (the term synonyms) - the label and
+    scientific name are positions in that tuple.
+    """
 
-            # Add preferred label as alt_id
-            if settings.TAXONOMY_LABELS.get(id, False):
-                terms[id]["alt_keys"].append(
-                    f"{namespace_def['namespace']}:{settings.TAXONOMY_LABELS[id]}"
-                )
+    def __init__(self):
+        self.row_of = array.array("i")  # taxonomy id -> row, -1 if no row
+        self.ids = array.array("I")  # row -> taxonomy id
+        self.parent_ids = array.array("I")  # row -> parent taxonomy id, 0 if none
+        self.rank_codes = array.array("B")  # row -> rank code
+        self.ranks = []  # rank code -> rank, e.g. species
+        self.rank_index = {}  # rank -> rank code
+        self.names = []  # row -> tuple of distinct names
+        self.name_positions = array.array("h")  # row -> position of scientific name, -1 if none
+        self.label_positions = array.array("h")  # row -> position of label, -1 if none
+        self.common_labels = bytearray()  # row -> 1 if label is the genbank common name
+        self.node_rows = array.array("I")  # rows in nodes.dmp order
+
+    def row(self, id: int) -> int:
+        """Get row of taxonomy id - allocated if new"""
+
+        if id >= len(self.row_of):
+            grow = max(id + 1 - len(self.row_of), len(self.row_of))  # amortized doubling
+            self.row_of.extend(array.array("i", [-1]) * grow)
+
+        row = self.row_of[id]
+        if row == -1:
+            row = len(self.ids)
+            self.row_of[id] = row
+            self.ids.append(id)
+            self.parent_ids.append(0)
+            self.rank_codes.append(0)
+            self.names.append(())
+            self.name_positions.append(-1)
+            self.label_positions.append(-1)
+            self.common_labels.append(0)
+
+        return row
+
+    def read_nodes(self, fi: Iterable[str]):
+        """Read nodes.dmp - taxonomy id, parent id and rank"""
+
+        for line in fi:
+            (id, parent_id, rank, *rest) = line.split("\t|\t")
 
+            row = self.row(int(id))
+            self.node_rows.append(row)
             if parent_id and parent_id != id:
-                terms[id]["parent_keys"].append(f"{namespace}:{parent_id}")
+                self.parent_ids[row] = int(parent_id)
 
-            # Only add Species to annotation/entity types to records with rank == species in the nodes.dmp file
-            if rank == "species":
-                terms[id]["annotation_types"].append("Species")
-                terms[id]["entity_types"].append("Species")
+            if rank not in self.rank_index:
+                self.rank_index[rank] = len(self.ranks)
+                self.ranks.append(rank)
+            self.rank_codes[row] = self.rank_index[rank]
+
+    def read_names(self, fi: Iterable[str]):
+        """Read names.dmp - names are grouped by taxonomy id so distinct names are collected per group"""
+
+        row = None
+        positions = {}  # name -> position in names of row
 
-    # Add labels
-    with open(f"{tmpdir.name}/names.dmp", "r") as fi:
         for line in fi:
             line = line.rstrip("\t|\n")
             (id, name, unique_variant, name_type) = line.split("\t|\t")
 
-            if name not in terms[id]["synonyms"]:
-                terms[id]["synonyms"].append(name)
+            next_row = self.row(int(id))
+            if next_row != row:
+                if row is not None:
+                    self.names[row] = tuple(positions)
+                row = next_row
+                positions = {name: idx for (idx, name) in enumerate(self.names[row])}
 
-            terms[id]["taxonomy_names"].append({"name": name, "type": name_type})
+            position = positions.setdefault(name, len(positions))
 
             if name_type == "genbank common name":
-                terms[id]["label"] = settings.TAXONOMY_LABELS.get(
-                    id, name
-                )  # Override label if available
-                terms[id]["species_label"] = settings.TAXONOMY_LABELS.get(
-                    id, name
-                )  # Override label if available
+                self.label_positions[row] = position
+                self.common_labels[row] = 1
             elif name_type == "scientific name":
-                terms[id]["name"] = name
-                if not terms[id]["label"]:
-                    terms[id]["label"] = name
-                    terms[id]["species_label"] = name
+                self.name_positions[row] = position
+                if self.label_positions[row] == -1:
+                    self.label_positions[row] = position
+
+        if row is not None:
+            self.names[row] = tuple(positions)
+
+    def rank(self, row: int) -> str:
+        return self.ranks[self.rank_codes[row]]
+
+    def name(self, row: int) -> str:
+        """Scientific name"""
+
+        position = self.name_positions[row]
+        return self.names[row][position] if position != -1 else ""
+
+    def label(self, row: int) -> str:
+        """Genbank common name (overridden by TAXONOMY_LABELS) or else the scientific name"""
+
+        position = self.label_positions[row]
+        if position == -1:
+            return ""
+
+        label = self.names[row][position]
+        if self.common_labels[row]:
+            label = settings.TAXONOMY_LABELS.get(str(self.ids[row]), label)
+
+        return label
+
+    def lineage(self):
+        """Lineage arrays of the nodes.dmp taxa, see app.common.taxonomy.compute_lineage()"""
 
-                # Add name as alternate ID if scientific names and taxonomy rank is species
-                if terms[id]["taxonomy_rank"] == "species":
-                 
-                    if not re.search("sp.", name):
-                        terms[id]["alt_keys"].append(f"{namespace}:{quote_id(name)}")
+        rows = np.frombuffer(self.node_rows, dtype=np.uint32)
 
-    with gzip.open(resource_fn, "wt") as fo, gzip.open(
-        resource_fn_hmrz, "wt"
-    ) as fz:
+        return compute_lineage(
+            np.frombuffer(self.ids, dtype=np.uint32)[rows],
+            np.frombuffer(self.parent_ids, dtype=np.uint32)[rows],
+            np.frombuffer(self.rank_codes, dtype=np.uint8)[rows],
+            self.ranks,
+        )
+
+
+def read_taxdump(fn: str) -> Taxonomy:
+    """Stream nodes.dmp and names.dmp from the taxdump tarfile - other members are skipped"""
+
+    taxonomy = Taxonomy()
+
+    with tarfile.open(fn, "r|gz") as tar:
+        for member in tar:
+            if member.name not in ("nodes.dmp", "names.dmp"):
+                continue
+
+            # Streamed member - io.TextIOWrapper needs a seekable file so lines are decoded here
+            lines = (line.decode("utf-8") for line in tar.extractfile(member))
+            if member.name == "nodes.dmp":
+                taxonomy.read_nodes(lines)
+            else:
+                taxonomy.read_names(lines)
+
+    return taxonomy
+
+
+def build_json():
+    """Build taxonomy.json file"""
+
+    taxonomy = read_taxdump(download_fn)
+
+    # Lineage first - species subsets with clades are resolved with it
+    save_lineage(taxonomy.lineage())
+
+    with open_term_writer(resource_fn) as writer:
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
-        fz.write("{}\n".format(json.dumps({"metadata": metadata})))
-
-        for id in terms:
-
-            # Make sure the term record conforms to defined Term structure
-            term = Term(
-                key = terms[id]["key"],
-                namespace = namespace,
-                id = id,
-                label = terms[id]["label"],
-                name = terms[id]["name"],
-                description = f"Taxonomy rank: {terms[id]['taxonomy_rank']}",
-                synonyms = terms[id]["synonyms"],
-                alt_keys = terms[id]["alt_keys"],
-                parent_keys = terms[id]["parent_keys"],
-                species_key = terms[id]["species_key"],
-                species_label = terms[id]["species_label"],
-                entity_types = terms[id]["entity_types"],
-                annotation_types = terms[id]["annotation_types"],
-            )
+        writer.write_metadata(metadata)
 
-            # Add terms record to JSONL
-            fo.write("{}\n".format(json.dumps({"term": term.dict()})))
+        for row in taxonomy.node_rows:
+            id = str(taxonomy.ids[row])
+            rank = taxonomy.rank(row)
+            name = taxonomy.name(row)
+            label = taxonomy.label(row)
+
+            # Add preferred label as alt_id
+            alt_keys = []
+            if settings.TAXONOMY_LABELS.get(id, False):
+                alt_keys.append(f"{namespace_def['namespace']}:{settings.TAXONOMY_LABELS[id]}")
+
+            # Add scientific name as alternate ID if taxonomy rank is species
+            if rank == "species" and name and not re.search("sp.", name):
+                alt_keys.append(f"{namespace}:{quote_id(name)}")
 
-            if terms[id]["species_key"] in hmrz_species:
-                fz.write("{}\n".format(json.dumps({"term": term.dict()})))
+            parent_keys = []
+            if taxonomy.parent_ids[row]:
+                parent_keys.append(f"{namespace}:{taxonomy.parent_ids[row]}")
 
+            # Only add Species to annotation/entity types to records with rank == species in the nodes.dmp file
+            species_types = ["Species"] if rank == "species" else []
+
+            # Term record - validated against the Term model if BELRES_TERM_VALIDATION_SAMPLE is set
+            term = TermRecord(
+                key=f"{namespace}:{id}",
+                namespace=namespace,
+                id=id,
+                label=label,
+                name=name,
+                description=f"Taxonomy rank: {rank}",
+                synonyms=taxonomy.names[row],
+                alt_keys=alt_keys,
+                parent_keys=parent_keys,
+                species_key=f"{namespace}:{id}",
+                species_label=label,
+                entity_types=species_types,
+                annotation_types=species_types,
+            )
+
+            # Add terms record to JSONL
+            writer.write_term(term)
 
-    # Create species label file
-    species_labels = {}
+    # Create species label files
+    species_rows = [row for row in taxonomy.node_rows if taxonomy.rank(row) == "species"]
 
-    for id in terms:
-        if terms[id]["taxonomy_rank"] != "species":
-            continue
-        species_labels[terms[id]["key"]] = terms[id]["label"]    
+    with open_output(species_labels_json_fn) as fo:
+        fo.write(b"{")
+        for (idx, row) in enumerate(species_rows):
+            key = json.dumps(f"{namespace}:{taxonomy.ids[row]}")
+            fo.write(f"{', ' if idx else ''}{key}: {json.dumps(taxonomy.label(row))}".encode("utf-8"))
+        fo.write(b"}")
 
-    with gzip.open(species_labels_fn, "wt") as fo:
-        json.dump(species_labels, fo)
+    species_rows.sort(key=taxonomy.ids.__getitem__)
+    write_species_label_store(
+        species_labels_fn, ((taxonomy.ids[row], taxonomy.label(row)) for row in species_rows)
+    )
 
 
 def main(
     overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
     force_download: bool = Option(False, help="Force re-downloading of source data file"),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
 ):
 
-    (changed, msg) = get_ftp_file(download_url, download_fn, force_download=force_download)
-
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
-
-    if changed or overwrite:
-        build_json()
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_fn],
+        __file__,
+        config={
+            "namespace": namespace_def,
+            "taxonomy_labels": settings.TAXONOMY_LABELS,
+            "species_subsets": settings.SPECIES_SUBSETS,
+        },
+    )
+
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json()
+        save_build_inputs(build_inputs)
+
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
@@ -22,6 +22,7 @@ import app.settings as settings
 import app.setup_logging
 import typer
 from app.common.resources import get_metadata, get_species_labels
+from app.common.writers import TermWriter, open_output, output_fn
 from app.schemas.main import Term
 from typer import Option
 
@@ -38,12 +39,12 @@ def build_json():
     for key in settings.NAMESPACE_DEFINITIONS:
         doc = settings.NAMESPACE_DEFINITIONS[key]
         if doc["namespace_type"] in ["virtual", "identifers_org"]:
-            resource_fn = f"{settings.DATA_DIR}/namespaces/{key}.jsonl.gz"
+            resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{key}.jsonl")
 
-            with gzip.open(resource_fn, "wt") as fo:
+            with open_output(resource_fn) as fo:
                 # Header JSONL record for terminology
                 metadata = get_metadata(doc)
-                fo.write("{}\n".format(json.dumps({"metadata": metadata})))
+                TermWriter(fo).write_metadata(metadata)
 
 
 def main():
@@ -22,10 +22,19 @@ import yaml
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_web_file
-from app.common.resources import get_metadata, get_species_labels
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.collect_sources import download_sources
+from app.common.columnar import write_parquet
+from app.common.delta import release_delta
+from app.common.resources import (
+    get_metadata,
+    get_species_labels,
+    species_labels_fn,
+    taxonomy_lineage_fns,
+)
 from app.common.text import quote_id
-from app.schemas.main import Term
+from app.common.writers import TermWriter, open_output, output_fn
+from app.schemas.main import TermRecord
 from typer import Option
 
 log = structlog.getLogger("zfin_namespace")
@@ -50,7 +59,13 @@ aliases_fn = download_fn
 genes_fn = download_fn2
 transcripts_fn = download_fn3
 
-resource_fn = f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl.gz"
+resource_fn = output_fn(f"{settings.DATA_DIR}/namespaces/{namespace_lc}.jsonl")
+
+sources = [
+    (download_url, download_fn),
+    (download_url2, download_fn2),
+    (download_url3, download_fn3),
+]
 
 
 def build_json():
@@ -123,18 +138,20 @@ def build_json():
                 log.debug(f"No term record for ZFIN {src_id} to add equivalences to")
                 continue
 
-    with gzip.open(resource_fn, "wt") as fo:
+    with open_output(resource_fn) as fo:
+
+        writer = TermWriter(fo)
 
         # Header JSONL record for terminology
         metadata = get_metadata(namespace_def)
-        fo.write("{}\n".format(json.dumps({"metadata": metadata})))
+        writer.write_metadata(metadata)
 
         for term_id in terms:
 
             label = terms[term_id].get("symbol", terms[term_id].get("name", term_id))
             name = terms[term_id].get("name", term_id)
 
-            term = Term(
+            term = TermRecord(
                 key=f"{namespace}:{term_id}",
                 namespace=namespace,
                 id=term_id,
@@ -151,23 +168,36 @@ def build_json():
                 term.alt_keys = [f"{namespace}:{term.label}"]
 
             # Add term to JSONLines file
-            fo.write("{}\n".format(json.dumps({"term": term.dict()})))
+            writer.write_term(term)
 
 
 def main(
     overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
     force_download: bool = Option(False, help="Force re-downloading of source data file"),
+    delta: bool = Option(False, help="Write namespace delta file versus the previous release"),
+    parquet: bool = Option(False, help="Also write the namespace terms as a Parquet file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
 ):
 
-    (changed, msg) = get_web_file(download_url, download_fn, force_download=force_download)
-    (changed2, msg2) = get_web_file(download_url2, download_fn2, force_download=force_download)
-    (changed3, msg3) = get_web_file(download_url3, download_fn3, force_download=force_download)
+    if download:
+        download_sources(sources, force_download=force_download)
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_namespace",
+        [download_fn, download_fn2, download_fn3, species_labels_fn, *taxonomy_lineage_fns],
+        __file__,
+        config={"namespace": namespace_def, "taxonomy_labels": settings.TAXONOMY_LABELS},
+    )
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
+    if overwrite or needs_rebuild(build_inputs):
+        with release_delta(resource_fn, enabled=delta):
+            build_json()
+        save_build_inputs(build_inputs)
 
-    if changed or overwrite:
-        build_json()
+    if parquet:
+        write_parquet(resource_fn)
 
 
 if __name__ == "__main__":
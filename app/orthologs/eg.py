@@ -6,22 +6,31 @@ Usage:  eg.py  -- orthologs
 
 """
 
+import array
 import copy
 import datetime
 import gzip
 import json
 import os
 import re
+from typing import Iterable, Iterator
 
+import numpy as np
 import structlog
 import yaml
 
 import app.settings as settings
 import app.setup_logging
 import typer
-from app.common.collect_sources import get_ftp_file
-from app.common.resources import get_metadata, get_species_labels
+from app.common import extsort
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.collect_sources import download_sources
+from app.common.gene_history import GeneHistory, gene_history_fns
+from app.common.orthologs import compute_ortholog_adjacency, save_ortholog_adjacency
+from app.common.parallel import chunked
+from app.common.resources import get_metadata, get_species_labels, taxonomy_lineage_fns
 from app.common.text import dt_now, quote_id
+from app.common.writers import open_term_writer, output_fn
 from app.schemas.main import Orthologs, ResourceMetadata
 from typer import Option
 
@@ -33,10 +42,10 @@ namespace_def = settings.NAMESPACE_DEFINITIONS[namespace_lc]
 
 download_url = "ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/gene_orthologs.gz"
 download_fn = f"{settings.DOWNLOAD_DIR}/eg_orthologs.csv.gz"
-download_history_fn = f"{settings.DOWNLOAD_DIR}/eg_gene_history.json.gz"
-resource_fn = f"{settings.DATA_DIR}/orthologs/{namespace_lc}.jsonl.gz"
-resource_fn_hmrz = f"{settings.DATA_DIR}/orthologs/{namespace_lc}_hmrz.jsonl.gz"
-hmrz_species = ["TAX:9606", "TAX:10090", "TAX:10116", "TAX:7955"]
+resource_fn = output_fn(f"{settings.DATA_DIR}/orthologs/{namespace_lc}.jsonl")
+
+# gene_history is downloaded and indexed by the EG namespace build
+sources = [(download_url, download_fn)]
 
 
 orthologs_metadata = ResourceMetadata(
@@ -49,32 +58,32 @@ orthologs_metadata = ResourceMetadata(
 ).dict(skip_defaults=True)
 
 
-def build_json():
-    """Build EG orthologs json load file"""
+def iter_pair_lines(fi: Iterable[str], history: GeneHistory, chunk_size: int) -> Iterator[bytes]:
+    """Ortholog pairs of gene_orthologs as sort lines - subject key, object key and species keys
 
-    with gzip.open(download_fn, "rt") as fi, gzip.open(resource_fn, "wt") as fo, gzip.open(
-        resource_fn_hmrz, "wt"
-    ) as fz:
+    Discontinued gene ids are replaced by their current gene ids - pairs with a withdrawn gene
+    are skipped and so are pairs whose genes were merged into the same current gene.  The pair keys are lexically ordered (subject key < object key) so both
+    directions of a pair give the same line.
+    """
 
-        # Header JSONL record for terminology
-        fo.write("{}\n".format(json.dumps({"metadata": orthologs_metadata})))
-        fz.write("{}\n".format(json.dumps({"metadata": orthologs_metadata})))
+    for lines in chunked(fi, chunk_size):
+        rows = [line.rstrip().split("\t") for line in lines]
+        rows = [row for row in rows if row[2] == "Ortholog"]
 
-        fi.__next__()  # skip header line
+        subject_gene_ids = [int(row[1]) for row in rows]
+        object_gene_ids = [int(row[4]) for row in rows]
+        if history.exists():
+            subject_gene_ids = history.current_many(subject_gene_ids)
+            object_gene_ids = history.current_many(object_gene_ids)
 
-        for line in fi:
-            (
-                subject_species_id,
-                subject_gene_id,
-                relationship,
-                object_species_id,
-                object_gene_id,
-            ) = line.rstrip().split("\t")
-            if relationship != "Ortholog":
-                continue
+        for (row, subject_gene_id, object_gene_id) in zip(rows, subject_gene_ids, object_gene_ids):
+            if not subject_gene_id or not object_gene_id:
+                continue  # withdrawn gene
+            if subject_gene_id == object_gene_id:
+                continue  # both genes replaced by the same gene - not an ortholog pair
 
-            subject_species_key = f"TAX:{subject_species_id}"
-            object_species_key = f"TAX:{object_species_id}"
+            subject_species_key = f"TAX:{row[0]}"
+            object_species_key = f"TAX:{row[3]}"
 
             subject_key = f"{namespace}:{subject_gene_id}"
             object_key = f"{namespace}:{object_gene_id}"
@@ -88,6 +97,56 @@ def build_json():
                     subject_species_key,
                 )
 
+            line = f"{subject_key}\t{object_key}\t{subject_species_key}\t{object_species_key}\n"
+            yield line.encode("utf-8")
+
+
+def build_json(chunk_size: int = 100_000):
+    """Build EG orthologs json load file and ortholog adjacency
+
+    gene_orthologs lists most pairs in both directions - the pairs are deduplicated with an
+    external sort (bounded memory, see settings.SORT_BUFFER_SIZE) and written in subject key,
+    object key order.  The ortholog adjacency (OrthologAdjacency) is built from the same pairs.
+
+    Discontinued gene ids are replaced by their current gene ids using the gene history index
+    written by the EG namespace build.
+
+    Args:
+        chunk_size (int): number of gene_orthologs lines resolved against the gene history at a time
+    """
+
+    history = GeneHistory()
+    if not history.exists():
+        log.warning("Gene history index not found - build the EG namespace to resolve gene ids")
+
+    # Gene and taxonomy ids of the written pairs for the ortholog adjacency
+    (subject_ids, object_ids) = (array.array("I"), array.array("I"))
+    (subject_species_ids, object_species_ids) = (array.array("I"), array.array("I"))
+
+    with gzip.open(download_fn, "rt") as fi, open_term_writer(resource_fn) as writer:
+
+        # Header JSONL record for terminology
+        writer.write_metadata(orthologs_metadata)
+
+        fi.__next__()  # skip header line
+
+        pair_lines = extsort.iter_sorted(
+            iter_pair_lines(fi, history, chunk_size),
+            unique=True,
+            tmpdir=os.path.dirname(resource_fn) or None,
+        )
+
+        previous_pair = None
+        for line in pair_lines:
+            (subject_key, object_key, subject_species_key, object_species_key) = (
+                line.decode("utf-8").rstrip("\n").split("\t")
+            )
+
+            # First species keys are kept if a pair is listed with conflicting species
+            if (subject_key, object_key) == previous_pair:
+                continue
+            previous_pair = (subject_key, object_key)
+
             ortholog = {
                 "subject_key": subject_key,
                 "subject_species_key": subject_species_key,
@@ -95,25 +154,46 @@ def build_json():
                 "object_species_key": object_species_key,
             }
 
-            # Add ortholog to JSONL
-            fo.write("{}\n".format(json.dumps({"ortholog": ortholog})))
+            # Add ortholog to JSONL - subset files only if both species are in the subset
+            writer.write({"ortholog": ortholog}, [subject_species_key, object_species_key])
+
+            subject_ids.append(int(subject_key.partition(":")[2]))
+            object_ids.append(int(object_key.partition(":")[2]))
+            subject_species_ids.append(int(subject_species_key.partition(":")[2]))
+            object_species_ids.append(int(object_species_key.partition(":")[2]))
+
+    adjacency = compute_ortholog_adjacency(
+        *(
+            np.frombuffer(ids, dtype=np.uint32)
+            for ids in (subject_ids, object_ids, subject_species_ids, object_species_ids)
+        )
+    )
+    save_ortholog_adjacency(adjacency)
 
-            if subject_species_key in hmrz_species and object_species_key in hmrz_species:
-                fz.write("{}\n".format(json.dumps({"ortholog": ortholog})))
+    log.info("Ortholog pairs written", pairs=len(subject_ids))
 
 
 def main(
     overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
     force_download: bool = Option(False, help="Force re-downloading of source data file"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files before building"
+    ),
 ):
 
-    (changed, msg) = get_ftp_file(download_url, download_fn, force_download=force_download)
+    if download:
+        download_sources(sources, force_download=force_download)
 
-    if msg:
-        log.info("Collect download file", result=msg, changed=changed)
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_orthologs",
+        [download_fn, *gene_history_fns().values(), *taxonomy_lineage_fns],
+        __file__,
+        config={"species_subsets": settings.SPECIES_SUBSETS},
+    )
 
-    if changed or overwrite:
+    if overwrite or needs_rebuild(build_inputs):
         build_json()
+        save_build_inputs(build_inputs)
 
 
 if __name__ == "__main__":
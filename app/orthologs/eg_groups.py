@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  eg_groups.py  -- ortholog groups
+
+NCBI gene_orthologs pairs are almost all anchored on human genes, so e.g. mouse and rat
+orthologs are only connected through their human ortholog.  The ortholog groups are the
+connected components of the EG ortholog pairs.
+"""
+
+import numpy as np
+import structlog
+
+import app.settings as settings
+import app.setup_logging
+import typer
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.orthologs import (
+    OrthologAdjacency,
+    compute_ortholog_groups,
+    ortholog_adjacency_fns,
+    save_ortholog_groups,
+)
+from app.common.text import dt_now
+from app.common.writers import open_term_writer, output_fn
+from app.schemas.main import ResourceMetadata
+from typer import Option
+
+log = structlog.getLogger("eg_ortholog_groups")
+
+namespace = "EG"
+namespace_lc = namespace.lower()
+
+resource_fn = output_fn(f"{settings.DATA_DIR}/orthologs/{namespace_lc}_groups.jsonl")
+
+# Built from the ortholog adjacency written by the EG orthologs build
+sources = []
+
+
+ortholog_groups_metadata = ResourceMetadata(
+    name="Ortholog_Groups_EntrezGene",
+    source_name="NCBI EntrezGene database",
+    source_url="ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/gene_orthologs.gz",
+    resource_type="orthologs",
+    description="Ortholog groups (connected components of the orthologs) defined by EntrezGene",
+    version=dt_now(),
+).dict(skip_defaults=True)
+
+
+def build_json():
+    """Build EG ortholog groups json load file and gene -> group index
+
+    Each record lists the member gene keys of a group with the species key of each member.
+    The group id is the smallest member gene id, so it is stable between releases as long
+    as that gene stays in the group.
+    """
+
+    groups = compute_ortholog_groups(OrthologAdjacency())
+    save_ortholog_groups(groups)
+
+    gene_ids = groups["gene_ids"]
+    species_ids = groups["species_ids"]
+    grouped = groups["grouped"]
+    grouped_group_ids = groups["grouped_group_ids"]
+
+    # Group boundaries in grouped
+    starts = np.flatnonzero(grouped_group_ids[1:] != grouped_group_ids[:-1]) + 1
+    if len(grouped):
+        starts = np.r_[0, starts]
+    ends = np.r_[starts[1:], len(grouped)]
+
+    # Species subsets aren't written - groups almost always span many species
+    with open_term_writer(resource_fn, subsets={}) as writer:
+
+        writer.write_metadata(ortholog_groups_metadata)
+
+        for (start, end) in zip(starts.tolist(), ends.tolist()):
+            members = grouped[start:end]
+            ortholog_group = {
+                "group_id": str(grouped_group_ids[start]),
+                "member_keys": [f"{namespace}:{id}" for id in gene_ids[members].tolist()],
+                "species_keys": [f"TAX:{id}" for id in species_ids[members].tolist()],
+            }
+            writer.write({"ortholog_group": ortholog_group})
+
+    log.info("Ortholog groups written", groups=len(starts), genes=len(gene_ids))
+
+
+def main(
+    overwrite: bool = Option(False, help="Force overwrite of output resource data file"),
+):
+
+    build_inputs = get_build_inputs(
+        f"{namespace_lc}_ortholog_groups", list(ortholog_adjacency_fns().values()), __file__
+    )
+
+    if overwrite or needs_rebuild(build_inputs):
+        build_json()
+        save_build_inputs(build_inputs)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  run_all.py
+
+Run all of the resource builders (namespaces, orthologs, backbone) in parallel
+processes - builders only wait on the builders they actually depend on.
+
+Source files for all of the builders are downloaded concurrently up front and each
+builder is started as soon as its own downloads (and dependencies) have finished.
+"""
+
+import importlib
+import inspect
+import multiprocessing
+import multiprocessing.connection
+import os
+import resource
+import sys
+import time
+from typing import Any, List, Mapping
+
+import structlog
+
+import app.settings as settings
+import app.setup_logging
+import typer
+from app.common.collect_sources import DownloadScheduler
+from typer import Option
+
+log = structlog.getLogger("run_all")
+
+# Builder stages and their dependencies
+#
+#   tax writes the tax_labels.bin species label store read by get_species_labels() in the
+#   gene/protein builders and the tax_lineage arrays used to resolve species subset clades
+#   eg downloads gene_history which is shared with the EG orthologs
+#   gene2protein reads the eg.jsonl(.gz) namespace file
+#   orthologs_eg_groups reads the ortholog adjacency written by orthologs_eg
+#   terms_db loads all of the namespace files into the SQLite term search database
+stages = {
+    "tax": {"module": "app.namespaces.tax", "depends": []},
+    "virtuals": {"module": "app.namespaces.virtuals", "depends": []},
+    "chebi": {"module": "app.namespaces.chebi", "depends": []},
+    "do": {"module": "app.namespaces.do", "depends": []},
+    "go": {"module": "app.namespaces.go", "depends": []},
+    "mesh": {"module": "app.namespaces.mesh", "depends": []},
+    "eg": {"module": "app.namespaces.eg", "depends": ["tax"]},
+    "hgnc": {"module": "app.namespaces.hgnc", "depends": ["tax"]},
+    "mgi": {"module": "app.namespaces.mgi", "depends": ["tax"]},
+    "rgd": {"module": "app.namespaces.rgd", "depends": ["tax"]},
+    "sp": {"module": "app.namespaces.sp", "depends": ["tax"]},
+    "zfin": {"module": "app.namespaces.zfin", "depends": ["tax"]},
+    "orthologs_eg": {"module": "app.orthologs.eg", "depends": ["eg"]},
+    "orthologs_eg_groups": {"module": "app.orthologs.eg_groups", "depends": ["orthologs_eg"]},
+    "backbone_eg": {"module": "app.backbone.gene2protein", "depends": ["eg"]},
+    "terms_db": {
+        "module": "app.search.terms_db",
+        "depends": [
+            "tax",
+            "virtuals",
+            "chebi",
+            "do",
+            "go",
+            "mesh",
+            "eg",
+            "hgnc",
+            "mgi",
+            "rgd",
+            "sp",
+            "zfin",
+        ],
+    },
+}
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size in MB (ru_maxrss is KB on Linux, bytes on macOS)
+
+    Args:
+        who (int): resource.RUSAGE_SELF for this process or resource.RUSAGE_CHILDREN for the
+            largest of its terminated (waited for) child processes, e.g. builder worker pools
+    """
+
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        return round(maxrss / 1024 / 1024, 1)
+
+    return round(maxrss / 1024, 1)
+
+
+def run_stage(name: str, options: Mapping[str, Any], conn) -> None:
+    """Run the builder main() for a stage - executed in its own process
+
+    Args:
+        name (str): stage name
+        options (Mapping[str, Any]): main() options - only those accepted by the builder main() are
+            passed, other main() parameters get their typer Option default
+        conn (multiprocessing.connection.Connection): pipe to send the stage result with wall time
+            and peak RSS of the stage process and of its largest child process (builder workers)
+    """
+
+    start = time.time()
+
+    try:
+        module = importlib.import_module(stages[name]["module"])
+        kwargs = {}
+        for key, param in inspect.signature(module.main).parameters.items():
+            if key in options:
+                kwargs[key] = options[key]
+            elif isinstance(param.default, typer.models.OptionInfo):
+                kwargs[key] = param.default.default
+
+        module.main(**kwargs)
+        result = {"stage": name}
+
+    except Exception as e:
+        log.exception("Failed stage", stage=name)
+        result = {"stage": name, "error": str(e)}
+
+    result["wall_time"] = round(time.time() - start, 1)
+    result["peak_rss_mb"] = peak_rss_mb()
+    result["peak_children_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    conn.send(result)
+    conn.close()
+
+
+def schedule_downloads(
+    selected: List[str], scheduler: DownloadScheduler, force_download: bool, results: dict
+) -> Mapping[str, list]:
+    """Schedule the source downloads (builder module sources list) of all selected stages
+
+    Args:
+        selected (List[str]): stage names
+        scheduler (DownloadScheduler): download scheduler
+        force_download (bool): force re-downloading of source data files
+        results (dict): stage results - stages whose builder module can't be imported are failed here
+
+    Returns:
+        Mapping[str, list]: download futures by stage name
+    """
+
+    downloads = {}
+    for name in selected:
+        try:
+            module = importlib.import_module(stages[name]["module"])
+        except Exception as e:
+            log.exception("Failed stage", stage=name)
+            results[name] = {"stage": name, "error": str(e)}
+            continue
+
+        downloads[name] = scheduler.submit_sources(
+            getattr(module, "sources", []), force_download=force_download
+        )
+
+    return downloads
+
+
+def run_stages(
+    selected: List[str], workers: int, options: Mapping[str, Any], download: bool = True
+) -> Mapping[str, Any]:
+    """Run stages concurrently as soon as their dependencies and source downloads have finished
+
+    Each stage gets a fresh (non-daemonic) process so that peak RSS is per stage and
+    builders can start their own worker pools.  Stage processes are spawned rather than
+    forked as the download threads are running in this process.
+
+    Args:
+        selected (List[str]): stage names to run - dependencies outside of this list are treated as done
+        workers (int): maximum number of stage processes running at once
+        options (Mapping[str, Any]): builder main() options
+        download (bool): download the stage source files - overlapped with running stages
+
+    Returns:
+        Mapping[str, Any]: stage results keyed by stage name
+    """
+
+    results = {}
+    running = {}
+    context = multiprocessing.get_context("spawn")
+
+    # Split the output compression threads between the stages running at once - stage processes
+    # read BELRES_OUTPUT_THREADS from the environment when they start
+    if "BELRES_OUTPUT_THREADS" not in os.environ:
+        output_threads = max(1, (os.cpu_count() or 1) // max(1, min(workers, len(selected))))
+        os.environ["BELRES_OUTPUT_THREADS"] = str(output_threads)
+
+    # Downloads are done here so the builders don't download their own source files
+    options = dict(options, download=False)
+    scheduler = DownloadScheduler()
+    downloads = {}
+    if download:
+        downloads = schedule_downloads(selected, scheduler, options["force_download"], results)
+
+    pending = {
+        name: set(stages[name]["depends"]) & set(selected) for name in selected if name not in results
+    }
+
+    while pending or running:
+
+        # Fail stages with a failed download
+        for name in list(pending):
+            failed = [
+                future.exception()
+                for future in downloads.get(name, [])
+                if future.done() and future.exception()
+            ]
+            if failed:
+                log.error("Failed stage downloads", stage=name, errors=[str(e) for e in failed])
+                results[name] = {"stage": name, "error": f"Failed downloads: {failed[0]}"}
+                del pending[name]
+
+        # Skip stages with a failed dependency
+        for name in list(pending):
+            failed = [dep for dep in pending[name] if results.get(dep, {}).get("error")]
+            if failed:
+                log.error("Skipping stage", stage=name, failed_dependencies=failed)
+                results[name] = {"stage": name, "error": f"Failed dependencies: {failed}"}
+                del pending[name]
+
+        # Start stages with all dependencies finished
+        for name in list(pending):
+            if len(running) >= workers:
+                break
+            if all(dep in results for dep in pending[name]) and all(
+                future.done() for future in downloads.get(name, [])
+            ):
+                log.info("Starting stage", stage=name)
+                (recv_conn, send_conn) = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=run_stage, args=(name, options, send_conn), name=name
+                )
+                process.start()
+                send_conn.close()
+                running[name] = (process, recv_conn)
+                del pending[name]
+
+        ready = multiprocessing.connection.wait(
+            [recv_conn for (process, recv_conn) in running.values()], timeout=1
+        )
+        for name in [name for name in running if running[name][1] in ready]:
+            (process, recv_conn) = running.pop(name)
+            try:
+                results[name] = recv_conn.recv()
+            except EOFError:
+                results[name] = {"stage": name, "error": "Stage process exited without a result"}
+            process.join()
+
+            if results[name].get("error"):
+                log.error("Failed stage", **results[name])
+            else:
+                log.info("Finished stage", **results[name])
+
+    scheduler.shutdown()
+
+    return results
+
+
+def main(
+    stage: List[str] = Option(None, help="Stage(s) to run - defaults to all stages"),
+    workers: int = Option(
+        multiprocessing.cpu_count(), help="Number of builder processes to run at once"
+    ),
+    builder_workers: int = Option(
+        1, help="Number of processes used inside builders that support parallel builds (e.g. eg)"
+    ),
+    overwrite: bool = Option(False, help="Force overwrite of output resource data files"),
+    force_download: bool = Option(False, help="Force re-downloading of source data files"),
+    delta: bool = Option(False, help="Write namespace delta files versus the previous releases"),
+    parquet: bool = Option(False, help="Also write the namespace terms as Parquet files"),
+    download: bool = Option(
+        True, "--download/--no-download", help="Download source data files while building"
+    ),
+):
+
+    selected = list(stage) if stage else list(stages.keys())
+    unknown = [name for name in selected if name not in stages]
+    if unknown:
+        log.error("Unknown stages", unknown=unknown, available=list(stages.keys()))
+        raise typer.Exit(code=1)
+
+    start = time.time()
+    results = run_stages(
+        selected,
+        workers,
+        {
+            "overwrite": overwrite,
+            "force_download": force_download,
+            "delta": delta,
+            "parquet": parquet,
+            "workers": builder_workers,
+        },
+        download=download,
+    )
+
+    for name in selected:
+        log.info("Stage summary", **results[name])
+
+    log.info("Finished all stages", wall_time=round(time.time() - start, 1))
+
+    if any(result.get("error") for result in results.values()):
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -156,6 +156,101 @@ class Term(BaseModel):
     annotation_types: List[AnnotationTypesEnum] = []
 
 
+class TermRecord:
+    """Lightweight namespace term record used by the builders
+
+    Same fields, defaults and dict() output as Term but without pydantic validation
+    on every term - use validate() (or BELRES_TERM_VALIDATION_SAMPLE) to check records
+    against the Term model.
+    """
+
+    __slots__ = (
+        "key",
+        "namespace",
+        "id",
+        "label",
+        "name",
+        "description",
+        "synonyms",
+        "alt_keys",
+        "child_keys",
+        "parent_keys",
+        "obsolete_keys",
+        "equivalence_keys",
+        "species_key",
+        "species_label",
+        "entity_types",
+        "annotation_types",
+    )
+
+    def __init__(
+        self,
+        key: str = "",
+        namespace: str = "",
+        id: str = "",
+        label: str = "",
+        name: str = "",
+        description: str = "",
+        synonyms: List[str] = None,
+        alt_keys: List[Key] = None,
+        child_keys: List[Key] = None,
+        parent_keys: List[Key] = None,
+        obsolete_keys: List[Key] = None,
+        equivalence_keys: List[Key] = None,
+        species_key: Key = "",
+        species_label: str = "",
+        entity_types: List[str] = None,
+        annotation_types: List[str] = None,
+    ):
+        self.key = key
+        self.namespace = namespace
+        self.id = id
+        self.label = label
+        self.name = name
+        self.description = description
+
+        # Lists are copied like the pydantic model does so callers can reuse their lists
+        self.synonyms = list(synonyms) if synonyms else []
+        self.alt_keys = list(alt_keys) if alt_keys else []
+        self.child_keys = list(child_keys) if child_keys else []
+        self.parent_keys = list(parent_keys) if parent_keys else []
+        self.obsolete_keys = list(obsolete_keys) if obsolete_keys else []
+        self.equivalence_keys = list(equivalence_keys) if equivalence_keys else []
+
+        self.species_key = species_key
+        self.species_label = species_label
+
+        self.entity_types = list(entity_types) if entity_types else []
+        self.annotation_types = list(annotation_types) if annotation_types else []
+
+    def dict(self) -> Mapping[str, Any]:
+        """Term record as dict - same key order as Term.dict()"""
+
+        return {
+            "key": self.key,
+            "namespace": self.namespace,
+            "id": self.id,
+            "label": self.label,
+            "name": self.name,
+            "description": self.description,
+            "synonyms": self.synonyms,
+            "alt_keys": self.alt_keys,
+            "child_keys": self.child_keys,
+            "parent_keys": self.parent_keys,
+            "obsolete_keys": self.obsolete_keys,
+            "equivalence_keys": self.equivalence_keys,
+            "species_key": self.species_key,
+            "species_label": self.species_label,
+            "entity_types": self.entity_types,
+            "annotation_types": self.annotation_types,
+        }
+
+    def validate(self) -> Term:
+        """Validate term record against the Term model - raises pydantic.ValidationError"""
+
+        return Term(**self.dict())
+
+
 class Orthologs(BaseModel):
     """Ortholog equivalences - subject and object arbitrarily assigned by lexical ordering"""
 
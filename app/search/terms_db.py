@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Usage:  terms_db.py
+
+Build an SQLite term search database from the namespace resource files - an offline
+alternative to loading the namespaces into Elasticsearch.
+
+    SELECT terms.key, terms.label FROM terms_fts
+    JOIN terms ON terms.rowid = terms_fts.rowid
+    WHERE terms_fts MATCH 'label:akt1' AND terms.species_key = 'TAX:9606'
+    ORDER BY rank LIMIT 10
+"""
+
+import glob
+import json
+import os
+import re
+import sqlite3
+from typing import Iterator, List, Tuple
+
+import structlog
+
+import app.settings as settings
+import app.setup_logging
+import typer
+from app.common.build_manifest import get_build_inputs, needs_rebuild, save_build_inputs
+from app.common.parallel import chunked
+from app.common.writers import loads, open_input
+from typer import Option
+
+log = structlog.getLogger("terms_db")
+
+namespaces_dir = f"{settings.DATA_DIR}/namespaces"
+db_fn = f"{settings.DATA_DIR}/search/terms.sqlite"
+
+# Namespace resource files - not the delta or previous release files.  TrEMBL shards are
+# listed in their manifest
+resource_fn_regex = re.compile(r"^[\w\-]+\.jsonl(\.\w+)?$")
+trembl_manifest_fn = f"{namespaces_dir}/tr.manifest.json"
+
+# Species subset files, e.g. eg_hmrz.jsonl.gz, are not loaded
+subset_suffixes = tuple(f"_{subset}" for subset in settings.SPECIES_SUBSET_DEFINITIONS)
+
+# Terms inserted per transaction
+batch_size = 50000
+
+schema_sql = """
+CREATE TABLE namespaces (
+    namespace TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE terms (
+    rowid INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    id TEXT NOT NULL,
+    label TEXT,
+    name TEXT,
+    synonyms TEXT,
+    description TEXT,
+    species_key TEXT,
+    species_label TEXT,
+    entity_types TEXT,
+    term TEXT NOT NULL
+);
+CREATE TABLE term_entity_types (
+    term_rowid INTEGER NOT NULL,
+    entity_type TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE terms_fts USING fts5(
+    label, name, synonyms, description,
+    content='terms', content_rowid='rowid', tokenize="unicode61 tokenchars '-_.'"
+);
+"""
+
+# Created after the bulk load - building an index once is much faster than updating it per row
+index_sql = """
+CREATE INDEX terms_key ON terms (key);
+CREATE INDEX terms_namespace ON terms (namespace);
+CREATE INDEX terms_species_key ON terms (species_key);
+CREATE INDEX term_entity_types_entity_type ON term_entity_types (entity_type, term_rowid);
+CREATE INDEX term_entity_types_term_rowid ON term_entity_types (term_rowid);
+"""
+
+
+def get_resource_fns(namespaces: List[str] = None) -> List[str]:
+    """Namespace resource files to load, e.g. eg.jsonl.gz
+
+    Args:
+        namespaces (List[str]): namespace resource file prefixes, e.g. eg, go - defaults to all
+    """
+
+    resource_fns = []
+    for fn in sorted(glob.glob(f"{namespaces_dir}/*.jsonl*")):
+        basename = os.path.basename(fn)
+        prefix = basename.split(".")[0]
+        if not resource_fn_regex.match(basename) or prefix.endswith(subset_suffixes):
+            continue
+        if namespaces and prefix not in namespaces:
+            continue
+        resource_fns.append(fn)
+
+    # Only the shards of the last finished TrEMBL build - not leftovers of an unfinished one
+    if os.path.exists(trembl_manifest_fn) and (not namespaces or "tr" in namespaces):
+        with open(trembl_manifest_fn, "r") as fi:
+            manifest = json.load(fi)
+        resource_fns.extend(f"{namespaces_dir}/{shard['fn']}" for shard in manifest["shards"])
+
+    return resource_fns
+
+
+def iter_rows(resource_fn: str, conn: sqlite3.Connection) -> Iterator[Tuple[tuple, List[str]]]:
+    """Get terms table rows and entity types from namespace resource file
+
+    Namespace metadata records are saved to the namespaces table in conn.
+    """
+
+    with open_input(resource_fn, "rb") as fi:
+        for line in fi:
+            record = loads(line)
+
+            if "metadata" in record:
+                metadata = record["metadata"]
+                conn.execute(
+                    "INSERT OR REPLACE INTO namespaces VALUES (?, ?)",
+                    (metadata.get("namespace", ""), json.dumps(metadata)),
+                )
+                continue
+
+            term = record.get("term")
+            if term is None:
+                continue
+
+            entity_types = term.get("entity_types") or []
+            row = (
+                term["key"],
+                term["namespace"],
+                term["id"],
+                term.get("label", ""),
+                term.get("name", ""),
+                "\n".join(term.get("synonyms") or []),
+                term.get("description", ""),
+                term.get("species_key", ""),
+                term.get("species_label", ""),
+                json.dumps(entity_types),
+                json.dumps(term, ensure_ascii=False),
+            )
+
+            yield (row, entity_types)
+
+
+def remove_duplicate_terms(conn: sqlite3.Connection) -> int:
+    """Remove terms with the key of an earlier loaded term - uses the terms_key index
+
+    Returns:
+        int: number of terms removed
+    """
+
+    duplicates = conn.execute(
+        "SELECT key, COUNT(*) FROM terms GROUP BY key HAVING COUNT(*) > 1"
+    ).fetchall()
+    if not duplicates:
+        return 0
+
+    log.warning(
+        "Duplicate term keys - keeping the first loaded term",
+        keys=len(duplicates),
+        examples=[key for (key, count) in duplicates[:20]],
+    )
+
+    conn.execute("BEGIN")
+    conn.execute(
+        """CREATE TEMP TABLE duplicate_rowids AS
+        SELECT rowid FROM terms
+        WHERE key IN (SELECT key FROM terms GROUP BY key HAVING COUNT(*) > 1)
+        AND rowid NOT IN (SELECT MIN(rowid) FROM terms GROUP BY key HAVING COUNT(*) > 1)"""
+    )
+    conn.execute("DELETE FROM terms WHERE rowid IN duplicate_rowids")
+    conn.execute("DELETE FROM term_entity_types WHERE term_rowid IN duplicate_rowids")
+    (removed,) = conn.execute("SELECT COUNT(*) FROM duplicate_rowids").fetchone()
+    conn.execute("DROP TABLE duplicate_rowids")
+    conn.execute("COMMIT")
+
+    return removed
+
+
+def build_db(resource_fns: List[str]):
+    """Build term search database from namespace resource files
+
+    The database is written to a temporary file with journaling off and moved into place when
+    complete.  Terms are inserted in batch_size transactions, indexes are created after all of
+    the terms are loaded and the full text index is built in one pass with the FTS5 rebuild command.
+
+    Args:
+        resource_fns (List[str]): namespace resource files
+    """
+
+    os.makedirs(os.path.dirname(db_fn), exist_ok=True)
+    tmp_fn = f"{db_fn}.tmp"
+    if os.path.exists(tmp_fn):
+        os.remove(tmp_fn)
+
+    conn = sqlite3.connect(tmp_fn, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -262144")  # 256MB
+        conn.executescript(schema_sql)
+
+        rowid = 0
+        for resource_fn in resource_fns:
+            count = 0
+            for rows in chunked(iter_rows(resource_fn, conn), batch_size):
+                term_rows = []
+                entity_type_rows = []
+                for (row, entity_types) in rows:
+                    rowid += 1
+                    term_rows.append((rowid,) + row)
+                    entity_type_rows.extend((rowid, entity_type) for entity_type in entity_types)
+
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT INTO terms VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", term_rows
+                )
+                conn.executemany("INSERT INTO term_entity_types VALUES (?, ?)", entity_type_rows)
+                conn.execute("COMMIT")
+                count += len(rows)
+
+            log.info("Loaded namespace terms", resource_fn=resource_fn, terms=count)
+
+        log.info("Creating indexes", terms=rowid)
+        conn.executescript(index_sql)
+        terms = rowid - remove_duplicate_terms(conn)
+
+        log.info("Building full text index", terms=terms)
+        conn.execute("INSERT INTO terms_fts(terms_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO terms_fts(terms_fts) VALUES ('optimize')")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    os.replace(tmp_fn, db_fn)
+
+    log.info("Wrote term search database", db_fn=db_fn, terms=terms)
+
+
+def main(
+    overwrite: bool = Option(False, help="Force overwrite of the search database"),
+    namespace: List[str] = Option(
+        None, help="Namespace resource file(s) to load, e.g. eg - defaults to all namespaces"
+    ),
+):
+
+    resource_fns = get_resource_fns(namespace)
+
+    build_inputs = get_build_inputs("terms_db", resource_fns, __file__, config=namespace)
+
+    if overwrite or needs_rebuild(build_inputs):
+        build_db(resource_fns)
+        save_build_inputs(build_inputs)
+
+
+if __name__ == "__main__":
+    typer.run(main)
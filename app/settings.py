@@ -16,6 +16,46 @@ DOWNLOAD_DIR = os.getenv("BELRES_DOWNLOAD_DIR")
 
 UPDATE_CYCLE_DAYS = os.getenv("UPDATE_CYCLE_DAYS", default=7)
 
+# Concurrent source downloads - per host caps keep us within the providers' connection limits
+DOWNLOAD_WORKERS = int(os.getenv("BELRES_DOWNLOAD_WORKERS", default=8))
+DOWNLOAD_DEFAULT_HOST_LIMIT = int(os.getenv("BELRES_DOWNLOAD_HOST_LIMIT", default=2))
+DOWNLOAD_HOST_LIMITS = {
+    "ftp.ncbi.nlm.nih.gov": 2,
+    "ftp.ncbi.nih.gov": 2,
+    "ftp.ebi.ac.uk": 3,
+    "ftp.uniprot.org": 2,
+    "nlmpubs.nlm.nih.gov": 2,
+    "www.informatics.jax.org": 2,
+}
+# Downloads are resumed from a .partial file after transient errors with exponential backoff
+DOWNLOAD_RETRIES = int(os.getenv("BELRES_DOWNLOAD_RETRIES", default=5))
+DOWNLOAD_RETRY_BACKOFF = int(os.getenv("BELRES_DOWNLOAD_RETRY_BACKOFF", default=10))  # seconds
+DOWNLOAD_TIMEOUT = int(os.getenv("BELRES_DOWNLOAD_TIMEOUT", default=120))  # seconds
+# Total bandwidth ceiling for all concurrent downloads in bytes/sec (0 = unlimited)
+DOWNLOAD_MAX_BYTES_PER_SEC = int(os.getenv("BELRES_DOWNLOAD_MAX_BYTES_PER_SEC", default=0))
+
+# Resource file compression codec: gzip, bgzf (gzip in 64KiB blocks with a .keys term index),
+# zstd (requires zstandard), lz4 (requires lz4) or none
+OUTPUT_CODEC = os.getenv("BELRES_OUTPUT_CODEC", default="gzip")
+# Compression threads shared by a resource file and its subset files - run_all.py splits the
+# cpus between the stages it runs at once
+OUTPUT_THREADS = int(os.getenv("BELRES_OUTPUT_THREADS", default=os.cpu_count() or 1))
+# gzip blocks are compressed in parallel as gzip members
+OUTPUT_GZIP_LEVEL = int(os.getenv("BELRES_OUTPUT_GZIP_LEVEL", default=6))
+OUTPUT_GZIP_BLOCK_SIZE = int(os.getenv("BELRES_OUTPUT_GZIP_BLOCK_SIZE", default=1024 * 1024))
+OUTPUT_ZSTD_LEVEL = int(os.getenv("BELRES_OUTPUT_ZSTD_LEVEL", default=9))
+
+# Memory used by external sorts (e.g. the BGZF term key index) before spilling sorted runs to disk
+SORT_BUFFER_SIZE = int(os.getenv("BELRES_SORT_BUFFER_SIZE", default=256 * 1024 * 1024))
+
+# Optional Parquet export of namespace terms (requires pyarrow) - row groups are sized so that
+# readers can skip most of a namespace using the row group statistics (e.g. on species_key)
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("BELRES_PARQUET_ROW_GROUP_SIZE", default=100_000))
+PARQUET_COMPRESSION = os.getenv("BELRES_PARQUET_COMPRESSION", default="zstd")
+
+# Validate every Nth term record against the Term model while building (0 = off, 1 = every term)
+TERM_VALIDATION_SAMPLE = int(os.getenv("BELRES_TERM_VALIDATION_SAMPLE", default=0))
+
 MAIL_API = os.getenv("BELRES_MAIL_API")
 MAIL_API_KEY = os.getenv("BELRES_MAIL_API_KEY")
 MAIL_FROM = os.getenv("BELRES_MAIL_FROM")
@@ -32,7 +72,20 @@ TAXONOMY_LABELS = yaml.load(
     open(f"{RESOURCES_DIR}/taxonomy_labels.yml", "r").read(), Loader=yaml.SafeLoader
 )
 
-# TODO Not currently used - need to update _hmrz subset to use this for the species_filter
-SPECIES_FILTER = os.getenv("BELRES_SPECIES_FILTER", default=[])
-if SPECIES_FILTER:
-    SPECIES_FILTER = [species.strip() for species in SPECIES_FILTER.split(",")]
+SPECIES_SUBSET_DEFINITIONS = yaml.load(
+    open(f"{RESOURCES_DIR}/species_subsets.yml", "r").read(), Loader=yaml.SafeLoader
+)
+
+# Species subsets written alongside the resource files - all subsets unless
+# BELRES_SPECIES_SUBSETS lists the subset names to write, e.g. hmrz,human.  Clades are
+# expanded to all of their taxa with the taxonomy lineage when the subset files are opened
+SPECIES_SUBSETS = {
+    name: {"species": subset.get("species", []), "clades": subset.get("clades", [])}
+    for (name, subset) in SPECIES_SUBSET_DEFINITIONS.items()
+}
+if os.getenv("BELRES_SPECIES_SUBSETS") is not None:
+    SPECIES_SUBSETS = {
+        name.strip(): SPECIES_SUBSETS[name.strip()]
+        for name in os.getenv("BELRES_SPECIES_SUBSETS").split(",")
+        if name.strip()
+    }
@@ -25,27 +25,9 @@ fi
 source "/home/ubuntu/resources/.venv/bin/activate"
 
 
-# Update Namespaces
-/home/ubuntu/resources/tools/namespaces/tax.py
-/home/ubuntu/resources/tools/namespaces/chebi.py
-# /home/ubuntu/resources/tools/namespaces/chembl.py
-/home/ubuntu/resources/tools/namespaces/do.py
-/home/ubuntu/resources/tools/namespaces/eg.py
-/home/ubuntu/resources/tools/namespaces/go.py
-/home/ubuntu/resources/tools/namespaces/hgnc.py
-/home/ubuntu/resources/tools/namespaces/mesh.py
-/home/ubuntu/resources/tools/namespaces/mgi.py
-/home/ubuntu/resources/tools/namespaces/rgd.py
-/home/ubuntu/resources/tools/namespaces/sp.py
-/home/ubuntu/resources/tools/namespaces/zfin.py
-
-
-# Update Orthologs
-/home/ubuntu/resources/tools/orthologs/eg.py
-
-
-# Update Backbone Nanopubs
-
+# Update Namespaces, Orthologs and Backbone Nanopubs (independent builders run in parallel)
+/home/ubuntu/resources/app/run_all.py
+# /home/ubuntu/resources/app/namespaces/chembl.py
 
 
 # Ping Healthchecks.io
@@ -0,0 +1,53 @@
+import gzip
+import json
+
+import pytest
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.parquet  # noqa: E402
+
+from app.common.columnar import term_schema, write_parquet  # noqa: E402
+
+dictionary_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+
+
+def test_term_schema_dictionary_columns():
+
+    schema = term_schema()
+
+    assert schema.field("namespace").type == dictionary_type
+    assert schema.field("species_key").type == dictionary_type
+    assert schema.field("entity_types").type == pyarrow.list_(dictionary_type)
+    assert schema.field("synonyms").type == pyarrow.list_(pyarrow.string())
+
+
+def test_write_parquet(tmp_path):
+
+    resource_fn = str(tmp_path / "eg.jsonl.gz")
+    records = [
+        {"metadata": {"namespace": "EG"}},
+        {
+            "term": {
+                "key": "EG:207",
+                "namespace": "EG",
+                "id": "207",
+                "species_key": "TAX:9606",
+                "entity_types": ["Gene", "RNA", "Protein"],
+            }
+        },
+        {"term": {"key": "EG:11651", "namespace": "EG", "id": "11651", "species_key": "TAX:10090"}},
+    ]
+    with gzip.open(resource_fn, "wt") as fo:
+        for record in records:
+            fo.write(json.dumps(record) + "\n")
+
+    fn = write_parquet(resource_fn)
+
+    schema = pyarrow.parquet.read_schema(fn)
+    assert schema.field("namespace").type == dictionary_type
+    assert schema.field("species_key").type == dictionary_type
+    assert schema.field("entity_types").type == pyarrow.list_(dictionary_type)
+
+    table = pyarrow.parquet.read_table(fn)
+    assert table.column("entity_types").to_pylist() == [["Gene", "RNA", "Protein"], None]
+    assert table.column("species_key").to_pylist() == ["TAX:9606", "TAX:10090"]
@@ -0,0 +1,75 @@
+import gzip
+import json
+import os
+
+from app.common.delta import delta_release_fn, previous_release_fn, release_delta
+from app.common.writers import open_input
+
+
+def write_release(fn, version, keys):
+
+    with gzip.open(fn, "wt") as fo:
+        fo.write(json.dumps({"metadata": {"namespace": "EG", "version": version}}) + "\n")
+        for key in keys:
+            fo.write(json.dumps({"term": {"key": key, "namespace": "EG", "id": key[3:]}}) + "\n")
+
+
+def read_deltas(fn):
+
+    with open_input(fn) as fi:
+        records = [json.loads(line) for line in fi]
+
+    return sorted((record["delta"]["action"], record["delta"]["key"]) for record in records[1:])
+
+
+def test_release_delta(tmp_path):
+
+    resource_fn = str(tmp_path / "eg.jsonl.gz")
+    write_release(resource_fn, "1", ["EG:1", "EG:2"])
+
+    with release_delta(resource_fn):
+        write_release(resource_fn, "2", ["EG:1", "EG:3"])
+
+    assert read_deltas(delta_release_fn(resource_fn)) == [("added", "EG:3"), ("removed", "EG:2")]
+    assert not os.path.exists(previous_release_fn(resource_fn))
+
+
+def test_release_delta_after_killed_build(tmp_path):
+    """Previous release moved aside by a build that was killed - with and without a partial file"""
+
+    resource_fn = str(tmp_path / "eg.jsonl.gz")
+    previous_fn = previous_release_fn(resource_fn)
+
+    for partial in (False, True):
+        write_release(previous_fn, "1", ["EG:1", "EG:2"])
+        if partial:
+            with open(resource_fn, "wb") as fo:
+                fo.write(b"\x1f\x8b")
+        elif os.path.exists(resource_fn):
+            os.remove(resource_fn)
+
+        with release_delta(resource_fn):
+            write_release(resource_fn, "2", ["EG:1", "EG:3"])
+
+        assert read_deltas(delta_release_fn(resource_fn)) == [
+            ("added", "EG:3"),
+            ("removed", "EG:2"),
+        ]
+        assert not os.path.exists(previous_fn)
+
+
+def test_release_delta_failed_build(tmp_path):
+
+    resource_fn = str(tmp_path / "eg.jsonl.gz")
+    write_release(resource_fn, "1", ["EG:1", "EG:2"])
+
+    try:
+        with release_delta(resource_fn):
+            write_release(resource_fn, "2", ["EG:1"])
+            raise RuntimeError("build failed")
+    except RuntimeError:
+        pass
+
+    with open_input(resource_fn) as fi:
+        assert json.loads(next(fi))["metadata"]["version"] == "1"
+    assert not os.path.exists(previous_release_fn(resource_fn))
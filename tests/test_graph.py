@@ -0,0 +1,43 @@
+import random
+
+from app.common.graph import Dag
+
+
+def brute_force_ancestors(parents, node):
+
+    result = set()
+    stack = list(parents.get(node, ()))
+    while stack:
+        next_node = stack.pop()
+        if next_node not in result:
+            result.add(next_node)
+            stack.extend(parents.get(next_node, ()))
+
+    return result
+
+
+def test_closure_matches_brute_force():
+
+    rng = random.Random(0)
+    for cyclic in (False, True):
+        dag = Dag()
+        for child in range(1, 300):
+            for _ in range(rng.randint(0, 3)):
+                parent = rng.randrange(300 if cyclic else child)
+                if parent != child:
+                    dag.add_edge(child, parent)
+
+        for node in rng.sample(range(300), 300):
+            assert dag.ancestors(node) == brute_force_ancestors(dag.parents, node)
+            assert dag.descendants(node) == brute_force_ancestors(dag.children, node)
+
+
+def test_closure_memoizes_intermediate_nodes():
+
+    dag = Dag()
+    for node in range(1, 100):
+        dag.add_edge(node, node - 1)
+
+    assert dag.ancestors(99) == frozenset(range(99))
+    assert len(dag.ancestor_sets) == 100
+    assert dag.ancestor_sets[50] == frozenset(range(50))
@@ -0,0 +1,30 @@
+import numpy as np
+
+from app.common.gene_history import GeneHistory, compute_gene_history, save_gene_history
+from app.orthologs.eg import iter_pair_lines
+
+
+def gene_orthologs_line(tax_id, gene_id, other_tax_id, other_gene_id):
+
+    return f"{tax_id}\t{gene_id}\tOrtholog\t{other_tax_id}\t{other_gene_id}\n"
+
+
+def test_iter_pair_lines_history(tmp_path):
+
+    # 301 replaced by 101, 302 withdrawn, 303 replaced by 304 replaced by 1
+    old_ids = np.array([301, 302, 303, 304], dtype=np.uint32)
+    new_ids = np.array([101, 0, 304, 1], dtype=np.uint32)
+    save_gene_history(compute_gene_history(old_ids, new_ids), str(tmp_path))
+    history = GeneHistory(str(tmp_path))
+
+    lines = [
+        gene_orthologs_line(9606, 1, 10090, 101),
+        gene_orthologs_line(9606, 2, 10090, 301),  # -> EG:2 - EG:101
+        gene_orthologs_line(9606, 2, 10090, 302),  # withdrawn
+        gene_orthologs_line(10090, 101, 9606, 301),  # -> EG:101 - EG:101 self pair
+        gene_orthologs_line(9606, 1, 10116, 303),  # -> EG:1 - EG:1 through a chain
+    ]
+
+    pairs = [line.decode().split("\t")[:2] for line in iter_pair_lines(lines, history, 2)]
+
+    assert pairs == [["EG:1", "EG:101"], ["EG:101", "EG:2"]]